@@ -0,0 +1,180 @@
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Optional
+from models import (Order, OrderAllocation, OrderProductAllocation, ArchivedOrder,
+                    ArchivedOrderAllocation, ArchivedOrderProductAllocation, ArchiveStat)
+from cache import bump_version
+from transactions import run_transaction
+import queries
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Completed orders older than this many days are moved to the archive tables
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "90"))
+
+# Orders moved per transaction; each batch commits on its own
+ORDER_ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", "1000"))
+
+_ORDER_COLUMNS = [
+    "id", "product_id", "quantity", "status", "created_at", "completed_at",
+    "status_changed_at", "parent_order_id", "location_id", "to_stock"
+]
+_ALLOCATION_COLUMNS = ["id", "order_id", "component_id", "quantity_allocated", "location_id"]
+_PRODUCT_ALLOCATION_COLUMNS = ["id", "order_id", "product_id", "quantity_allocated"]
+
+
+# Hot/cold split for orders. `orders` and `order_allocations` only hold the
+# working set (pending, in progress, recently completed); old completed
+# orders move, with their allocations and the same ids, to archived_orders
+# and archived_order_allocations. Every batch is one transaction that copies
+# and deletes the same rows, so a run can stop at any point and the next
+# one carries on where it left off. archive_stats keeps running totals so
+# order counts never have to scan the archive.
+
+
+def _archivable_ids(db: Session, cutoff: datetime, batch_size: int):
+    return db.execute(queries.archivable_order_ids(cutoff, batch_size).with_for_update()).scalars().all()
+
+
+def _add_to_stats(db: Session, table_name: str, rows: int, now: datetime):
+    changed = db.execute(
+        update(ArchiveStat)
+        .where(ArchiveStat.table_name == table_name)
+        .values(rows_archived=ArchiveStat.rows_archived + rows, last_archived_at=now)
+    ).rowcount
+
+    if not changed:
+        db.execute(insert(ArchiveStat).values(table_name=table_name, rows_archived=rows, last_archived_at=now))
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_size: int = ORDER_ARCHIVE_BATCH_SIZE):
+    """
+    Move one batch of completed orders (completed before `cutoff`) and their
+    allocations to the archive tables and commit.
+
+    Returns (orders_moved, allocations_moved); (0, 0) means nothing is left.
+    """
+    order_ids = _archivable_ids(db, cutoff, batch_size)
+
+    if not order_ids:
+        db.rollback()
+        return 0, 0
+
+    now = datetime.utcnow()
+
+    db.execute(insert(ArchivedOrder).from_select(
+        _ORDER_COLUMNS,
+        select(*(getattr(Order, column) for column in _ORDER_COLUMNS)).where(Order.id.in_(order_ids))
+    ))
+
+    allocations_moved = db.execute(insert(ArchivedOrderAllocation).from_select(
+        _ALLOCATION_COLUMNS,
+        select(*(getattr(OrderAllocation, column) for column in _ALLOCATION_COLUMNS))
+        .where(OrderAllocation.order_id.in_(order_ids))
+    )).rowcount
+
+    product_allocations_moved = db.execute(insert(ArchivedOrderProductAllocation).from_select(
+        _PRODUCT_ALLOCATION_COLUMNS,
+        select(*(getattr(OrderProductAllocation, column) for column in _PRODUCT_ALLOCATION_COLUMNS))
+        .where(OrderProductAllocation.order_id.in_(order_ids))
+    )).rowcount
+
+    db.execute(delete(OrderAllocation).where(OrderAllocation.order_id.in_(order_ids)))
+    db.execute(delete(OrderProductAllocation).where(OrderProductAllocation.order_id.in_(order_ids)))
+    db.execute(delete(Order).where(Order.id.in_(order_ids)))
+
+    _add_to_stats(db, "orders", len(order_ids), now)
+    _add_to_stats(db, "order_allocations", allocations_moved, now)
+    if product_allocations_moved:
+        _add_to_stats(db, "order_product_allocations", product_allocations_moved, now)
+
+    db.commit()
+
+    return len(order_ids), allocations_moved
+
+
+def archive_completed_orders(
+    db: Session,
+    older_than_days: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    max_batches: Optional[int] = None
+):
+    """
+    Archive completed orders older than `older_than_days` in batches.
+
+    Stops when nothing is left or after max_batches; `complete` tells the
+    caller whether another run is needed.
+    """
+    if older_than_days is None:
+        older_than_days = ORDER_ARCHIVE_AFTER_DAYS
+    if batch_size is None:
+        batch_size = ORDER_ARCHIVE_BATCH_SIZE
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    orders_archived = 0
+    allocations_archived = 0
+    batches = 0
+    complete = False
+
+    try:
+        while max_batches is None or batches < max_batches:
+            orders_moved, allocations_moved = run_transaction(db, archive_batch, cutoff, batch_size)
+
+            if not orders_moved:
+                complete = True
+                break
+
+            batches += 1
+            orders_archived += orders_moved
+            allocations_archived += allocations_moved
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        # Earlier batches are committed even if a later one failed
+        if orders_archived:
+            bump_version("orders")
+
+    logger.info("Archived %d orders (%d allocations) in %d batches", orders_archived, allocations_archived, batches)
+
+    return {
+        "cutoff": cutoff,
+        "batches": batches,
+        "orders_archived": orders_archived,
+        "allocations_archived": allocations_archived,
+        "complete": complete
+    }
+
+
+def get_archived_order(db: Session, order_id: int):
+    return db.query(ArchivedOrder).filter(ArchivedOrder.id == order_id).first()
+
+
+def archived_backorder_ids(db: Session, order_id: int):
+    return list(db.execute(
+        select(ArchivedOrder.id).where(ArchivedOrder.parent_order_id == order_id).order_by(ArchivedOrder.id)
+    ).scalars())
+
+
+def archived_count(db: Session, table_name: str = "orders"):
+    """Rows archived so far, from the running totals."""
+    count = db.execute(
+        select(ArchiveStat.rows_archived).where(ArchiveStat.table_name == table_name)
+    ).scalar()
+
+    return int(count or 0)
+
+
+if __name__ == "__main__":
+    # Run from cron: python archive.py
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    session = SessionLocal()
+    try:
+        print(archive_completed_orders(session))
+    finally:
+        session.close()
@@ -0,0 +1,178 @@
+"""
+Benchmark for the fast list serialization path (fast_json.py).
+
+Seeds a scratch database, then builds the GET /components, /products and
+/orders response bodies two ways and times them:
+
+    before  ORM objects -> response_model validation -> jsonable dump -> JSONResponse
+            (what FastAPI does for a route that returns model instances)
+    after   plain rows  -> fast_json.dumps (what the list routes do now)
+
+and fails if the two bodies differ in a single byte.
+
+    python bench_serialization.py                 # 50000 rows each, in-memory SQLite
+    python bench_serialization.py --rows 10000 --repeat 5
+    python bench_serialization.py --db-url sqlite:////tmp/bench.db
+"""
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from datetime import datetime, timedelta
+from typing import List
+from database import Base
+from models import Component, Product, Order, OrderStatus
+from schemas import ComponentResponse, ProductResponse, OrderResponse, OrderSummaryResponse
+import crud_components
+import crud_products
+import crud_orders
+import fast_json
+import stock_slots
+import archive
+import argparse
+import sys
+import time
+
+
+def seed(engine, rows: int):
+    Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        conn.execute(insert(Component), [
+            {"name": f"Component {i} ünïcode", "spillage_coefficient": 0.0125, "in_stock": i, "created_at": now, "updated_at": now}
+            for i in range(1, rows + 1)
+        ])
+        conn.execute(insert(Product), [
+            {"name": f"Product {i}", "in_progress": i % 7, "created_at": now, "updated_at": now}
+            for i in range(1, rows + 1)
+        ])
+        statuses = [OrderStatus.PENDING, OrderStatus.IN_PROGRESS, OrderStatus.COMPLETED]
+        conn.execute(insert(Order), [
+            {
+                "product_id": i % rows + 1,
+                "quantity": i % 50 + 1,
+                "status": statuses[i % 3],
+                "created_at": now - timedelta(minutes=i),
+                "status_changed_at": now,
+                "completed_at": now if i % 3 == 2 else None
+            }
+            for i in range(1, rows + 1)
+        ])
+
+
+def fastapi_body(response_type, content):
+    # fastapi.routing.serialize_response + the default JSONResponse
+    adapter = TypeAdapter(response_type)
+    value = adapter.validate_python(content, from_attributes=True)
+    return JSONResponse(adapter.dump_python(value, mode="json")).body
+
+
+def components_before(db):
+    return fastapi_body(List[ComponentResponse], stock_slots.apply_totals(db, db.query(Component).all()))
+
+
+def components_after(db):
+    return fast_json.dumps(crud_components.get_all_components(db))
+
+
+def products_before(db):
+    return fastapi_body(List[ProductResponse], db.query(Product).all())
+
+
+def products_after(db):
+    return fast_json.dumps(crud_products.get_all_products(db))
+
+
+def orders_before(db):
+    # get_order_summary as it was: ORM orders, lazy product names, one OrderResponse per row
+    orders = db.query(Order).order_by(Order.id).all()
+    archived_count = archive.archived_count(db)
+
+    return fastapi_body(OrderSummaryResponse, {
+        "total_orders": len(orders) + archived_count,
+        "pending": sum(1 for o in orders if o.status == OrderStatus.PENDING),
+        "in_progress": sum(1 for o in orders if o.status == OrderStatus.IN_PROGRESS),
+        "completed": sum(1 for o in orders if o.status == OrderStatus.COMPLETED) + archived_count,
+        "archived": archived_count,
+        "orders": [
+            OrderResponse(
+                id=order.id,
+                product_id=order.product_id,
+                product_name=order.product.name,
+                quantity=order.quantity,
+                status=order.status.value,
+                created_at=order.created_at,
+                completed_at=order.completed_at,
+                parent_order_id=order.parent_order_id,
+                location_id=order.location_id,
+                to_stock=order.to_stock
+            )
+            for order in orders
+        ]
+    })
+
+
+def orders_after(db):
+    return fast_json.dumps(crud_orders.get_order_summary(db))
+
+
+def timed(Session, build, repeat: int):
+    best = None
+    body = None
+
+    for _ in range(repeat):
+        # A fresh session each time, so ORM hydration is measured too
+        db = Session()
+        try:
+            started = time.perf_counter()
+            body = build(db)
+            elapsed = time.perf_counter() - started
+        finally:
+            db.close()
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare list response serialization before/after fast_json.")
+    parser.add_argument("--rows", type=int, default=50000, help="rows per table (default 50000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, best is reported (default 3)")
+    parser.add_argument("--db-url", default="sqlite://", help="scratch database (default: in-memory SQLite)")
+    args = parser.parse_args()
+
+    if args.db_url.startswith("sqlite"):
+        engine = create_engine(args.db_url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        engine = create_engine(args.db_url)
+
+    seed(engine, args.rows)
+    Session = sessionmaker(bind=engine)
+
+    print(f"encoder: {'orjson' if fast_json.orjson is not None else 'json (orjson not installed)'}, {args.rows} rows")
+    mismatches = 0
+
+    for name, before, after in [
+        ("GET /components", components_before, components_after),
+        ("GET /products", products_before, products_after),
+        ("GET /orders", orders_before, orders_after),
+    ]:
+        before_seconds, before_body = timed(Session, before, args.repeat)
+        after_seconds, after_body = timed(Session, after, args.repeat)
+        same = before_body == after_body
+        mismatches += not same
+
+        print(
+            f"{name:<16} before {before_seconds * 1000:8.1f} ms   after {after_seconds * 1000:8.1f} ms   "
+            f"x{before_seconds / after_seconds:5.1f}   {len(after_body) / 1e6:6.2f} MB   "
+            f"{'identical' if same else 'BODIES DIFFER'}"
+        )
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
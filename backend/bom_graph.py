@@ -0,0 +1,372 @@
+from sqlalchemy import select, func, text, literal
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from models import Component, ComponentLocation, Product, BillOfMaterials, ProductBOM, OrderStatus
+from decimal import Decimal
+import math
+import stock_slots
+
+
+# All BOM lines reachable from one product, fetched in a single round-trip.
+# The recursive part only walks product_bom; component lines and nested
+# product lines for every reachable product are joined on afterwards.
+PRODUCT_TREE_SQL = text("""
+    WITH RECURSIVE reachable (product_id, depth) AS (
+        SELECT id, 0 FROM products WHERE id = :product_id
+        UNION
+        SELECT pb.child_product_id, r.depth + 1
+        FROM product_bom pb
+        JOIN reachable r ON pb.parent_product_id = r.product_id
+        WHERE r.depth < :max_depth
+    )
+    SELECT 'root' AS kind, 0 AS line_id, NULL AS parent_id, p.id AS node_id, p.name AS name,
+           1 AS quantity_required, NULL AS spillage_coefficient, p.in_stock AS in_stock
+    FROM products p
+    WHERE p.id = :product_id
+    UNION ALL
+    SELECT 'product', pb.id, pb.parent_product_id, p.id, p.name,
+           pb.quantity_required, NULL, p.in_stock
+    FROM product_bom pb
+    JOIN products p ON p.id = pb.child_product_id
+    WHERE pb.parent_product_id IN (SELECT product_id FROM reachable)
+    UNION ALL
+    SELECT 'component', b.id, b.product_id, c.id, c.name,
+           b.quantity_required, c.spillage_coefficient,
+           c.in_stock + CASE WHEN c.stock_slots > 0 THEN (
+               SELECT COALESCE(SUM(s.in_stock), 0) FROM component_stock_slots s WHERE s.component_id = c.id
+           ) ELSE 0 END + (
+               SELECT COALESCE(SUM(l.in_stock), 0) FROM component_locations l WHERE l.component_id = c.id
+           )
+    FROM bill_of_materials b
+    JOIN components c ON c.id = b.component_id
+    WHERE b.product_id IN (SELECT product_id FROM reachable)
+    ORDER BY line_id
+""")
+
+
+class BOMGraph:
+    """
+    In-memory snapshot of components, products and both BOM tables.
+
+    Loaded with one query per table, so reports that need the whole catalog
+    (capacity, procurement, dashboard) never issue per-line lazy loads.
+    The math mirrors calculate_total_components_recursive and the original
+    capacity calculation exactly, including per-level spillage rounding.
+
+    Products carry their finished stock (in_stock). explode() ignores it;
+    explode_from_stock() and the reports take nested products from it
+    first, as allocation does, and only explode the remainder.
+    """
+
+    def __init__(self, components, products, component_lines, product_lines):
+        self.components = {row["id"]: dict(row) for row in components}
+        self.products = {row["id"]: dict(row) for row in products}
+
+        # product_id -> [(component_id, quantity_required)]
+        self.component_bom = {}
+        for product_id, component_id, quantity_required in component_lines:
+            self.component_bom.setdefault(product_id, []).append((component_id, quantity_required))
+
+        # parent_product_id -> [(child_product_id, quantity_required)]
+        self.product_bom = {}
+        for parent_id, child_id, quantity_required in product_lines:
+            self.product_bom.setdefault(parent_id, []).append((child_id, quantity_required))
+
+        self._explosions = {}
+        self._max_producible = {}
+
+    @classmethod
+    def load(cls, db: Session, location_id=None):
+        """
+        Snapshot of the whole catalog. With a location_id, component counters
+        are that site's stock only (0 where the site holds none), and product
+        stock, which is not kept per site, counts as 0.
+        """
+        if location_id is None:
+            counters = [stock_slots.total_column(field).label(field) for field in stock_slots.COUNTERS]
+            source = Component
+        else:
+            site = ComponentLocation.__table__
+            counters = [func.coalesce(site.c[field], 0).label(field) for field in stock_slots.COUNTERS]
+            source = Component.__table__.outerjoin(
+                site, (site.c.component_id == Component.id) & (site.c.location_id == location_id)
+            )
+
+        components = db.execute(
+            select(Component.id, Component.name, Component.spillage_coefficient, *counters)
+            .select_from(source)
+            .order_by(Component.id)
+        ).mappings().all()
+
+        product_stock = Product.in_stock if location_id is None else literal(0).label("in_stock")
+
+        products = db.execute(
+            select(Product.id, Product.name, product_stock, Product.in_progress, Product.shipped).order_by(Product.id)
+        ).mappings().all()
+
+        component_lines = db.execute(
+            select(
+                BillOfMaterials.product_id, BillOfMaterials.component_id, BillOfMaterials.quantity_required
+            ).order_by(BillOfMaterials.id)
+        ).all()
+
+        product_lines = db.execute(
+            select(
+                ProductBOM.parent_product_id, ProductBOM.child_product_id, ProductBOM.quantity_required
+            ).order_by(ProductBOM.id)
+        ).all()
+
+        return cls(components, products, component_lines, product_lines)
+
+    @classmethod
+    def load_product(cls, db: Session, product_id: int):
+        """
+        Snapshot of just the part of the catalog one product is built from.
+
+        Uses the same single recursive query as the product tree endpoint, so
+        per-order work does not pay for loading the whole catalog.
+        """
+        rows = db.execute(PRODUCT_TREE_SQL, {"product_id": product_id, "max_depth": 11}).mappings().all()
+
+        components = {}
+        products = {}
+        component_lines = []
+        product_lines = []
+
+        for row in rows:
+            if row["kind"] == "component":
+                components[row["node_id"]] = {
+                    "id": row["node_id"],
+                    "name": row["name"],
+                    "spillage_coefficient": Decimal(str(row["spillage_coefficient"])),
+                    "in_stock": row["in_stock"]
+                }
+                component_lines.append((row["parent_id"], row["node_id"], row["quantity_required"]))
+            else:
+                products[row["node_id"]] = {"id": row["node_id"], "name": row["name"], "in_stock": row["in_stock"]}
+                if row["kind"] == "product":
+                    product_lines.append((row["parent_id"], row["node_id"], row["quantity_required"]))
+
+        return cls(components.values(), products.values(), component_lines, product_lines)
+
+    def explode(self, product_id: int, quantity: int, depth=0):
+        """
+        Total component requirements (with spillage) for `quantity` units of a product.
+
+        Returns {component_id: units_needed}. Results are memoised per
+        (product_id, quantity) for the lifetime of the snapshot.
+        """
+        if depth > 10:
+            raise HTTPException(400, "BOM nesting too deep (max 10 levels)")
+
+        key = (product_id, quantity)
+        cached = self._explosions.get(key)
+
+        if cached is None:
+            total_components = self._direct_components(product_id, quantity)
+
+            for child_id, quantity_required in self.product_bom.get(product_id, ()):
+                sub_components = self.explode(child_id, quantity_required * quantity, depth + 1)
+
+                for component_id, component_qty in sub_components.items():
+                    total_components[component_id] = total_components.get(component_id, 0) + component_qty
+
+            cached = self._explosions[key] = total_components
+
+        return dict(cached)
+
+    def _direct_components(self, product_id: int, quantity: int):
+        # The product's own component lines, each rounded up on its own
+        total_components = {}
+
+        for component_id, quantity_required in self.component_bom.get(product_id, ()):
+            spillage_multiplier = Decimal("1") + self.components[component_id]["spillage_coefficient"]
+            exact_per_unit = Decimal(str(quantity_required)) * spillage_multiplier
+            exact_total = exact_per_unit * Decimal(str(quantity))
+            needed = math.ceil(float(exact_total))
+
+            total_components[component_id] = total_components.get(component_id, 0) + needed
+
+        return total_components
+
+    def product_stock(self):
+        """{product_id: finished units in stock}, for products that have any."""
+        return {product_id: product["in_stock"] for product_id, product in self.products.items() if product.get("in_stock")}
+
+    def explode_from_stock(self, product_id: int, quantity: int, product_stock: dict, depth=0):
+        """
+        Like explode(), but nested products are taken from `product_stock`
+        ({product_id: units}, see product_stock()) before anything is built;
+        only the remainder of each line is exploded. The product itself is
+        always built.
+
+        Returns ({component_id: units_needed}, {product_id: units_from_stock})
+        and takes the units out of `product_stock`, so successive calls (one
+        per order) share the stock.
+        """
+        if depth > 10:
+            raise HTTPException(400, "BOM nesting too deep (max 10 levels)")
+
+        total_components = self._direct_components(product_id, quantity)
+        from_stock = {}
+
+        for child_id, quantity_required in self.product_bom.get(product_id, ()):
+            needed = quantity_required * quantity
+            taken = min(needed, product_stock.get(child_id, 0))
+
+            if taken:
+                product_stock[child_id] -= taken
+                if not product_stock[child_id]:
+                    del product_stock[child_id]
+                from_stock[child_id] = from_stock.get(child_id, 0) + taken
+
+            if needed == taken:
+                continue
+
+            # Nothing left on the shelf: the memoised plain explosion is the answer
+            if product_stock:
+                sub_components, sub_from_stock = self.explode_from_stock(child_id, needed - taken, product_stock, depth + 1)
+            else:
+                sub_components, sub_from_stock = self.explode(child_id, needed - taken, depth + 1), {}
+
+            for component_id, component_qty in sub_components.items():
+                total_components[component_id] = total_components.get(component_id, 0) + component_qty
+            for sub_product_id, sub_qty in sub_from_stock.items():
+                from_stock[sub_product_id] = from_stock.get(sub_product_id, 0) + sub_qty
+
+        return total_components, from_stock
+
+    def max_buildable(self, product_id: int, quantity: int, stock: dict, product_stock: dict = None):
+        """
+        Largest n <= quantity whose explosion fits in `stock` ({component_id: units}),
+        after taking nested products from `product_stock` when given.
+
+        Per-line rounding makes requirements non-linear in n but still
+        monotonic, so a binary search over explode() finds the exact answer.
+        """
+        def fits(units):
+            if product_stock:
+                requirements, _ = self.explode_from_stock(product_id, units, dict(product_stock))
+            else:
+                requirements = self.explode(product_id, units)
+            return all(stock.get(component_id, 0) >= needed for component_id, needed in requirements.items())
+
+        low, high = 0, quantity
+        while low < high:
+            middle = (low + high + 1) // 2
+            if fits(middle):
+                low = middle
+            else:
+                high = middle - 1
+
+        return low
+
+    def max_producible(self, product_id: int, depth=0):
+        """
+        Max producible units for a product from current component stock,
+        counting finished stock of nested products as available units.
+
+        Returns: (max_units, limiting_factor_name)
+        """
+        if depth > 10:
+            return (0, "Nesting too deep")
+
+        key = (product_id, depth)
+        if key in self._max_producible:
+            return self._max_producible[key]
+
+        component_lines = self.component_bom.get(product_id, [])
+        product_lines = self.product_bom.get(product_id, [])
+
+        if not component_lines and not product_lines:
+            return (0, "No BOM defined")
+
+        max_quantities = []
+
+        for component_id, quantity_required in component_lines:
+            component = self.components[component_id]
+            spillage_multiplier = Decimal("1") + component["spillage_coefficient"]
+            required_per_unit = Decimal(str(quantity_required)) * spillage_multiplier
+
+            if required_per_unit > 0:
+                max_units = int(Decimal(str(component["in_stock"])) / required_per_unit)
+            else:
+                max_units = 0
+
+            max_quantities.append((component["name"], max_units))
+
+        for child_id, quantity_required in product_lines:
+            child_max, _ = self.max_producible(child_id, depth + 1)
+            child_units = child_max + self.products[child_id].get("in_stock", 0)
+            max_units = child_units // quantity_required if quantity_required > 0 else 0
+
+            max_quantities.append((f"{self.products[child_id]['name']} (nested product)", max_units))
+
+        # The limiting factor is the minimum (first one wins on ties)
+        limiting_name, limiting_units = min(max_quantities, key=lambda x: x[1])
+        result = self._max_producible[key] = (limiting_units, limiting_name)
+
+        return result
+
+    def production_capacity(self):
+        capacity_list = []
+
+        for product in self.products.values():
+            max_producible, limiting_component = self.max_producible(product["id"])
+
+            capacity_list.append({
+                "id": product["id"],
+                "name": product["name"],
+                "in_stock": product["in_stock"],
+                "in_progress": product["in_progress"],
+                "shipped": product["shipped"],
+                "max_producible": max_producible,
+                "limiting_component": limiting_component
+            })
+
+        return capacity_list
+
+    def procurement_needs(self, open_orders):
+        """
+        Component shortages for the pending orders in `open_orders`.
+
+        `open_orders` is an iterable of (product_id, quantity, status) rows.
+        Finished subassembly stock is handed to the orders in that sequence
+        before their remainder is exploded.
+        """
+        component_needs = {}
+        product_stock = self.product_stock()
+
+        for product_id, quantity, status in open_orders:
+            if status != OrderStatus.PENDING:
+                continue
+
+            requirements, _ = self.explode_from_stock(product_id, quantity, product_stock)
+
+            for component_id, needed_qty in requirements.items():
+                if component_id not in component_needs:
+                    component_needs[component_id] = {"total_needed": 0, "orders_count": 0}
+
+                component_needs[component_id]["total_needed"] += needed_qty
+                component_needs[component_id]["orders_count"] += 1
+
+        procurement_list = []
+
+        for component_id, data in component_needs.items():
+            component = self.components[component_id]
+            shortage = data["total_needed"] - component["in_stock"]
+
+            if shortage > 0:
+                procurement_list.append({
+                    "component_id": component_id,
+                    "component_name": component["name"],
+                    "in_stock": component["in_stock"],
+                    "total_needed": data["total_needed"],
+                    "shortage": shortage,
+                    "orders_affected": data["orders_count"]
+                })
+
+        return {
+            "components_to_order": procurement_list,
+            "total_items": len(procurement_list)
+        }
@@ -0,0 +1,268 @@
+from collections import OrderedDict
+from sqlalchemy import text, bindparam
+from sqlalchemy.exc import IntegrityError
+from database import engine
+from transactions import defer_until_commit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Entity groups whose versions are tracked. Each crud_* write bumps the groups
+# it touched, so a result computed at version N stays valid until the next write.
+# "catalog" covers definitions only (names, spillage, BOMs), not stock or orders.
+ENTITY_GROUPS = ("components", "products", "orders", "catalog")
+
+# Other workers publish their writes through the cache_versions table. Each
+# worker re-reads it at most this often, which bounds cross-worker staleness.
+CACHE_POLL_SECONDS = float(os.getenv("CACHE_POLL_SECONDS", "1"))
+
+# Upper bound on the age of any version-keyed cache entry, so a write whose
+# publish failed cannot keep other workers on stale results for long
+CACHE_MAX_AGE_SECONDS = float(os.getenv("CACHE_MAX_AGE_SECONDS", "300"))
+
+_version_lock = threading.Lock()
+_poll_lock = threading.Lock()
+
+# Writes made by this worker (visible immediately)
+_local_versions = dict.fromkeys(ENTITY_GROUPS, 0)
+
+# Last values read from cache_versions (writes made by any worker)
+_shared_versions = dict.fromkeys(ENTITY_GROUPS, 0)
+_last_poll = 0.0
+_polled_once = False
+
+# Versions this worker's own bumps produced and no poll has passed yet, to
+# tell remote writes apart. Recorded inside the publishing transaction, so
+# a poll can never see one of our versions before it is known to be ours.
+_own_versions = {group: set() for group in ENTITY_GROUPS}
+
+# Remote writes seen per group, ever increasing. Consumers that need to
+# know what changed (the event broker) keep their own copy to compare.
+_remote_writes = dict.fromkeys(ENTITY_GROUPS, 0)
+
+
+def bump_version(*groups):
+    """
+    Record a committed write to the given entity groups (all groups if none given).
+    """
+    # Inside deferred_commit() the write is not committed yet
+    if defer_until_commit(bump_version, *groups):
+        return
+
+    groups = groups or ENTITY_GROUPS
+
+    with _version_lock:
+        for group in groups:
+            _local_versions[group] += 1
+
+    published = []
+
+    try:
+        try:
+            _publish(groups, published)
+        except IntegrityError:
+            # Another worker created a missing row first; it exists now
+            _publish(groups, published)
+    except Exception as e:
+        with _version_lock:
+            for group, version in published:
+                _own_versions[group].discard(version)
+
+        # Local caches are already invalidated; other workers refresh on CACHE_MAX_AGE_SECONDS
+        logger.warning("Could not publish cache invalidation for %s: %s", ", ".join(groups), e)
+
+
+def _publish(groups, published):
+    with engine.begin() as conn:
+        conn.execute(
+            text("UPDATE cache_versions SET version = version + 1 WHERE entity_group = :group"),
+            [{"group": group} for group in groups]
+        )
+
+        # Our UPDATE holds the row locks, so these are exactly our new versions
+        rows = conn.execute(
+            text("SELECT entity_group, version FROM cache_versions WHERE entity_group IN :groups").bindparams(
+                bindparam("groups", expanding=True)
+            ),
+            {"groups": list(groups)}
+        ).all()
+
+        # Databases built with create_all() lack schema.sql's seed rows
+        missing = set(groups) - {group for group, _ in rows}
+        if missing:
+            conn.execute(
+                text("INSERT INTO cache_versions (entity_group, version) VALUES (:group, 1)"),
+                [{"group": group} for group in sorted(missing)]
+            )
+            rows = [*rows, *((group, 1) for group in sorted(missing))]
+
+        with _version_lock:
+            for group, version in rows:
+                _own_versions[group].add(version)
+                published.append((group, version))
+
+
+def poll_versions(force: bool = False):
+    """
+    Refresh the shared versions from cache_versions (rate limited unless forced).
+    """
+    global _last_poll, _polled_once
+
+    if not force and time.monotonic() - _last_poll < CACHE_POLL_SECONDS:
+        return
+
+    # Only one thread per worker polls; the others keep using the current versions
+    if not _poll_lock.acquire(blocking=False):
+        return
+
+    try:
+        _last_poll = time.monotonic()
+
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT entity_group, version FROM cache_versions")).all()
+
+        with _version_lock:
+            for group, version in rows:
+                if group not in _shared_versions:
+                    continue
+
+                own = _own_versions[group]
+                remote_writes = version - _shared_versions[group] - sum(
+                    1 for own_version in own if _shared_versions[group] < own_version <= version
+                )
+                if _polled_once and remote_writes > 0:
+                    _remote_writes[group] += remote_writes
+
+                _shared_versions[group] = version
+                _own_versions[group] = {own_version for own_version in own if own_version > version}
+
+            _polled_once = True
+    except Exception as e:
+        logger.warning("Could not poll cache_versions: %s", e)
+    finally:
+        _poll_lock.release()
+
+
+def remote_changes(seen=None):
+    """
+    Poll now and return (groups another worker changed since `seen`, new seen).
+
+    `seen` is the second value of an earlier call (None to start), so each
+    caller tracks its own position and polls made elsewhere (e.g. by
+    current_version()) do not hide changes from it.
+    """
+    poll_versions(force=True)
+
+    with _version_lock:
+        now = dict(_remote_writes)
+
+    if seen is None:
+        return set(), now
+
+    return {group for group, count in now.items() if count != seen.get(group, 0)}, now
+
+
+def current_version(*groups):
+    """
+    Version key for the given entity groups (all groups if none given).
+
+    Combines the shared counters with this worker's own writes, so a local
+    write invalidates immediately and a remote one within CACHE_POLL_SECONDS.
+    """
+    poll_versions()
+    groups = groups or ENTITY_GROUPS
+
+    with _version_lock:
+        return tuple((_shared_versions[group], _local_versions[group]) for group in groups)
+
+
+def shared_version(*groups):
+    """
+    Version key from the cache_versions counters only, read fresh.
+
+    Unlike current_version() it is the same on every worker, so it can name
+    a data version across workers (e.g. to share one background report run).
+    """
+    poll_versions(force=True)
+    groups = groups or ENTITY_GROUPS
+
+    with _version_lock:
+        return tuple(_shared_versions[group] for group in groups)
+
+
+def expired(cached_at: float):
+    """True once a version-keyed entry made at `cached_at` (monotonic) is past CACHE_MAX_AGE_SECONDS."""
+    return time.monotonic() - cached_at >= CACHE_MAX_AGE_SECONDS
+
+
+class ReportCache:
+    """
+    LRU cache for computed reports keyed by (report, entity group versions).
+
+    Entries for older versions are never served again and simply age out
+    of the LRU as new versions are cached. Entries are also recomputed
+    after CACHE_MAX_AGE_SECONDS, in case a version bump was lost.
+    
+    `compute` must read the primary: the versions come from the primary,
+    so a result computed on a lagging replica would be filed under a
+    version it does not reflect.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, report: str, compute, *args, groups=ENTITY_GROUPS):
+        # Read the version BEFORE computing: a write that lands mid-computation
+        # leaves the result filed under the old version, never the new one
+        key = (report, current_version(*groups))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not expired(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        cached_at = time.monotonic()
+        result = compute(*args)
+
+        with self._lock:
+            self._entries[key] = (cached_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with _version_lock:
+            versions = dict(_shared_versions)
+            local_writes = dict(_local_versions)
+
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "versions": versions,
+                "local_writes": local_writes,
+                "entries": len(self._entries),
+                "max_entries": self.maxsize,
+                "max_age_seconds": CACHE_MAX_AGE_SECONDS,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+report_cache = ReportCache(maxsize=int(os.getenv("REPORT_CACHE_SIZE", "64")))
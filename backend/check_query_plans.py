@@ -0,0 +1,210 @@
+"""
+Query plan regression check for the hot CRUD queries.
+
+Runs EXPLAIN for each query below (the statements the app runs, built by
+queries.py) against the configured database (DB_URL or the DB_* settings)
+and fails when one of them reads a guarded table with a full table scan,
+i.e. when the managed indexes in schema.sql / models.py no longer cover
+it. Run it before deploy against a scratch database:
+
+    python check_query_plans.py --seed      # create tables and load synthetic data first
+    python check_query_plans.py             # database already has data
+    python check_query_plans.py --verbose   # print every plan
+
+Exit status is 1 if any hot query falls back to a full scan. Supports MySQL
+(EXPLAIN) and SQLite (EXPLAIN QUERY PLAN).
+"""
+from sqlalchemy import select, insert, func, text
+from sqlalchemy.orm import with_parent
+from datetime import datetime, timedelta
+from database import engine, Base
+from models import Component, Product, BillOfMaterials, ProductBOM, Order, OrderAllocation, OrderStatus
+import archive
+import queries
+import argparse
+import random
+import sys
+
+
+def _lazy_load(relationship, parent):
+    """The SELECT the ORM issues when `relationship` is loaded from `parent`."""
+    return select(relationship.property.mapper.class_).where(with_parent(parent, relationship))
+
+
+def _foreign_key_check(column, value):
+    """The child-row lookup the database runs for a foreign key on `column` when a parent row is deleted."""
+    return select(func.count()).select_from(column.table).where(column == value)
+
+
+def hot_queries(sample):
+    """
+    (name, statement, guarded tables) for the queries the crud_* modules
+    run on every request or report. The statements come from the builders
+    in queries.py that those modules execute, or are derived from the
+    models (relationship loads, foreign key checks), so they cannot drift.
+    """
+    return [
+        ("pending queue (feasibility)", queries.pending_orders("fifo"), ["orders"]),
+        ("pending queue, smallest first (feasibility)", queries.pending_orders("smallest_first"), ["orders"]),
+        ("pending orders at a site (procurement)", queries.pending_demand(1), ["orders"]),
+        ("open orders (dashboard)", queries.open_orders(), ["orders"]),
+        ("order status counts", queries.order_status_counts(), ["orders"]),
+        ("order delta sync", queries.order_summaries(sample["since"]), ["orders"]),
+        ("orders of a product (delete_product)", queries.product_order_count(sample["product_id"]), ["orders"]),
+        ("backorders of an order", _lazy_load(Order.backorders, Order(id=sample["order_id"])), ["orders"]),
+        (
+            "archive candidates (archive.py)",
+            queries.archivable_order_ids(sample["cutoff"], archive.ORDER_ARCHIVE_BATCH_SIZE),
+            ["orders", "backorder"]
+        ),
+        ("allocations of an order", _lazy_load(Order.allocations, Order(id=sample["order_id"])), ["order_allocations"]),
+        ("allocation sums for a batch (complete_orders)", queries.allocation_sums(sample["order_ids"]), ["order_allocations"]),
+        (
+            "allocations of a component (foreign key check)",
+            _foreign_key_check(OrderAllocation.component_id, sample["component_id"]),
+            ["order_allocations"]
+        ),
+        ("BOM lines using a component (delete_component)", queries.component_bom_lines(sample["component_id"]), ["bill_of_materials"]),
+        ("BOM lines of a product", queries.product_bom_lines(sample["product_id"]), ["bill_of_materials"]),
+        (
+            "products using a product (foreign key check)",
+            _foreign_key_check(ProductBOM.child_product_id, sample["product_id"]),
+            ["product_bom"]
+        ),
+        ("deletions since (delta sync)", queries.deleted_entities(sample["since"]), ["deleted_entities"]),
+        ("deletions of a type since (delta sync)", queries.deleted_entities(sample["since"], "component"), ["deleted_entities"]),
+    ]
+
+
+def _full_scans(conn, statement, guarded):
+    """Plan rows of `statement` plus the guarded tables it reads with a full scan."""
+    # Literal values keep the plan independent of the driver's parameter style
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    rows = conn.exec_driver_sql(prefix + sql.replace("%", "%%") if conn.dialect.name == "mysql" else prefix + sql).all()
+    scans = []
+
+    for row in rows:
+        if conn.dialect.name == "sqlite":
+            detail = row[3]
+            words = detail.split()
+            # "SCAN orders" is a table scan; "SCAN orders USING [COVERING] INDEX" walks an index
+            if words[0] == "SCAN" and "USING" not in words:
+                table = words[-1] if "AS" in words else words[1]
+                if table in guarded:
+                    scans.append(table)
+        else:
+            mapping = row._mapping
+            table = mapping["table"] or ""
+            if mapping["type"] == "ALL" and table in guarded:
+                scans.append(table)
+
+    return rows, scans
+
+
+def seed(orders: int):
+    """Create the tables and fill an empty database with synthetic data."""
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        if conn.execute(select(func.count(Order.id))).scalar() or conn.execute(select(func.count(Component.id))).scalar():
+            sys.exit("--seed needs an empty scratch database")
+
+        conn.execute(insert(Component), [
+            {"name": f"Component {i}", "spillage_coefficient": 0.05, "in_stock": 100000} for i in range(1, 201)
+        ])
+        conn.execute(insert(Product), [{"name": f"Product {i}"} for i in range(1, 51)])
+
+        conn.execute(insert(BillOfMaterials), [
+            {"product_id": product_id, "component_id": component_id, "quantity_required": rng.randint(1, 6)}
+            for product_id in range(1, 51)
+            for component_id in rng.sample(range(1, 201), 6)
+        ])
+        conn.execute(insert(ProductBOM), [
+            {"parent_product_id": product_id, "child_product_id": product_id - 40, "quantity_required": 2}
+            for product_id in range(41, 51)
+        ])
+
+        # Mostly completed orders over the last ~95 days, a small open queue
+        order_rows = []
+        for order_id in range(1, orders + 1):
+            created_at = now - timedelta(minutes=rng.randint(0, 95 * 24 * 60))
+            roll = rng.random()
+            status = OrderStatus.PENDING if roll < 0.02 else OrderStatus.IN_PROGRESS if roll < 0.05 else OrderStatus.COMPLETED
+            order_rows.append({
+                "id": order_id,
+                "product_id": rng.randint(1, 50),
+                "quantity": rng.randint(1, 20),
+                "status": status,
+                "created_at": created_at,
+                "status_changed_at": created_at,
+                "completed_at": created_at + timedelta(days=1) if status == OrderStatus.COMPLETED else None,
+                "parent_order_id": order_id - 1 if order_id > 1 and rng.random() < 0.01 else None
+            })
+        conn.execute(insert(Order), order_rows)
+
+        conn.execute(insert(OrderAllocation), [
+            {"order_id": row["id"], "component_id": component_id, "quantity_allocated": rng.randint(1, 100)}
+            for row in order_rows if row["status"] != OrderStatus.PENDING
+            for component_id in rng.sample(range(1, 201), 3)
+        ])
+
+        # InnoDB would refresh these on its own, just not before we EXPLAIN. SQLite
+        # databases are never ANALYZEd by the app, so they are checked without stats.
+        if conn.dialect.name == "mysql":
+            conn.execute(text("ANALYZE TABLE orders, order_allocations, bill_of_materials, product_bom"))
+
+    print(f"Seeded {orders} orders")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when a hot query falls back to a full table scan.")
+    parser.add_argument("--seed", action="store_true", help="create tables and load synthetic data into an empty database first")
+    parser.add_argument("--orders", type=int, default=20000, help="orders to seed (default 20000)")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    if engine.dialect.name not in ("mysql", "sqlite"):
+        sys.exit(f"Unsupported database: {engine.dialect.name}")
+
+    if args.seed:
+        seed(args.orders)
+
+    failures = 0
+
+    with engine.connect() as conn:
+        order_ids = conn.execute(
+            select(OrderAllocation.order_id).distinct().order_by(OrderAllocation.order_id.desc()).limit(50)
+        ).scalars().all()
+
+        sample = {
+            "order_id": order_ids[0] if order_ids else 1,
+            "order_ids": order_ids or [1],
+            "component_id": conn.execute(select(func.min(Component.id))).scalar() or 1,
+            "product_id": conn.execute(select(func.min(Product.id))).scalar() or 1,
+            "since": datetime.utcnow() - timedelta(hours=1),
+            "cutoff": datetime.utcnow() - timedelta(days=90)
+        }
+
+        for name, statement, guarded in hot_queries(sample):
+            rows, scans = _full_scans(conn, statement, guarded)
+
+            if scans:
+                failures += 1
+                print(f"FULL SCAN  {name}: {', '.join(scans)}")
+            else:
+                print(f"ok         {name}")
+
+            if args.verbose or scans:
+                for row in rows:
+                    print(f"           {tuple(row)}")
+
+    if failures:
+        print(f"\n{failures} hot queries fall back to a full table scan")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,59 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+from typing import Optional
 from fastapi import HTTPException
-from models import Component
-from schemas import ComponentCreate, ComponentUpdate
+from models import Component, Location, DeletedEntity
+from schemas import ComponentCreate, ComponentUpdate, ComponentResponse, ListFilters
+from cache import bump_version
+from events import broker, component_stock_event, deleted_event
+from listing import apply_list_filters
+from fast_json import row_dicts
+from transactions import raise_if_retryable
+import stock_slots
+import versioning
+import stock_locations
+import queries
 
-def get_all_components(db: Session):
-    return db.query(Component).all()
+# ComponentResponse fields, in order; list rows are built straight from these columns
+_LIST_FIELDS = list(ComponentResponse.model_fields)
+
+
+def get_all_components(db: Session, updated_since: Optional[datetime] = None, filters: Optional[ListFilters] = None):
+    """
+    Components as plain dicts in ComponentResponse field order (no ORM
+    objects), ready for fast_json. Counters are the totals, as everywhere.
+    """
+    query = db.query(*(getattr(Component, field) for field in _LIST_FIELDS), Component.stock_slots)
+    
+    # Delta sync: only rows changed at or after the client's last sync point
+    if updated_since is not None:
+        query = query.filter(stock_slots.changed_since(updated_since)).order_by(Component.updated_at, Component.id)
+    
+    if filters is not None:
+        query = apply_list_filters(db, query, Component, filters)
+    
+    rows = query.all()
+    components = row_dicts(rows, _LIST_FIELDS)
+    
+    # Same totals as stock_slots.apply_totals: slot rows of sharded components plus site stock
+    slots = stock_slots.slot_sums(db, [row.id for row in rows if row.stock_slots])
+    locations = stock_slots.location_sums(db, [row.id for row in rows])
+    
+    for component in components:
+        for extra in (slots.get(component["id"]), locations.get(component["id"])):
+            if extra:
+                for field in stock_slots.COUNTERS:
+                    component[field] += extra.get(field, 0)
+    
+    return components
 
 
 def get_component_by_id(db: Session, component_id: int):
-    return db.query(Component).filter(Component.id == component_id).first()
+    component = db.query(Component).filter(Component.id == component_id).first()
+    stock_slots.apply_totals(db, [component])
+    return component
 
 
 def create_component(db: Session, component: ComponentCreate):
@@ -25,7 +69,9 @@ def create_component(db: Session, component: ComponentCreate):
     try:
         db.add(new_component)       # Stage for insert
         db.commit()                 # Write to database
+        bump_version("components", "catalog")
         db.refresh(new_component)   # Get auto-generated values
+        broker.publish(*component_stock_event(new_component))
         return new_component
     except IntegrityError as e:
         db.rollback()  # Undo staged changes
@@ -41,26 +87,44 @@ def create_component(db: Session, component: ComponentCreate):
         raise HTTPException(status_code=400, detail=f"Database error: {str(e.orig)}")
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
-def update_component(db: Session, component_id: int, component_update: ComponentUpdate):
+def update_component(db: Session, component_id: int, component_update: ComponentUpdate, if_match: Optional[str] = None):
     # Find existing component
     existing_component = get_component_by_id(db, component_id)
     
     if not existing_component:
         raise HTTPException(status_code=404, detail=f"Component with id {component_id} not found")
     
+    versioning.check_if_match(existing_component, if_match, f"Component '{existing_component.name}'")
+    
     # Update only provided fields (exclude_unset=True ignores None values)
     update_data = component_update.model_dump(exclude_unset=True)
     
-    # Apply updates
-    for field, value in update_data.items():
-        setattr(existing_component, field, value)
-    
     try:
+        # Claim the new version first: a concurrent edit fails here, before any stock moves
+        versioning.bump(existing_component)
+        db.flush()
+        
+        # Apply updates. in_stock sets the unassigned pool (site stock is kept)
+        # and is applied as a delta, so sharded components update their slots
+        for field, value in update_data.items():
+            if field == "in_stock":
+                stock_slots.adjust(db, existing_component, "in_stock", value - stock_slots.pool_stock(db, existing_component))
+            else:
+                setattr(existing_component, field, value)
+        
         db.commit()
+        # Name/spillage changes also invalidate catalog caches (name search, BOM math)
+        if "name" in update_data or "spillage_coefficient" in update_data:
+            bump_version("components", "catalog")
+        else:
+            bump_version("components")
         db.refresh(existing_component)
+        stock_slots.apply_totals(db, [existing_component])
+        broker.publish(*component_stock_event(existing_component))
         return existing_component
     except IntegrityError as e:
         db.rollback()
@@ -72,8 +136,18 @@ def update_component(db: Session, component_id: int, component_update: Component
             )
         
         raise HTTPException(status_code=400, detail=f"Database error: {str(e.orig)}")
+    except StaleDataError as e:
+        db.rollback()
+        # Without If-Match the edit is unconditional: retry it on the new version
+        if if_match is None:
+            raise_if_retryable(e)
+        raise versioning.precondition_failed(f"Component {component_id}")
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
@@ -84,17 +158,15 @@ def delete_component(db: Session, component_id: int):
         raise HTTPException(status_code=404, detail=f"Component with id {component_id} not found")
     
     # Check if component is used in any BOMs before attempting delete
-    from models import BillOfMaterials
-    bom_count = db.query(BillOfMaterials).filter(BillOfMaterials.component_id == component_id).count()
+    boms = db.execute(queries.component_bom_lines(component_id)).scalars().all()
     
-    if bom_count > 0:
+    if boms:
         # Get product names that use this component
-        boms = db.query(BillOfMaterials).filter(BillOfMaterials.component_id == component_id).all()
         product_names = [bom.product.name for bom in boms]
         
         raise HTTPException(
             status_code=409,
-            detail=f"Cannot delete component '{component.name}' because it is used in {bom_count} product BOM(s): {', '.join(product_names)}"
+            detail=f"Cannot delete component '{component.name}' because it is used in {len(boms)} product BOM(s): {', '.join(product_names)}"
         )
     
     # Check if component has inventory in progress or shipped
@@ -106,7 +178,10 @@ def delete_component(db: Session, component_id: int):
     
     try:
         db.delete(component)
+        db.add(DeletedEntity(entity_type="component", entity_id=component_id))
         db.commit()
+        bump_version("components", "catalog")
+        broker.publish(*deleted_event("component", component_id))
         return {"message": f"Component '{component.name}' deleted successfully"}
     except IntegrityError as e:
         db.rollback()
@@ -124,30 +199,77 @@ def delete_component(db: Session, component_id: int):
     
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
 
-def adjust_component_stock(db: Session, component_id: int, adjustment: int):
+def adjust_component_stock(db: Session, component_id: int, adjustment: int, location_id: Optional[int] = None):
     component = get_component_by_id(db, component_id)
     
     if not component:
         raise HTTPException(status_code=404, detail=f"Component with id {component_id} not found")
     
-    new_stock = component.in_stock + adjustment
+    if location_id is not None and db.get(Location, location_id) is None:
+        raise HTTPException(status_code=404, detail=f"Location with id {location_id} not found")
+    
+    # Only the stock at the adjusted place (the pool or one site) can be taken
+    if location_id is None:
+        current_stock = stock_slots.pool_stock(db, component)
+    else:
+        current_stock = stock_locations.site_stock(db, [component_id]).get(component_id, {}).get(location_id, 0)
+    
+    new_stock = current_stock + adjustment
     
     if new_stock < 0:
+        where = "unassigned" if location_id is None else f"at location {location_id}"
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid adjustment. Current stock: {component.in_stock}, Adjustment: {adjustment}, Result: {new_stock} (cannot be negative)"
+            detail=f"Invalid adjustment. Current stock {where}: {current_stock}, Adjustment: {adjustment}, Result: {new_stock} (cannot be negative)"
         )
     
-    component.in_stock = new_stock
+    try:
+        if location_id is None:
+            stock_slots.adjust(db, component, "in_stock", adjustment)
+        else:
+            stock_locations.adjust(db, component, location_id, adjustment)
+        db.commit()
+        bump_version("components")
+        db.refresh(component)
+        stock_slots.apply_totals(db, [component])
+        broker.publish(*component_stock_event(component))
+        return component
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise_if_retryable(e)
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+def set_stock_slots(db: Session, component_id: int, slots: int):
+    """
+    Split a hot component's counters over `slots` rows (0 = single row again).
+    
+    Totals are unchanged; only how they are stored changes.
+    """
+    component = get_component_by_id(db, component_id)
+    
+    if not component:
+        raise HTTPException(status_code=404, detail=f"Component with id {component_id} not found")
     
     try:
+        component = stock_slots.reshard(db, component, slots)
         db.commit()
+        bump_version("components")
         db.refresh(component)
+        stock_slots.apply_totals(db, [component])
         return component
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
\ No newline at end of file
+        raise_if_retryable(e)
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
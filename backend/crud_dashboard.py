@@ -0,0 +1,64 @@
+from sqlalchemy.orm import Session
+from models import OrderStatus
+from bom_graph import BOMGraph
+import archive
+import queries
+
+def get_dashboard(db: Session):
+    """
+    Build the dashboard, inventory, orders and procurement cards from one bulk load.
+    
+    Components, products and both BOM tables are read once into a BOMGraph;
+    orders contribute a status count and the open (pending/in_progress) rows.
+    Only the fields the cards render are returned.
+    """
+    graph = BOMGraph.load(db)
+    
+    status_counts = dict(db.execute(queries.order_status_counts()).all())
+    
+    # Sorted here rather than in SQL (see queries.open_orders)
+    open_orders = sorted(db.execute(queries.open_orders()).all(), key=lambda order: order.id)
+    
+    components = [
+        {
+            "id": component["id"],
+            "name": component["name"],
+            "spillage_coefficient": component["spillage_coefficient"],
+            "in_stock": component["in_stock"],
+            "in_progress": component["in_progress"],
+            "shipped": component["shipped"]
+        }
+        for component in graph.components.values()
+    ]
+    
+    order_list = [
+        {
+            "id": order.id,
+            "product_name": graph.products[order.product_id]["name"],
+            "quantity": order.quantity,
+            "status": order.status.value,
+            "created_at": order.created_at
+        }
+        for order in open_orders
+    ]
+    
+    pending = status_counts.get(OrderStatus.PENDING, 0)
+    in_progress = status_counts.get(OrderStatus.IN_PROGRESS, 0)
+    archived = archive.archived_count(db)
+    completed = status_counts.get(OrderStatus.COMPLETED, 0) + archived
+    
+    return {
+        "components": components,
+        "capacity": graph.production_capacity(),
+        "orders": {
+            "total_orders": pending + in_progress + completed,
+            "pending": pending,
+            "in_progress": in_progress,
+            "completed": completed,
+            "archived": archived,
+            "open_orders": order_list
+        },
+        "procurement": graph.procurement_needs(
+            (order.product_id, order.quantity, order.status) for order in open_orders
+        )
+    }
@@ -0,0 +1,78 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from fastapi import HTTPException
+from models import Location, ComponentLocation
+from schemas import LocationCreate
+from cache import bump_version
+from crud_components import get_component_by_id
+from transactions import raise_if_retryable
+
+def get_all_locations(db: Session):
+    return db.query(Location).order_by(Location.id).all()
+
+
+def get_location_by_id(db: Session, location_id: int):
+    location = db.query(Location).filter(Location.id == location_id).first()
+    
+    if not location:
+        raise HTTPException(status_code=404, detail=f"Location with id {location_id} not found")
+    
+    return location
+
+
+def create_location(db: Session, location: LocationCreate):
+    new_location = Location(name=location.name)
+    
+    try:
+        db.add(new_location)
+        db.commit()
+        bump_version("catalog")
+        db.refresh(new_location)
+        return new_location
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Location with name '{location.name}' already exists")
+    except Exception as e:
+        db.rollback()
+        raise_if_retryable(e)
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+def get_component_locations(db: Session, component_id: int):
+    """
+    Stock of one component per site, plus the unassigned pool.
+    
+    The pool is whatever part of the component totals is not held at a site.
+    """
+    component = get_component_by_id(db, component_id)
+    
+    if not component:
+        raise HTTPException(status_code=404, detail=f"Component with id {component_id} not found")
+    
+    rows = db.query(ComponentLocation, Location.name).join(
+        Location, Location.id == ComponentLocation.location_id
+    ).filter(ComponentLocation.component_id == component_id).order_by(ComponentLocation.location_id).all()
+    
+    sites = [
+        {
+            "location_id": row.location_id,
+            "location_name": location_name,
+            "in_stock": row.in_stock,
+            "in_progress": row.in_progress,
+            "shipped": row.shipped
+        }
+        for row, location_name in rows
+    ]
+    
+    return {
+        "component_id": component.id,
+        "component_name": component.name,
+        "locations": sites,
+        "unassigned": {
+            "location_id": None,
+            "location_name": None,
+            "in_stock": component.in_stock - sum(site["in_stock"] for site in sites),
+            "in_progress": component.in_progress - sum(site["in_progress"] for site in sites),
+            "shipped": component.shipped - sum(site["shipped"] for site in sites)
+        }
+    }
@@ -1,11 +1,23 @@
+from sqlalchemy import func, update, insert, case
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException
-from models import Order, OrderAllocation, Product, BillOfMaterials, Component, OrderStatus
-from schemas import OrderCreate, OrderDetailResponse, OrderAllocationResponse, OrderResponse
+from models import Order, OrderAllocation, OrderProductAllocation, Product, Component, OrderStatus
+from schemas import OrderCreate, OrderDetailResponse, OrderAllocationResponse, OrderProductAllocationResponse, OrderResponse
 from decimal import Decimal
 import math
 from datetime import datetime
+from typing import Optional, List
+from cache import bump_version
+from bom_graph import BOMGraph
+import stock_slots
+import stock_locations
+import archive
+from crud_locations import get_location_by_id
+from events import broker, component_stock_event, product_stock_event, order_status_event
+from transactions import raise_if_retryable
+from fast_json import row_dicts
+import queries
 
 def get_all_orders(db: Session):
     return db.query(Order).all()
@@ -15,12 +27,21 @@ def get_order_by_id(db: Session, order_id: int):
     return db.query(Order).filter(Order.id == order_id).first()
 
 
+def get_order_or_archived(db: Session, order_id: int):
+    """Active order by id, falling back to the archive (see archive.py)."""
+    return get_order_by_id(db, order_id) or archive.get_archived_order(db, order_id)
+
+
 def get_order_with_details(db: Session, order_id: int):
-    order = get_order_by_id(db, order_id)
+    order = get_order_or_archived(db, order_id)
     
     if not order:
         raise HTTPException(status_code=404, detail=f"Order with id {order_id} not found")
     
+    # Backorders may be active or already archived
+    backorder_ids = [backorder.id for backorder in getattr(order, "backorders", [])]
+    backorder_ids += archive.archived_backorder_ids(db, order.id)
+    
     # Get allocations with component details
     allocations = []
     for allocation in order.allocations:
@@ -28,9 +49,20 @@ def get_order_with_details(db: Session, order_id: int):
             id=allocation.id,
             component_id=allocation.component_id,
             component_name=allocation.component.name,
-            quantity_allocated=allocation.quantity_allocated
+            quantity_allocated=allocation.quantity_allocated,
+            location_id=allocation.location_id
         ))
     
+    product_allocations = [
+        OrderProductAllocationResponse(
+            id=allocation.id,
+            product_id=allocation.product_id,
+            product_name=allocation.product.name,
+            quantity_allocated=allocation.quantity_allocated
+        )
+        for allocation in order.product_allocations
+    ]
+    
     return OrderDetailResponse(
         id=order.id,
         product_id=order.product_id,
@@ -39,10 +71,75 @@ def get_order_with_details(db: Session, order_id: int):
         status=order.status.value,
         created_at=order.created_at,
         completed_at=order.completed_at,
-        allocations=allocations
+        parent_order_id=order.parent_order_id,
+        location_id=order.location_id,
+        to_stock=order.to_stock,
+        allocations=allocations,
+        product_allocations=product_allocations,
+        backorder_ids=sorted(backorder_ids)
     )
 
 
+def _allocate_components(db: Session, order: Order, component_requirements):
+    """
+    Take each requirement out of stock and record the allocation lines.
+    
+    Units come from the order's own site first, then other sites, then
+    the unassigned pool; one allocation line is written per source.
+    """
+    sites = stock_locations.site_stock(db, [req["component"].id for req in component_requirements])
+    
+    for req in component_requirements:
+        component = req["component"]
+        available = stock_locations.availability(component.in_stock, sites.get(component.id, {}))
+        parts = stock_locations.plan(available, req["allocated_quantity"], order.location_id)
+        
+        stock_locations.move(db, component, parts, "in_stock", "in_progress")
+        
+        for location_id, quantity in parts:
+            db.add(OrderAllocation(
+                order_id=order.id,
+                component_id=component.id,
+                quantity_allocated=quantity,
+                location_id=location_id
+            ))
+
+
+def _product_stock(db: Session):
+    """{product_id: finished units in stock}, for products that have any."""
+    return dict(db.query(Product.id, Product.in_stock).filter(Product.in_stock > 0).all())
+
+
+def _take_subassemblies(db: Session, order_ids_and_units):
+    """
+    Move finished subassemblies from in_stock to in_progress and record the
+    product allocation lines.
+    
+    order_ids_and_units is [(order_id, {product_id: units})]. One guarded
+    UPDATE for all products; raises 409 if stock was taken in the meantime.
+    """
+    product_deltas = {}
+    allocation_rows = []
+    
+    for order_id, from_stock in order_ids_and_units:
+        for product_id, qty in from_stock.items():
+            product_deltas[product_id] = product_deltas.get(product_id, 0) + qty
+            allocation_rows.append({"order_id": order_id, "product_id": product_id, "quantity_allocated": qty})
+    
+    if not allocation_rows:
+        return
+    
+    taken = _add_by_case(db, Product, {
+        "in_stock": {product_id: -qty for product_id, qty in product_deltas.items()},
+        "in_progress": product_deltas
+    }, nonnegative=("in_stock",))
+    
+    if not taken:
+        raise HTTPException(status_code=409, detail="Inventory changed during allocation, please retry")
+    
+    db.execute(insert(OrderProductAllocation), allocation_rows)
+
+
 def create_order(db: Session, order_data: OrderCreate):
     product = db.query(Product).filter(Product.id == order_data.product_id).first()
     
@@ -52,10 +149,17 @@ def create_order(db: Session, order_data: OrderCreate):
             detail=f"Product with id {order_data.product_id} not found"
         )
     
-    # Calculate required components with spillage (RECURSIVE for nested products)
-    total_component_requirements = calculate_total_components_recursive(db, order_data.product_id, order_data.quantity)
+    if order_data.location_id is not None:
+        get_location_by_id(db, order_data.location_id)
+    
+    # Calculate required components with spillage (RECURSIVE for nested products),
+    # taking finished subassemblies from stock first
+    from_stock = {}
+    total_component_requirements = calculate_total_components_recursive(
+        db, order_data.product_id, order_data.quantity, product_stock=_product_stock(db), from_stock=from_stock
+    )
 
-    if not total_component_requirements:
+    if not total_component_requirements and not from_stock:
         raise HTTPException(
             status_code=400,
             detail=f"Product '{product.name}' has no Bill of Materials defined"
@@ -65,6 +169,7 @@ def create_order(db: Session, order_data: OrderCreate):
     
     for component_id, needed_qty in total_component_requirements.items():
         component = db.query(Component).filter(Component.id == component_id).first()
+        stock_slots.apply_totals(db, [component])
         
         component_requirements.append({
             "component": component,
@@ -89,6 +194,30 @@ def create_order(db: Session, order_data: OrderCreate):
                 "shortage": needed - available
             })
     
+    allocated_quantity = order_data.quantity
+    
+    # Partial fill: build as many units as stock allows, back-order the rest
+    if insufficient_components and order_data.allow_partial:
+        graph = BOMGraph.load_product(db, order_data.product_id)
+        stock = {req["component"].id: req["component"].in_stock for req in component_requirements}
+        buildable_quantity = graph.max_buildable(order_data.product_id, order_data.quantity, stock, graph.product_stock())
+        
+        if buildable_quantity > 0:
+            allocated_quantity = buildable_quantity
+            insufficient_components = []
+            
+            # Same per-line spillage rounding as calculate_total_components_recursive
+            requirements_by_component = {req["component"].id: req for req in component_requirements}
+            component_requirements = []
+            requirements, from_stock = graph.explode_from_stock(
+                order_data.product_id, buildable_quantity, graph.product_stock()
+            )
+            
+            for component_id, needed_qty in requirements.items():
+                req = requirements_by_component[component_id]
+                req["allocated_quantity"] = needed_qty
+                component_requirements.append(req)
+    
     # Decide status based on inventory availability
     if insufficient_components:
         order_status = OrderStatus.PENDING  # Not enough inventory - wait for procurement
@@ -100,45 +229,63 @@ def create_order(db: Session, order_data: OrderCreate):
     try:
         new_order = Order(
             product_id=order_data.product_id,
-            quantity=order_data.quantity,
-            status=order_status
+            quantity=allocated_quantity,
+            status=order_status,
+            location_id=order_data.location_id,
+            to_stock=order_data.to_stock
         )
         
         db.add(new_order)
         db.flush()
         
+        backorder = None
+        if allocated_quantity < order_data.quantity:
+            backorder = Order(
+                product_id=order_data.product_id,
+                quantity=order_data.quantity - allocated_quantity,
+                status=OrderStatus.PENDING,
+                parent_order_id=new_order.id,
+                location_id=order_data.location_id,
+                to_stock=order_data.to_stock
+            )
+            db.add(backorder)
+            db.flush()
+        
         # Only allocate if we have enough inventory
         if allocate_inventory:
-            for req in component_requirements:
-                component = req["component"]
-                allocated_qty = req["allocated_quantity"]
-                
-                component.in_stock -= allocated_qty
-                component.in_progress += allocated_qty
-                
-                allocation = OrderAllocation(
-                    order_id=new_order.id,
-                    component_id=component.id,
-                    quantity_allocated=allocated_qty
-                )
-                db.add(allocation)
+            _allocate_components(db, new_order, component_requirements)
+            _take_subassemblies(db, [(new_order.id, from_stock)])
             
-            product.in_progress += order_data.quantity
+            _add_by_case(db, Product, {"in_progress": {product.id: allocated_quantity}})
+        
+        # Snapshot change events before commit expires the objects
+        change_events = [order_status_event(new_order)]
+        if backorder is not None:
+            change_events.append(order_status_event(backorder))
+        if allocate_inventory:
+            change_events += [component_stock_event(req["component"]) for req in component_requirements]
+            change_events += _stock_events(db, (), [product.id, *from_stock])
         
         db.commit()
+        bump_version("orders", "components", "products")
+        broker.publish_many(change_events)
         db.refresh(new_order)
         
         return get_order_with_details(db, new_order.id)
     
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to create order: {str(e)}"
         )
 
 def complete_order(db: Session, order_id: int):
-    order = get_order_by_id(db, order_id)
+    order = get_order_or_archived(db, order_id)
     
     if not order:
         raise HTTPException(
@@ -154,6 +301,8 @@ def complete_order(db: Session, order_id: int):
     
     try:
         # Move component inventory: from in_progress to shipped
+        stock_slots.apply_totals(db, [allocation.component for allocation in order.allocations])
+        
         for allocation in order.allocations:
             component = allocation.component
             qty = allocation.quantity_allocated
@@ -165,10 +314,26 @@ def complete_order(db: Session, order_id: int):
                     detail=f"Data inconsistency: Component '{component.name}' has insufficient in_progress inventory"
                 )
             
-            component.in_progress -= qty
-            component.shipped += qty
+            stock_locations.move(db, component, [(allocation.location_id, qty)], "in_progress", "shipped")
+        
+        # Subassemblies taken from stock are used up: from in_progress to shipped
+        in_progress_deltas = {}
+        shipped_deltas = {}
+        in_stock_deltas = {}
+        for allocation in order.product_allocations:
+            subassembly = allocation.product
+            qty = allocation.quantity_allocated
+            
+            if subassembly.in_progress < qty:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Data inconsistency: Product '{subassembly.name}' has insufficient in_progress inventory"
+                )
+            
+            in_progress_deltas[subassembly.id] = in_progress_deltas.get(subassembly.id, 0) - qty
+            shipped_deltas[subassembly.id] = shipped_deltas.get(subassembly.id, 0) + qty
         
-        # Move product inventory: from in_progress to shipped
+        # Move product inventory: from in_progress to shipped (or in_stock when built ahead)
         product = order.product
         
         if product.in_progress < order.quantity:
@@ -177,14 +342,37 @@ def complete_order(db: Session, order_id: int):
                 detail=f"Data inconsistency: Product '{product.name}' has insufficient in_progress inventory"
             )
         
-        product.in_progress -= order.quantity
-        product.shipped += order.quantity
+        in_progress_deltas[product.id] = in_progress_deltas.get(product.id, 0) - order.quantity
+        target = in_stock_deltas if order.to_stock else shipped_deltas
+        target[product.id] = target.get(product.id, 0) + order.quantity
+        
+        # Applied as SQL deltas, so concurrent allocations and stock adjustments
+        # of these products are not overwritten with the values read above
+        products_ok = _add_by_case(db, Product, {
+            "in_progress": in_progress_deltas,
+            "shipped": shipped_deltas,
+            "in_stock": in_stock_deltas
+        }, nonnegative=("in_progress",))
+        
+        if not products_ok:
+            raise HTTPException(
+                status_code=500,
+                detail="Data inconsistency: a product has insufficient in_progress inventory"
+            )
         
         # Update order status
         order.status = OrderStatus.COMPLETED
         order.completed_at = datetime.utcnow()
+        order.status_changed_at = func.now()
+        
+        # Snapshot change events before commit expires the objects
+        change_events = [order_status_event(order)]
+        change_events += [component_stock_event(allocation.component) for allocation in order.allocations]
+        change_events += _stock_events(db, (), in_progress_deltas.keys())
         
         db.commit()
+        bump_version("orders", "components", "products")
+        broker.publish_many(change_events)
         db.refresh(order)
         
         return get_order_with_details(db, order_id)
@@ -194,44 +382,384 @@ def complete_order(db: Session, order_id: int):
         raise
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to complete order: {str(e)}"
         )
 
 
-def get_order_summary(db: Session):
-    orders = get_all_orders(db)
+def _add_by_case(db: Session, model, column_deltas: dict, nonnegative=()):
+    """
+    Add per-row deltas to counter columns of `model` with one UPDATE ... CASE.
+    
+    column_deltas is {column_name: {row_id: delta}}. Rows where a column named
+    in `nonnegative` would drop below zero are not updated; returns False
+    when that happened to any row, so the caller can roll back.
+    """
+    column_deltas = {name: deltas for name, deltas in column_deltas.items() if deltas}
+    ids = sorted(set().union(*(deltas.keys() for deltas in column_deltas.values())))
+    if not ids:
+        return True
+    
+    values = {}
+    guards = []
+    
+    for name, deltas in column_deltas.items():
+        column = getattr(model, name)
+        new_value = column + case(deltas, value=model.id, else_=0)
+        values[name] = new_value
+        if name in nonnegative:
+            guards.append(new_value >= 0)
+    
+    result = db.execute(
+        update(model)
+        .where(model.id.in_(ids), *guards)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    
+    return result.rowcount == len(ids)
+
+
+def _move_component_stock(db: Session, source_deltas: dict, from_field: str, to_field: str):
+    """
+    Move summed quantities between two component counters for a batch.
+    
+    source_deltas is {(component_id, location_id or None): units}. Pool
+    units of unsharded components get one UPDATE ... CASE; sharded ones go
+    through their slot rows and site units through their location rows.
+    Returns False if a counter would have gone negative.
+    """
+    component_deltas = {}
+    site_deltas = {}
+    for (component_id, location_id), qty in source_deltas.items():
+        if location_id is None:
+            component_deltas[component_id] = qty
+        else:
+            site_deltas[(component_id, location_id)] = qty
+    
+    if not stock_locations.move_rows(db, site_deltas, from_field, to_field):
+        return False
+    
+    sharded = stock_slots.sharded_ids(db, component_deltas.keys())
+    plain = {component_id: qty for component_id, qty in component_deltas.items() if component_id not in sharded}
+    
+    moved = _add_by_case(db, Component, {
+        from_field: {component_id: -qty for component_id, qty in plain.items()},
+        to_field: plain
+    }, nonnegative=(from_field,))
+    
+    if not moved:
+        return False
+    
+    for component in db.query(Component).filter(Component.id.in_(sharded)).order_by(Component.id):
+        stock_slots.move(db, component, from_field, to_field, component_deltas[component.id])
+    
+    return True
+
+
+def _load_batch_orders(db: Session, order_ids: List[int]):
+    order_ids = sorted(set(order_ids))
+    
+    orders = db.query(Order.id, Order.product_id, Order.quantity, Order.status, Order.location_id, Order.to_stock).filter(
+        Order.id.in_(order_ids)
+    ).order_by(Order.id).with_for_update().all()
     
-    # Count by status
-    pending_count = sum(1 for o in orders if o.status == OrderStatus.PENDING)
-    in_progress_count = sum(1 for o in orders if o.status == OrderStatus.IN_PROGRESS)
-    completed_count = sum(1 for o in orders if o.status == OrderStatus.COMPLETED)
+    missing = sorted(set(order_ids) - {order.id for order in orders})
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Orders not found: {', '.join(str(order_id) for order_id in missing)}"
+        )
+    
+    return orders
+
+
+def _batch_result(db: Session, order_ids: List[int]):
+    # Event payloads and the response both come from one re-read after the UPDATEs
+    rows = db.query(Order, Product.name).join(Product, Product.id == Order.product_id).filter(
+        Order.id.in_(order_ids)
+    ).order_by(Order.id).all()
     
-    # Build order list with product names
-    order_list = []
-    for order in orders:
-        order_list.append(OrderResponse(
+    orders = [
+        OrderResponse(
             id=order.id,
             product_id=order.product_id,
-            product_name=order.product.name,
+            product_name=product_name,
             quantity=order.quantity,
             status=order.status.value,
             created_at=order.created_at,
-            completed_at=order.completed_at
-        ))
+            completed_at=order.completed_at,
+            parent_order_id=order.parent_order_id,
+            location_id=order.location_id,
+            to_stock=order.to_stock
+        )
+        for order, product_name in rows
+    ]
+    
+    return orders, [order_status_event(order) for order, _ in rows]
+
+
+def _stock_events(db: Session, component_ids, product_ids):
+    components = db.query(
+        Component.id,
+        *(stock_slots.total_column(field).label(field) for field in stock_slots.COUNTERS)
+    ).filter(Component.id.in_(component_ids)).all()
+    products = db.query(Product.id, Product.in_stock, Product.in_progress, Product.shipped).filter(
+        Product.id.in_(product_ids)
+    ).all()
+    
+    return [component_stock_event(row) for row in components] + [product_stock_event(row) for row in products]
+
+
+def complete_orders(db: Session, order_ids: List[int]):
+    """
+    Complete many orders in one transaction.
+    
+    Component and product deltas are summed across all orders and applied
+    with one UPDATE per table, instead of one ORM update per allocation line.
+    Either every order is completed or none is.
+    """
+    try:
+        orders = _load_batch_orders(db, order_ids)
+        
+        completed = [order.id for order in orders if order.status == OrderStatus.COMPLETED]
+        if completed:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Orders already completed: {', '.join(str(order_id) for order_id in completed)}"
+            )
+        
+        ids = [order.id for order in orders]
+        
+        # Move component inventory: from in_progress to shipped, at the site each line came from
+        source_deltas = {
+            (component_id, location_id): int(qty)
+            for component_id, location_id, qty in db.execute(queries.allocation_sums(ids)).all()
+        }
+        
+        # Move product inventory: from in_progress to shipped, or to in_stock
+        # for build-ahead orders; subassemblies taken from stock are shipped
+        product_deltas = {}
+        shipped_deltas = {}
+        in_stock_deltas = {}
+        for order in orders:
+            product_deltas[order.product_id] = product_deltas.get(order.product_id, 0) + order.quantity
+            target = in_stock_deltas if order.to_stock else shipped_deltas
+            target[order.product_id] = target.get(order.product_id, 0) + order.quantity
+        
+        for product_id, qty in db.query(
+            OrderProductAllocation.product_id, func.sum(OrderProductAllocation.quantity_allocated)
+        ).filter(OrderProductAllocation.order_id.in_(ids)).group_by(OrderProductAllocation.product_id).all():
+            product_deltas[product_id] = product_deltas.get(product_id, 0) + int(qty)
+            shipped_deltas[product_id] = shipped_deltas.get(product_id, 0) + int(qty)
+        
+        if not _move_component_stock(db, source_deltas, "in_progress", "shipped"):
+            raise HTTPException(
+                status_code=500,
+                detail="Data inconsistency: a component has insufficient in_progress inventory"
+            )
+        
+        products_ok = _add_by_case(db, Product, {
+            "in_progress": {product_id: -qty for product_id, qty in product_deltas.items()},
+            "shipped": shipped_deltas,
+            "in_stock": in_stock_deltas
+        }, nonnegative=("in_progress",))
+        
+        if not products_ok:
+            raise HTTPException(
+                status_code=500,
+                detail="Data inconsistency: a product has insufficient in_progress inventory"
+            )
+        
+        # Update order status
+        db.execute(
+            update(Order)
+            .where(Order.id.in_(ids))
+            .values(status=OrderStatus.COMPLETED, completed_at=datetime.utcnow(), status_changed_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+        
+        # Snapshot change events before commit
+        result, change_events = _batch_result(db, ids)
+        change_events += _stock_events(db, {component_id for component_id, _ in source_deltas}, product_deltas.keys())
+        
+        db.commit()
+        bump_version("orders", "components", "products")
+        broker.publish_many(change_events)
+        
+        return {"count": len(result), "orders": result}
+    
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise_if_retryable(e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to complete orders: {str(e)}"
+        )
+
+
+def allocate_pending_orders(db: Session, order_ids: List[int]):
+    """
+    Allocate inventory to many pending orders in one transaction.
+    
+    Requirements come from one BOMGraph load (same spillage math as
+    calculate_total_components_recursive), are summed across orders and
+    applied with one UPDATE per table and one multi-row allocation INSERT.
+    Finished subassembly stock goes to the orders in id order before their
+    remainder is exploded. If the combined requirement does not fit in
+    stock, nothing is allocated.
+    """
+    try:
+        orders = _load_batch_orders(db, order_ids)
+        
+        not_pending = [order.id for order in orders if order.status != OrderStatus.PENDING]
+        if not_pending:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Orders not pending: {', '.join(str(order_id) for order_id in not_pending)}"
+            )
+        
+        graph = BOMGraph.load(db)
+        product_stock = graph.product_stock()
+        
+        component_deltas = {}
+        product_deltas = {}
+        plans = []
+        
+        for order in orders:
+            requirements, from_stock = graph.explode_from_stock(order.product_id, order.quantity, product_stock)
+            plans.append((order, requirements, from_stock))
+            
+            for component_id, needed_qty in requirements.items():
+                component_deltas[component_id] = component_deltas.get(component_id, 0) + needed_qty
+            
+            product_deltas[order.product_id] = product_deltas.get(order.product_id, 0) + order.quantity
+        
+        # Check the combined requirement against current inventory
+        shortage_details = []
+        for component_id, needed in component_deltas.items():
+            component = graph.components[component_id]
+            if component["in_stock"] < needed:
+                shortage_details.append(
+                    f"{component['name']}: need {needed}, have {component['in_stock']} (short {needed - component['in_stock']})"
+                )
+        
+        if shortage_details:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Still insufficient inventory. Shortages: {'; '.join(shortage_details)}"
+            )
+        
+        # Pick sources order by order (each order's own site first)
+        sites = stock_locations.site_stock(db, component_deltas.keys())
+        available = {
+            component_id: stock_locations.availability(graph.components[component_id]["in_stock"], sites.get(component_id, {}))
+            for component_id in component_deltas
+        }
+        source_deltas = {}
+        allocation_rows = []
+        
+        for order, requirements, _ in plans:
+            for component_id, needed_qty in requirements.items():
+                for location_id, qty in stock_locations.plan(available[component_id], needed_qty, order.location_id):
+                    source = (component_id, location_id)
+                    source_deltas[source] = source_deltas.get(source, 0) + qty
+                    allocation_rows.append({
+                        "order_id": order.id,
+                        "component_id": component_id,
+                        "quantity_allocated": qty,
+                        "location_id": location_id
+                    })
+        
+        # Guarded again in SQL in case stock moved since the snapshot
+        if not _move_component_stock(db, source_deltas, "in_stock", "in_progress"):
+            raise HTTPException(status_code=409, detail="Inventory changed during allocation, please retry")
+        
+        _add_by_case(db, Product, {"in_progress": product_deltas})
+        _take_subassemblies(db, [(order.id, from_stock) for order, _, from_stock in plans])
+        
+        if allocation_rows:
+            db.execute(insert(OrderAllocation), allocation_rows)
+        
+        ids = [order.id for order in orders]
+        subassembly_ids = {product_id for _, _, from_stock in plans for product_id in from_stock}
+        
+        # Update order status
+        db.execute(
+            update(Order)
+            .where(Order.id.in_(ids))
+            .values(status=OrderStatus.IN_PROGRESS, status_changed_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+        
+        # Snapshot change events before commit
+        result, change_events = _batch_result(db, ids)
+        change_events += _stock_events(db, component_deltas.keys(), product_deltas.keys() | subassembly_ids)
+        
+        db.commit()
+        bump_version("orders", "components", "products")
+        broker.publish_many(change_events)
+        
+        return {"count": len(result), "orders": result}
+    
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise_if_retryable(e)
+        raise HTTPException(status_code=500, detail=f"Failed to allocate orders: {str(e)}")
+
+
+# Summary rows are queries.ORDER_SUMMARY_COLUMNS, which follow these fields
+_SUMMARY_FIELDS = list(OrderResponse.model_fields)
+
+
+def get_order_summary(db: Session, updated_since: Optional[datetime] = None):
+    """
+    Order counts plus the order list, the list as plain dicts in
+    OrderResponse field order (one joined select, no ORM objects), ready
+    for fast_json.
+    """
+    rows = db.execute(queries.order_summaries(updated_since)).all()
+    
+    if updated_since is None:
+        
+        # Count by status
+        pending_count = sum(1 for row in rows if row.status == OrderStatus.PENDING)
+        in_progress_count = sum(1 for row in rows if row.status == OrderStatus.IN_PROGRESS)
+        completed_count = sum(1 for row in rows if row.status == OrderStatus.COMPLETED)
+        total_count = len(rows)
+    else:
+        # Delta mode: only orders whose status changed, but counts still cover every order
+        status_counts = dict(db.execute(queries.order_status_counts()).all())
+        pending_count = status_counts.get(OrderStatus.PENDING, 0)
+        in_progress_count = status_counts.get(OrderStatus.IN_PROGRESS, 0)
+        completed_count = status_counts.get(OrderStatus.COMPLETED, 0)
+        total_count = pending_count + in_progress_count + completed_count
+    
+    # Archived orders are all completed; counted from archive_stats, never listed
+    archived_count = archive.archived_count(db)
+    completed_count += archived_count
+    total_count += archived_count
     
     return {
-        "total_orders": len(orders),
+        "total_orders": total_count,
         "pending": pending_count,
         "in_progress": in_progress_count,
         "completed": completed_count,
-        "orders": order_list
+        "archived": archived_count,
+        "orders": row_dicts(rows, _SUMMARY_FIELDS)
     }
 
 
 def allocate_pending_order(db: Session, order_id: int):
-    order = get_order_by_id(db, order_id)
+    order = get_order_or_archived(db, order_id)
     
     if not order:
         raise HTTPException(status_code=404, detail=f"Order with id {order_id} not found")
@@ -243,17 +771,21 @@ def allocate_pending_order(db: Session, order_id: int):
         )
     
     product = order.product
-     # Use recursive calculation for nested products
+     # Use recursive calculation for nested products, subassemblies from stock first
+    from_stock = {}
     total_component_requirements = calculate_total_components_recursive(
         db, 
         order.product_id, 
-        order.quantity
+        order.quantity,
+        product_stock=_product_stock(db),
+        from_stock=from_stock
     )
 
     component_requirements = []
 
     for component_id, needed_qty in total_component_requirements.items():
         component = db.query(Component).filter(Component.id == component_id).first()
+        stock_slots.apply_totals(db, [component])
         
         component_requirements.append({
             "component": component,
@@ -290,34 +822,35 @@ def allocate_pending_order(db: Session, order_id: int):
         )
     
     try:
-        # Allocate components
-        for req in component_requirements:
-            component = req["component"]
-            allocated_qty = req["allocated_quantity"]
-            
-            component.in_stock -= allocated_qty
-            component.in_progress += allocated_qty
-            
-            allocation = OrderAllocation(
-                order_id=order.id,
-                component_id=component.id,
-                quantity_allocated=allocated_qty
-            )
-            db.add(allocation)
+        # Allocate components and subassemblies
+        _allocate_components(db, order, component_requirements)
+        _take_subassemblies(db, [(order.id, from_stock)])
         
         # Update product
-        product.in_progress += order.quantity
+        _add_by_case(db, Product, {"in_progress": {product.id: order.quantity}})
         
         # Update order status
         order.status = OrderStatus.IN_PROGRESS
+        order.status_changed_at = func.now()
+        
+        # Snapshot change events before commit expires the objects
+        change_events = [order_status_event(order)]
+        change_events += [component_stock_event(req["component"]) for req in component_requirements]
+        change_events += _stock_events(db, (), [product.id, *from_stock])
         
         db.commit()
+        bump_version("orders", "components", "products")
+        broker.publish_many(change_events)
         db.refresh(order)
         
         return get_order_with_details(db, order_id)
     
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(status_code=500, detail=f"Failed to allocate order: {str(e)}")
  
     
@@ -327,23 +860,27 @@ def get_order_requirements(db: Session, order_id: int):
     
     Shows what components are needed, available, and short.
     """
-    order = get_order_by_id(db, order_id)
+    order = get_order_or_archived(db, order_id)
     
     if not order:
         raise HTTPException(status_code=404, detail=f"Order with id {order_id} not found")
     
     product = order.product
-     # Use recursive calculation for nested products
+     # Use recursive calculation for nested products, subassemblies from stock first
+    from_stock = {}
     total_component_requirements = calculate_total_components_recursive(
         db, 
         order.product_id, 
-        order.quantity
+        order.quantity,
+        product_stock=_product_stock(db),
+        from_stock=from_stock
     )
     
     requirements = []
     
     for component_id, needed_qty in total_component_requirements.items():
         component = db.query(Component).filter(Component.id == component_id).first()
+        stock_slots.apply_totals(db, [component])
         
         available = component.in_stock
         shortage = max(0, needed_qty - available)
@@ -357,6 +894,13 @@ def get_order_requirements(db: Session, order_id: int):
             "has_enough": shortage == 0
         })
     
+    subassemblies = [
+        {"product_id": product_id, "product_name": name, "from_stock": from_stock[product_id]}
+        for product_id, name in db.query(Product.id, Product.name).filter(
+            Product.id.in_(from_stock.keys())
+        ).order_by(Product.id).all()
+    ] if from_stock else []
+    
     can_allocate = all(req["has_enough"] for req in requirements)
     
     return {
@@ -365,13 +909,97 @@ def get_order_requirements(db: Session, order_id: int):
         "quantity": order.quantity,
         "status": order.status,
         "requirements": requirements,
+        "subassemblies": subassemblies,
         "can_allocate": can_allocate
     }
 
-def calculate_total_components_recursive(db: Session, product_id: int, quantity: int, depth=0):
+def get_pending_feasibility(db: Session, order_by: str = "fifo"):
+    """
+    Check every pending order against the same running stock.
+    
+    Orders are walked in `order_by` sequence; each order that fits is marked
+    allocatable and its requirements (components and finished subassemblies)
+    are taken out of the running stock, so later orders only see what is left. Orders that do not fit are marked
+    partially_blocked (some units could be built) or blocked, with the
+    component that limits them most. Nothing is written.
+    """
+    graph = BOMGraph.load(db)
+    
+    pending_orders = db.execute(queries.pending_orders(order_by)).all()
+    
+    stock = {component_id: component["in_stock"] for component_id, component in graph.components.items()}
+    product_stock = graph.product_stock()
+    counts = {"allocatable": 0, "partially_blocked": 0, "blocked": 0}
+    results = []
+    
+    for order in pending_orders:
+        # Subassemblies only leave the running stock if the order fits
+        remaining_product_stock = dict(product_stock)
+        requirements, from_stock = graph.explode_from_stock(order.product_id, order.quantity, remaining_product_stock)
+        
+        # Short components, tightest (lowest share of the need in stock) first
+        shortages = sorted(
+            (
+                (stock[component_id] / needed, component_id, needed)
+                for component_id, needed in requirements.items()
+                if stock[component_id] < needed
+            ),
+            key=lambda shortage: shortage[0]
+        )
+        
+        bottleneck = None
+        
+        if (requirements or from_stock) and not shortages:
+            feasibility = "allocatable"
+            buildable_quantity = order.quantity
+            product_stock = remaining_product_stock
+            
+            for component_id, needed in requirements.items():
+                stock[component_id] -= needed
+        else:
+            buildable_quantity = graph.max_buildable(order.product_id, order.quantity, stock, product_stock) if requirements else 0
+            feasibility = "partially_blocked" if buildable_quantity > 0 else "blocked"
+            
+            if shortages:
+                _, component_id, needed = shortages[0]
+                bottleneck = {
+                    "component_id": component_id,
+                    "component_name": graph.components[component_id]["name"],
+                    "needed": needed,
+                    "available": stock[component_id],
+                    "shortage": needed - stock[component_id]
+                }
+        
+        counts[feasibility] += 1
+        results.append({
+            "order_id": order.id,
+            "product_id": order.product_id,
+            "product_name": graph.products[order.product_id]["name"],
+            "quantity": order.quantity,
+            "created_at": order.created_at,
+            "feasibility": feasibility,
+            "buildable_quantity": buildable_quantity,
+            "bottleneck": bottleneck
+        })
+    
+    return {
+        "order_by": order_by,
+        "total_pending": len(results),
+        **counts,
+        "orders": results
+    }
+
+
+def calculate_total_components_recursive(db: Session, product_id: int, quantity: int, depth=0,
+                                         product_stock: Optional[dict] = None, from_stock: Optional[dict] = None):
     """
     Recursively calculate all component requirements for a product,
     including components from nested sub-products.
+    
+    With product_stock ({product_id: finished units}, see _product_stock),
+    nested products are taken from that stock first and only the remainder
+    is exploded. Units taken are removed from product_stock and added to
+    from_stock ({product_id: units}).
     """
     from models import ProductBOM
     
@@ -381,9 +1009,7 @@ def calculate_total_components_recursive(db: Session, product_id: int, quantity:
     total_components = {}
     
     # Get direct component requirements
-    component_boms = db.query(BillOfMaterials).filter(
-        BillOfMaterials.product_id == product_id
-    ).all()
+    component_boms = db.execute(queries.product_bom_lines(product_id)).scalars().all()
     
     for bom in component_boms:
         component = bom.component
@@ -403,13 +1029,27 @@ def calculate_total_components_recursive(db: Session, product_id: int, quantity:
     ).all()
     
     for product_bom in product_boms:
-        # Recursively get components for sub-product
         sub_quantity = product_bom.quantity_required * quantity
+        
+        # Finished units on the shelf first
+        if product_stock:
+            taken = min(sub_quantity, product_stock.get(product_bom.child_product_id, 0))
+            if taken:
+                product_stock[product_bom.child_product_id] -= taken
+                from_stock[product_bom.child_product_id] = from_stock.get(product_bom.child_product_id, 0) + taken
+                sub_quantity -= taken
+        
+        if sub_quantity == 0:
+            continue
+        
+        # Recursively get components for sub-product
         sub_components = calculate_total_components_recursive(
             db, 
             product_bom.child_product_id, 
             sub_quantity,
-            depth + 1
+            depth + 1,
+            product_stock,
+            from_stock
         )
         
         # Merge sub-product components into total
@@ -1,11 +1,24 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import func, update
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException
-from models import Product, BillOfMaterials, Component
-from schemas import ProductCreate, ProductUpdate, BOMItemDetailResponse, ProductDetailResponse, ProductBOMItemResponse, ProductBOMItemCreate
+from models import Product, BillOfMaterials, Component, DeletedEntity
+from schemas import ProductCreate, ProductUpdate, BOMItemDetailResponse, ProductDetailResponse, ProductBOMItemResponse, ProductBOMItemCreate, ListFilters
+from schemas import ProductTreeResponse, ProductResponse
 from decimal import Decimal
+from datetime import datetime
+from typing import Optional
 import math
 from crud_orders import calculate_total_components_recursive;
+from cache import bump_version
+from bom_graph import BOMGraph, PRODUCT_TREE_SQL
+from events import broker, product_bom_event, product_stock_event, product_updated_event, deleted_event
+from listing import apply_list_filters
+from fast_json import row_dicts
+from transactions import raise_if_retryable
+import queries
+import versioning
 
 def check_circular_reference(db: Session, parent_id: int, child_id: int, visited=None):
     if visited is None:
@@ -30,8 +43,22 @@ def check_circular_reference(db: Session, parent_id: int, child_id: int, visited
     
     return False
 
-def get_all_products(db: Session):
-    return db.query(Product).all()
+# ProductResponse fields, in order; list rows are built straight from these columns
+_LIST_FIELDS = list(ProductResponse.model_fields)
+
+
+def get_all_products(db: Session, updated_since: Optional[datetime] = None, filters: Optional[ListFilters] = None):
+    """Products as plain dicts in ProductResponse field order, ready for fast_json."""
+    query = db.query(*(getattr(Product, field) for field in _LIST_FIELDS))
+    
+    # Delta sync: only rows changed at or after the client's last sync point
+    if updated_since is not None:
+        query = query.filter(Product.updated_at >= updated_since).order_by(Product.updated_at, Product.id)
+    
+    if filters is not None:
+        query = apply_list_filters(db, query, Product, filters)
+    
+    return row_dicts(query.all(), _LIST_FIELDS)
 
 
 def get_product_by_id(db: Session, product_id: int):
@@ -47,7 +74,9 @@ def get_product_with_bom(db: Session, product_id: int):
         raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
     
     # Get component BOM entries
-    bom_entries = db.query(BillOfMaterials).filter(BillOfMaterials.product_id == product_id).all()
+    bom_entries = db.execute(
+        queries.product_bom_lines(product_id).options(joinedload(BillOfMaterials.component))
+    ).scalars().all()
     
     component_bom_details = []
     for bom in bom_entries:
@@ -65,7 +94,9 @@ def get_product_with_bom(db: Session, product_id: int):
         ))
     
     # Get product BOM entries (nested products)
-    product_bom_entries = db.query(ProductBOM).filter(ProductBOM.parent_product_id == product_id).all()
+    product_bom_entries = db.query(ProductBOM).options(
+        joinedload(ProductBOM.child_product)
+    ).filter(ProductBOM.parent_product_id == product_id).all()
     
     product_bom_details = []
     for pbom in product_bom_entries:
@@ -80,14 +111,121 @@ def get_product_with_bom(db: Session, product_id: int):
     return ProductDetailResponse(
         id=product.id,
         name=product.name,
+        in_stock=product.in_stock,
         in_progress=product.in_progress,
         shipped=product.shipped,
+        version=product.version,
         created_at=product.created_at,
         updated_at=product.updated_at,
         component_bom=component_bom_details,
         product_bom=product_bom_details
     )
 
+
+def _stock_coverage(in_stock: int, required: int):
+    # Fraction of the requirement covered by current stock (>= 1 means enough)
+    return round(in_stock / required, 4) if required > 0 else None
+
+
+def get_product_tree(db: Session, product_id: int, quantity: int = 1):
+    """
+    Fully exploded multi-level BOM for `quantity` units of a product.
+    
+    Every node carries its per-parent and cumulative quantity; component lines
+    also carry spillage-adjusted totals (rounded per line exactly like
+    calculate_total_components_recursive) and stock coverage. Totals per
+    component are summed over the whole tree.
+    
+    The rows come from one WITH RECURSIVE query (MySQL 8 / SQLite) and the
+    tree is assembled in time linear in its size.
+    """
+    rows = db.execute(PRODUCT_TREE_SQL, {"product_id": product_id, "max_depth": 11}).mappings().all()
+    
+    root = next((row for row in rows if row["kind"] == "root"), None)
+    if root is None:
+        raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
+    
+    # parent product id -> lines, in BOM line order
+    child_products = {}
+    component_lines = {}
+    for row in rows:
+        if row["kind"] == "product":
+            child_products.setdefault(row["parent_id"], []).append(row)
+        elif row["kind"] == "component":
+            component_lines.setdefault(row["parent_id"], []).append(row)
+    
+    totals = {}
+    
+    def build_node(node_id, name, quantity_per_parent, cumulative_quantity, depth):
+        if depth > 10:
+            raise HTTPException(400, "BOM nesting too deep (max 10 levels)")
+        
+        components = []
+        for line in component_lines.get(node_id, []):
+            spillage = Decimal(str(line["spillage_coefficient"]))
+            quantity_with_spillage = Decimal(str(line["quantity_required"])) * (Decimal("1") + spillage) * Decimal(str(cumulative_quantity))
+            total_with_spillage = math.ceil(float(quantity_with_spillage))
+            
+            components.append({
+                "component_id": line["node_id"],
+                "component_name": line["name"],
+                "depth": depth + 1,
+                "quantity_per_parent": line["quantity_required"],
+                "cumulative_quantity": line["quantity_required"] * cumulative_quantity,
+                "spillage_coefficient": spillage,
+                "quantity_with_spillage": quantity_with_spillage,
+                "total_with_spillage": total_with_spillage,
+                "in_stock": line["in_stock"],
+                "stock_coverage": _stock_coverage(line["in_stock"], total_with_spillage)
+            })
+            
+            total = totals.setdefault(line["node_id"], {
+                "component_id": line["node_id"],
+                "component_name": line["name"],
+                "total_required": 0,
+                "in_stock": line["in_stock"]
+            })
+            total["total_required"] += total_with_spillage
+        
+        children = [
+            build_node(
+                child["node_id"],
+                child["name"],
+                child["quantity_required"],
+                child["quantity_required"] * cumulative_quantity,
+                depth + 1
+            )
+            for child in child_products.get(node_id, [])
+        ]
+        
+        return {
+            "product_id": node_id,
+            "product_name": name,
+            "depth": depth,
+            "quantity_per_parent": quantity_per_parent,
+            "cumulative_quantity": cumulative_quantity,
+            "components": components,
+            "children": children
+        }
+    
+    tree = build_node(root["node_id"], root["name"], 1, quantity, 0)
+    
+    total_list = []
+    for total in totals.values():
+        total["shortage"] = max(0, total["total_required"] - total["in_stock"])
+        total["stock_coverage"] = _stock_coverage(total["in_stock"], total["total_required"])
+        total_list.append(total)
+    
+    return ProductTreeResponse(
+        product_id=root["node_id"],
+        product_name=root["name"],
+        quantity=quantity,
+        tree=tree,
+        totals=total_list,
+        can_build=all(total["shortage"] == 0 for total in total_list) and bool(total_list)
+    )
+
+
 def create_product(db: Session, product: ProductCreate):
     from models import ProductBOM
     
@@ -132,6 +270,7 @@ def create_product(db: Session, product: ProductCreate):
     # Create the product
     new_product = Product(
         name=product.name,
+        in_stock=0,
         in_progress=0,
         shipped=0
     )
@@ -166,7 +305,9 @@ def create_product(db: Session, product: ProductCreate):
             db.add(pbom_entry)
         
         db.commit()
+        bump_version("products", "catalog")
         db.refresh(new_product)
+        broker.publish(*product_bom_event(new_product.id))
         
         return get_product_with_bom(db, new_product.id)
         
@@ -187,22 +328,30 @@ def create_product(db: Session, product: ProductCreate):
     
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
-def update_product(db: Session, product_id: int, product_update: ProductUpdate):
+def update_product(db: Session, product_id: int, product_update: ProductUpdate, if_match: Optional[str] = None):
     product = get_product_by_id(db, product_id)
     
     if not product:
         raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
     
+    versioning.check_if_match(product, if_match, f"Product '{product.name}'")
+    
     update_data = product_update.model_dump(exclude_unset=True)
     
     for field, value in update_data.items():
         setattr(product, field, value)
     
+    versioning.bump(product)
+    change_event = product_updated_event(product)
+    
     try:
         db.commit()
+        bump_version("products", "catalog")
+        broker.publish(*change_event)
         db.refresh(product)
         return product
     
@@ -217,8 +366,16 @@ def update_product(db: Session, product_id: int, product_update: ProductUpdate):
         
         raise HTTPException(status_code=400, detail=f"Database error: {str(e.orig)}")
     
+    except StaleDataError as e:
+        db.rollback()
+        # Without If-Match the edit is unconditional: retry it on the new version
+        if if_match is None:
+            raise_if_retryable(e)
+        raise versioning.precondition_failed(f"Product {product_id}")
+    
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
@@ -229,15 +386,16 @@ def delete_product(db: Session, product_id: int):
         raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
     
     # Check if product has inventory
-    if product.in_progress > 0 or product.shipped > 0:
+    if product.in_stock > 0 or product.in_progress > 0 or product.shipped > 0:
         raise HTTPException(
             status_code=409,
-            detail=f"Cannot delete product '{product.name}' because it has inventory in progress ({product.in_progress}) or shipped ({product.shipped})"
+            detail=f"Cannot delete product '{product.name}' because it has inventory in stock ({product.in_stock}), in progress ({product.in_progress}) or shipped ({product.shipped})"
         )
     
     # Check if product has active orders
-    from models import Order
-    order_count = db.query(Order).filter(Order.product_id == product_id).count()
+    from models import ArchivedOrder
+    order_count = db.execute(queries.product_order_count(product_id)).scalar()
+    order_count += db.query(ArchivedOrder).filter(ArchivedOrder.product_id == product_id).count()
     
     if order_count > 0:
         raise HTTPException(
@@ -247,15 +405,19 @@ def delete_product(db: Session, product_id: int):
     
     try:
         db.delete(product)  # CASCADE will delete BOM entries automatically
+        db.add(DeletedEntity(entity_type="product", entity_id=product_id))
         db.commit()
+        bump_version("products", "catalog")
+        broker.publish(*deleted_event("product", product_id))
         return {"message": f"Product '{product.name}' and its BOM deleted successfully"}
     
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
-def update_product_full_bom(db: Session, product_id: int, component_bom: list, product_bom: list):
+def update_product_full_bom(db: Session, product_id: int, component_bom: list, product_bom: list, if_match: Optional[str] = None):
     from models import ProductBOM
     
     product = get_product_by_id(db, product_id)
@@ -263,6 +425,8 @@ def update_product_full_bom(db: Session, product_id: int, component_bom: list, p
     if not product:
         raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
     
+    versioning.check_if_match(product, if_match, f"Product '{product.name}'")
+    
     # Validate all components exist
     component_ids = [item.component_id for item in component_bom]
     for component_id in component_ids:
@@ -287,6 +451,13 @@ def update_product_full_bom(db: Session, product_id: int, component_bom: list, p
         raise HTTPException(400, f"Product BOM contains duplicates: {list(set(duplicates))}")
     
     try:
+        # Claim the new version first: the product row lock serializes concurrent
+        # replacements and one that read the old version fails here. BOM rows live
+        # in other tables; touching the product also lets delta sync pick it up.
+        versioning.bump(product)
+        product.updated_at = func.now()
+        db.flush()
+        
         # Delete existing component BOMs
         db.query(BillOfMaterials).filter(BillOfMaterials.product_id == product_id).delete()
         
@@ -315,105 +486,78 @@ def update_product_full_bom(db: Session, product_id: int, component_bom: list, p
             db.add(new_pbom)
         
         db.commit()
+        bump_version("products", "catalog")
+        broker.publish(*product_bom_event(product_id))
         
         return get_product_with_bom(db, product_id)
     
+    except StaleDataError as e:
+        db.rollback()
+        # Without If-Match the edit is unconditional: retry it on the new version
+        if if_match is None:
+            raise_if_retryable(e)
+        raise versioning.precondition_failed(f"Product {product_id}")
     except HTTPException:
         db.rollback()
         raise
     except Exception as e:
         db.rollback()
+        raise_if_retryable(e)
         raise HTTPException(500, f"Unexpected error: {str(e)}")
 
-def calculate_production_capacity(db: Session):
-    from models import ProductBOM
+def adjust_product_stock(db: Session, product_id: int, adjustment: int):
+    """
+    Add (or remove) finished units of a product, e.g. after a stock count.
     
-    def calculate_max_producible_recursive(product_id, depth=0):
-        """
-        Recursively calculate max producible units for a product,
-        considering both component constraints and nested product constraints.
-        
-        Returns: (max_units, limiting_factor_name)
-        """
-        if depth > 10:
-            return (0, "Nesting too deep")
-        
-        # Get component BOM entries
-        component_boms = db.query(BillOfMaterials).filter(
-            BillOfMaterials.product_id == product_id
-        ).all()
-        
-        # Get product BOM entries (nested products)
-        product_boms = db.query(ProductBOM).filter(
-            ProductBOM.parent_product_id == product_id
-        ).all()
-        
-        # If no BOM at all, can't produce
-        if not component_boms and not product_boms:
-            return (0, "No BOM defined")
-        
-        max_quantities = []
-        
-        # Calculate max from component constraints
-        for bom in component_boms:
-            component = bom.component
-            spillage_multiplier = Decimal("1") + component.spillage_coefficient
-            required_per_unit = Decimal(str(bom.quantity_required)) * spillage_multiplier
-            
-            if required_per_unit > 0:
-                max_from_this_component = int(Decimal(str(component.in_stock)) / required_per_unit)
-            else:
-                max_from_this_component = 0
-            
-            max_quantities.append({
-                "name": component.name,
-                "max_units": max_from_this_component
-            })
-        
-        # Calculate max from nested product constraints
-        for product_bom in product_boms:
-            child_product = product_bom.child_product
-            
-            # Recursively get max producible for the nested product
-            child_max, _ = calculate_max_producible_recursive(
-                product_bom.child_product_id,
-                depth + 1
-            )
-            
-            # How many parent units can we make based on this child?
-            # If we need 2 child products per parent, and we can make 10 children,
-            # then we can make 10 / 2 = 5 parents
-            if product_bom.quantity_required > 0:
-                max_from_this_child = child_max // product_bom.quantity_required
-            else:
-                max_from_this_child = 0
-            
-            max_quantities.append({
-                "name": f"{child_product.name} (nested product)",
-                "max_units": max_from_this_child
-            })
+    Units built by to_stock orders arrive on their own when the order is
+    completed; this is for corrections and units built outside the system.
+    """
+    product = get_product_by_id(db, product_id)
+    
+    if not product:
+        raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
+    
+    new_stock = product.in_stock + adjustment
+    
+    if new_stock < 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid adjustment. Current stock: {product.in_stock}, Adjustment: {adjustment}, Result: {new_stock} (cannot be negative)"
+        )
+    
+    try:
+        # Guarded in SQL: orders may be taking units from this stock concurrently
+        adjusted = db.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.in_stock + adjustment >= 0)
+            .values(in_stock=Product.in_stock + adjustment)
+            .execution_options(synchronize_session=False)
+        ).rowcount
         
-        # The limiting factor is the minimum
-        if max_quantities:
-            limiting = min(max_quantities, key=lambda x: x["max_units"])
-            return (limiting["max_units"], limiting["name"])
-        else:
-            return (0, "No constraints found")
-    
-    # Calculate for all products
-    products = get_all_products(db)
-    capacity_list = []
-    
-    for product in products:
-        max_producible, limiting_component = calculate_max_producible_recursive(product.id)
+        if not adjusted:
+            raise HTTPException(status_code=409, detail="Stock changed during the adjustment, please retry")
         
-        capacity_list.append({
-            "id": product.id,
-            "name": product.name,
-            "in_progress": product.in_progress,
-            "shipped": product.shipped,
-            "max_producible": max_producible,
-            "limiting_component": limiting_component
-        })
-    
-    return capacity_list
+        db.commit()
+        bump_version("products")
+        db.refresh(product)
+        broker.publish(*product_stock_event(product))
+        return product
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise_if_retryable(e)
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+
+def calculate_production_capacity(db: Session, location_id: Optional[int] = None):
+    """
+    Calculate max producible units for every product, considering both
+    component constraints and nested product constraints (finished units
+    of a nested product in stock count towards its parents).
+    
+    Works on a bulk-loaded BOMGraph so the whole catalog costs one query per table.
+    With a location_id, only the stock held at that site counts.
+    """
+    return BOMGraph.load(db, location_id).production_capacity()
\ No newline at end of file
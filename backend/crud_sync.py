@@ -0,0 +1,13 @@
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Optional
+import queries
+
+def get_deleted_entities(db: Session, since: datetime, entity_type: Optional[str] = None):
+    """
+    Tombstones for components/products deleted at or after `since`.
+    
+    Delta sync clients combine these with the updated_since mode of the
+    list endpoints to drop rows that no longer exist.
+    """
+    return db.execute(queries.deleted_entities(since, entity_type)).scalars().all()
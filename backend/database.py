@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from contextvars import ContextVar
 from dotenv import load_dotenv
+import math
 import os
+import time
 
 # Load environment variables
 load_dotenv()
@@ -15,29 +21,178 @@ DB_PORT = os.getenv("DB_PORT", "3306")
 DB_NAME = os.getenv("DB_NAME", "stock_management")
 DATABASE_URL = os.getenv("DB_URL",f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 
-# Create SQLAlchemy engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={
-        "ssl": {
-            "ssl_mode": "REQUIRED"
-        }
-    },
-    pool_pre_ping=True,  # Verify connections before using
-    pool_recycle=3600,   # Recycle connections after 1 hour
-    echo=False            # Log SQL queries (set to False in production)
-)
+# Optional read replica for report/list endpoints (falls back to the primary)
+DB_READ_URL = os.getenv("DB_READ_URL")
+
+# After a write, that client's reads go to the primary for this many seconds so
+# it never sees replica lag on data it just changed. The client is told the time
+# of its last write (X-Last-Write header and cookie) and sends it back, so this
+# holds whichever worker its next read lands on.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+# How long to stop using the replica after it fails a connection check
+REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+
+
+def _create_engine(url):
+    # SSL is only meaningful for the MySQL driver; SQLite is used for local runs
+    connect_args = {"ssl": {"ssl_mode": "REQUIRED"}} if url.startswith("mysql") else {}
+
+    return create_engine(
+        url,
+        connect_args=connect_args,
+        pool_pre_ping=True,  # Verify connections before using
+        pool_recycle=3600,   # Recycle connections after 1 hour
+        echo=False            # Log SQL queries (set to False in production)
+    )
+
+
+# Create SQLAlchemy engines
+engine = _create_engine(DATABASE_URL)
+read_engine = _create_engine(DB_READ_URL) if DB_READ_URL else None
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine) if read_engine else None
 
 # Base class for models
 Base = declarative_base()
 
+LAST_WRITE_HEADER = "X-Last-Write"
+LAST_WRITE_COOKIE = "last_write"
+
+# Monotonic timestamp shared by all requests in this worker
+_replica_down_until = 0.0
+
+# Per request: {"at": unix time} once it committed a write (set by ReadYourWritesMiddleware)
+_request_writes = ContextVar("request_writes", default=None)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _mark_session_dirty(session, flush_context):
+    session.info["has_writes"] = True
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _mark_statement_write(orm_execute_state):
+    # Bulk UPDATE/INSERT/DELETE through the session (stock moves) skip the flush
+    if orm_execute_state.is_update or orm_execute_state.is_insert or orm_execute_state.is_delete:
+        orm_execute_state.session.info["has_writes"] = True
+
+
+def record_write():
+    """Mark the current request as having written (no-op outside a request)."""
+    writes = _request_writes.get()
+
+    if writes is not None:
+        writes["at"] = time.time()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_write(session):
+    if session.info.pop("has_writes", False):
+        record_write()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _clear_write_flag(session):
+    session.info.pop("has_writes", None)
+
+
+def mark_replica_unhealthy():
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+
+
+def replica_available(last_write_at: float = 0.0):
+    """
+    True when reads may go to the replica: one is configured, it has not failed
+    recently, and the client's last write (unix time) is outside the
+    read-your-writes window.
+    """
+    if ReadSessionLocal is None:
+        return False
+
+    if time.monotonic() < _replica_down_until:
+        return False
+
+    return time.time() - last_write_at >= READ_YOUR_WRITES_SECONDS
+
+
+def _last_write_at(request: Request):
+    # Header first (cross-origin API clients), then the cookie (same-origin browsers)
+    for value in (request.headers.get(LAST_WRITE_HEADER), request.cookies.get(LAST_WRITE_COOKIE)):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            continue
+
+    return 0.0
+
+
+class ReadYourWritesMiddleware:
+    """
+    Tells a client when it last wrote: responses to requests that committed a
+    write carry X-Last-Write and a matching cookie (unix time), which
+    get_read_db checks on the client's next reads.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Mutated in place by the threadpool threads, which run in copies of this context
+        writes = {}
+        token = _request_writes.set(writes)
+
+        async def send_marked(message: Message):
+            if message["type"] == "http.response.start" and "at" in writes:
+                value = f"{writes['at']:.3f}"
+                headers = MutableHeaders(scope=message)
+                headers[LAST_WRITE_HEADER] = value
+                headers.append(
+                    "Set-Cookie",
+                    f"{LAST_WRITE_COOKIE}={value}; Max-Age={math.ceil(READ_YOUR_WRITES_SECONDS)}; Path=/; SameSite=Lax"
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_marked)
+        finally:
+            _request_writes.reset(token)
+
+
 # Dependency to get database session
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Dependency for read-only endpoints (replica when healthy and the client has
+# not written recently, otherwise primary)
+def get_read_db(request: Request):
+    db = None
+
+    if replica_available(_last_write_at(request)):
+        db = ReadSessionLocal()
+        try:
+            db.connection()  # Checks out a connection (pre-ping) so failures surface here
+        except Exception:
+            db.close()
+            db = None
+            mark_replica_unhealthy()
+
+    if db is None:
+        db = SessionLocal()
+
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,153 @@
+from fastapi import Request
+import asyncio
+import itertools
+import json
+import os
+
+import cache
+from transactions import defer_until_commit
+
+# Comment line sent to idle subscribers so proxies keep the connection open
+HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+# Per-subscriber backlog; a subscriber that falls this far behind is told to resync
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+
+
+class EventBroker:
+    """
+    Fan-out of small change events to SSE subscribers on this worker's event loop.
+
+    Each subscriber is a bounded asyncio.Queue, so an idle subscriber costs one
+    queue and one suspended generator. publish() is thread-safe and is called by
+    the crud_* functions (which run in the threadpool) after their commit.
+
+    Writes made by other workers are detected through the cache_versions poll
+    and announced as coarse "invalidate" events naming the changed groups.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._loop = None
+        self._ids = itertools.count(1)
+        self._poller = None
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event_type: str, data: dict):
+        self.publish_many([(event_type, data)])
+
+    def publish_many(self, events):
+        # Cheap no-op while nobody listens
+        if not self._subscribers or self._loop is None or not events:
+            return
+
+        if defer_until_commit(self.publish_many, events):
+            return
+
+        messages = [{"id": next(self._ids), "type": event_type, "data": data} for event_type, data in events]
+
+        try:
+            self._loop.call_soon_threadsafe(self._fan_out, messages)
+        except RuntimeError:
+            # Event loop already closed (worker shutting down)
+            pass
+
+    def _fan_out(self, messages):
+        for queue in list(self._subscribers):
+            for message in messages:
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # Slow consumer: drop its backlog and ask it to refetch everything
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait({"id": next(self._ids), "type": "resync", "data": {}})
+                    break
+
+    async def _poll_other_workers(self):
+        loop = asyncio.get_running_loop()
+        _, seen = await loop.run_in_executor(None, cache.remote_changes)
+
+        while self._subscribers:
+            await asyncio.sleep(cache.CACHE_POLL_SECONDS)
+            changed, seen = await loop.run_in_executor(None, cache.remote_changes, seen)
+
+            if changed:
+                self._fan_out([{"id": next(self._ids), "type": "invalidate", "data": {"groups": sorted(changed)}}])
+
+        self._poller = None
+
+    async def stream(self, request: Request):
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll_other_workers())
+
+        try:
+            yield "retry: 3000\n\n"
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield f"id: {message['id']}\nevent: {message['type']}\ndata: {json.dumps(message['data'], default=str)}\n\n"
+        finally:
+            self._subscribers.discard(queue)
+
+
+broker = EventBroker()
+
+
+# Event payload helpers. Build these BEFORE db.commit() (objects are expired
+# afterwards) and publish them once the commit succeeded.
+
+def component_stock_event(component):
+    return ("component.stock", {
+        "id": component.id,
+        "in_stock": component.in_stock,
+        "in_progress": component.in_progress,
+        "shipped": component.shipped
+    })
+
+
+def product_stock_event(product):
+    return ("product.stock", {
+        "id": product.id,
+        "in_stock": product.in_stock,
+        "in_progress": product.in_progress,
+        "shipped": product.shipped
+    })
+
+
+def product_updated_event(product):
+    return ("product.updated", {
+        "id": product.id,
+        "name": product.name
+    })
+
+
+def order_status_event(order):
+    return ("order.status", {
+        "id": order.id,
+        "product_id": order.product_id,
+        "quantity": order.quantity,
+        "status": order.status.value
+    })
+
+
+def product_bom_event(product_id: int):
+    return ("product.bom", {"id": product_id})
+
+
+def deleted_event(entity_type: str, entity_id: int):
+    return (f"{entity_type}.deleted", {"id": entity_id})
@@ -0,0 +1,52 @@
+from fastapi.responses import JSONResponse
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; the json fallback writes the same bytes, only slower
+    orjson = None
+
+
+# Fast path for large list responses. The list endpoints fetch plain rows
+# (tuples turned into dicts in the response model's field order) and
+# return them as a FastJSONResponse, which skips FastAPI's per-row
+# response_model validation and serialization; the response_model stays
+# on the route for the OpenAPI docs.
+#
+# The output is byte-for-byte what FastAPI's JSONResponse would send for
+# the same model: compact separators, UTF-8 without \u escapes, Decimal as
+# its string, datetimes in isoformat, enums by value. Floats are the one
+# thing orjson writes differently (1e16 vs 1e+16), so rows sent this way
+# must not contain floats. bench_serialization.py checks both.
+
+
+def encode_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=encode_value)
+
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"), default=encode_value
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def row_dicts(rows, fields):
+    """Rows whose first columns are `fields`, in order, as dicts (extra trailing columns are dropped)."""
+    return [dict(zip(fields, row)) for row in rows]
@@ -0,0 +1,222 @@
+from collections import OrderedDict
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from database import engine
+from models import IdempotencyKey
+from transactions import deferred_commit, retry_reason
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How long a stored response is replayed for the same Idempotency-Key
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+# Recently stored responses kept in memory, so hot retries skip the table
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024"))
+
+# Expired rows are swept by whichever request claims a key after this interval
+IDEMPOTENCY_PURGE_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_SECONDS", "300"))
+
+_table = IdempotencyKey.__table__
+_last_purge = 0.0
+
+
+class ResponseLRU:
+    """Completed responses by (scope, key): (request_hash, status_code, body, expires_at)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key):
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            if entry[3] <= datetime.utcnow():
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return entry
+
+    def put(self, cache_key, entry):
+        with self._lock:
+            self._entries[cache_key] = entry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_responses = ResponseLRU(IDEMPOTENCY_CACHE_SIZE)
+
+
+def _request_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _replay(entry, request_hash):
+    stored_hash, status_code, body, _ = entry
+
+    if stored_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request"
+        )
+
+    return JSONResponse(content=json.loads(body), status_code=status_code, headers={"Idempotent-Replayed": "true"})
+
+
+def _claim(scope: str, key: str, request_hash: str):
+    """
+    Insert the in-progress row for (scope, key).
+
+    Returns None when this request now owns the key, or the stored
+    (request_hash, status_code, body, expires_at) entry to replay.
+    """
+    global _last_purge
+
+    now = datetime.utcnow()
+
+    if time.monotonic() - _last_purge >= IDEMPOTENCY_PURGE_SECONDS:
+        _last_purge = time.monotonic()
+        try:
+            purge_expired()
+        except Exception as e:
+            logger.warning("Could not purge expired idempotency keys: %s", e)
+
+    with engine.begin() as conn:
+        # An expired key is free to be used again
+        conn.execute(delete(_table).where(
+            _table.c.scope == scope, _table.c.idempotency_key == key, _table.c.expires_at <= now
+        ))
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(_table).values(
+                scope=scope,
+                idempotency_key=key,
+                request_hash=request_hash,
+                created_at=now,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+            ))
+        return None
+    except IntegrityError:
+        pass
+
+    with engine.connect() as conn:
+        row = conn.execute(select(_table).where(
+            _table.c.scope == scope, _table.c.idempotency_key == key
+        )).first()
+
+    if row is not None and row.status_code is not None:
+        return (row.request_hash, row.status_code, row.response_body, row.expires_at)
+
+    # Still running, or deleted between our insert and select. A claim is
+    # never taken over: its owner's write and response commit together, so
+    # only the owner knows whether the write happened.
+    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+
+def _release(scope: str, key: str):
+    try:
+        with engine.begin() as conn:
+            conn.execute(delete(_table).where(
+                _table.c.scope == scope, _table.c.idempotency_key == key, _table.c.status_code.is_(None)
+            ))
+    except Exception as e:
+        # Retries get 409 until the claim expires (IDEMPOTENCY_TTL_SECONDS)
+        logger.warning("Could not release idempotency key %s %s: %s", scope, key, e)
+
+
+def _store(db: Session, scope: str, key: str, request_hash: str, status_code: int, body: str):
+    """Record the response in the caller's transaction, so it commits with the write."""
+    expires_at = datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+
+    stored = db.execute(
+        update(_table)
+        .where(
+            _table.c.scope == scope,
+            _table.c.idempotency_key == key,
+            _table.c.request_hash == request_hash,
+            _table.c.status_code.is_(None)
+        )
+        .values(status_code=status_code, response_body=body, expires_at=expires_at)
+    ).rowcount
+
+    if not stored:
+        # Our claim is gone (expired and purged); roll the write back rather than risk a duplicate
+        raise HTTPException(status_code=409, detail="The Idempotency-Key claim was lost, nothing was changed; please retry")
+
+    return (request_hash, status_code, body, expires_at)
+
+
+def run_idempotent(db: Session, scope: str, key, payload, handler, response_model=None, status_code: int = 200):
+    """
+    Run `handler()` at most once per (scope, Idempotency-Key).
+
+    The first request claims the key and runs. Its commits on `db` are
+    deferred (transactions.deferred_commit) so the serialized response is
+    stored in the same transaction as the write: either both commit or
+    neither does. Retries with the same key and payload get that response
+    back (with an Idempotent-Replayed header) without running the handler
+    again; while the first request runs they get 409. Errors are not
+    stored, so a failed request can simply be retried. Without a key the
+    handler just runs.
+    """
+    if not key:
+        return handler()
+
+    request_hash = _request_hash(payload)
+
+    entry = _responses.get((scope, key))
+    if entry is not None:
+        return _replay(entry, request_hash)
+
+    entry = _claim(scope, key, request_hash)
+    if entry is not None:
+        _responses.put((scope, key), entry)
+        return _replay(entry, request_hash)
+
+    try:
+        with deferred_commit(db):
+            result = handler()
+
+            if response_model is not None:
+                content = response_model.model_validate(result).model_dump(mode="json")
+            else:
+                content = jsonable_encoder(result)
+
+            entry = _store(db, scope, key, request_hash, status_code, json.dumps(content))
+    except BaseException as e:
+        db.rollback()
+        _release(scope, key)
+
+        # The deferred commit itself can hit a deadlock; the whole request is safe to retry
+        if isinstance(e, Exception) and retry_reason(e) is not None:
+            raise HTTPException(
+                status_code=503,
+                detail="The database is busy with conflicting changes, please retry",
+                headers={"Retry-After": "1"}
+            ) from e
+        raise
+
+    _responses.put((scope, key), entry)
+
+    return JSONResponse(content=content, status_code=status_code)
+
+
+def purge_expired():
+    """Delete expired keys. Returns the number of rows removed."""
+    with engine.begin() as conn:
+        return conn.execute(delete(_table).where(_table.c.expires_at <= datetime.utcnow())).rowcount
@@ -0,0 +1,253 @@
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List
+from database import engine, SessionLocal
+from models import ReportJob
+from schemas import ProductCapacityResponse, ProcurementResponse, DashboardResponse, PendingFeasibilityResponse
+from cache import report_cache, shared_version
+import crud_products
+import crud_procurement
+import crud_dashboard
+import crud_orders
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Reports computed at the same time by this worker
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Jobs queued or running on this worker before new ones are refused with 429
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "16"))
+
+# How long a finished job (and its result) can be fetched
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "600"))
+
+# A queued/running job not finished after this long is assumed lost (worker died) and rerun
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))
+
+_table = ReportJob.__table__
+_last_purge = 0.0
+
+
+class Report:
+    def __init__(self, compute, response_type, cache_key):
+        self.compute = compute
+        self.adapter = TypeAdapter(response_type)
+        self.cache_key = cache_key
+
+
+def _located(name):
+    return lambda params: name if params.get("location_id") is None else f"{name}@{params['location_id']}"
+
+
+# Reports that can run as jobs. Cache keys match the synchronous endpoints,
+# so a job's result also serves the next GET, and a cached GET result makes
+# the job finish at once.
+REPORTS = {
+    "capacity": Report(
+        lambda db, params: crud_products.calculate_production_capacity(db, params.get("location_id")),
+        List[ProductCapacityResponse], _located("capacity")
+    ),
+    "procurement": Report(
+        lambda db, params: crud_procurement.calculate_procurement_needs(db, params.get("location_id")),
+        ProcurementResponse, _located("procurement")
+    ),
+    "dashboard": Report(
+        lambda db, params: crud_dashboard.get_dashboard(db),
+        DashboardResponse, lambda params: "dashboard"
+    ),
+    "feasibility": Report(
+        lambda db, params: crud_orders.get_pending_feasibility(db, params.get("order_by", "fifo")),
+        PendingFeasibilityResponse, lambda params: f"feasibility:{params.get('order_by', 'fifo')}"
+    ),
+}
+
+
+class JobRunner:
+    """
+    Runs report jobs on a bounded thread pool of this worker.
+
+    Job state lives in report_jobs, so GET /jobs/{id} works on any worker.
+    Requests for the same report, parameters and data version (the shared
+    cache_versions counters) get the same job: the first one inserts the
+    row and runs it, later ones, on any worker, just get its id. A thread
+    pool rather than processes keeps results in this worker's report cache
+    and sessions in one process.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-job")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, report: str, params: dict):
+        _purge_if_due()
+
+        params = {key: value for key, value in sorted(params.items()) if value is not None}
+        version = shared_version()
+        dedupe_key = hashlib.sha256(json.dumps([report, params, version]).encode()).hexdigest()
+
+        job_id = _claim(dedupe_key, report, params)
+        if job_id is None:
+            # Someone else is (or was) computing this version already
+            return get_job(_find(dedupe_key))
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                full = True
+            else:
+                full = False
+                self._pending += 1
+
+        if full:
+            _forget(job_id)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many report jobs are queued, please retry later",
+                headers={"Retry-After": "5"}
+            )
+
+        self._executor.submit(self._run, job_id, report, params)
+
+        return get_job(job_id)
+
+    def _run(self, job_id: str, report: str, params: dict):
+        definition = REPORTS[report]
+        db = SessionLocal()
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(update(_table).where(_table.c.id == job_id).values(status="running", started_at=datetime.utcnow()))
+
+            result = report_cache.get_or_compute(definition.cache_key(params), definition.compute, db, params)
+            # Same validation and shape as the endpoint's response_model
+            report_body = definition.adapter.validate_python(result, from_attributes=True)
+            body = json.dumps(definition.adapter.dump_python(report_body, mode="json"))
+            _finish(job_id, "succeeded", result=body)
+        except Exception as e:
+            logger.warning("Report job %s (%s) failed: %s", job_id, report, e)
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            try:
+                _finish(job_id, "failed", error=str(detail))
+            except Exception as store_error:
+                logger.warning("Could not record failure of report job %s: %s", job_id, store_error)
+        finally:
+            db.close()
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _claim(dedupe_key: str, report: str, params: dict):
+    """
+    Insert a queued job for `dedupe_key`. Returns its new id, or None when an
+    existing job (queued, running or succeeded) already covers the key.
+    """
+    now = datetime.utcnow()
+    job_id = uuid.uuid4().hex
+
+    with engine.begin() as conn:
+        # Expired and failed runs do not block a new one; neither do lost ones
+        conn.execute(delete(_table).where(
+            _table.c.dedupe_key == dedupe_key,
+            (_table.c.expires_at <= now)
+            | (_table.c.status == "failed")
+            | (_table.c.expires_at.is_(None) & (_table.c.created_at <= now - timedelta(seconds=JOB_STALE_SECONDS)))
+        ))
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(_table).values(
+                id=job_id,
+                dedupe_key=dedupe_key,
+                report=report,
+                params=json.dumps(params),
+                status="queued",
+                created_at=now
+            ))
+        return job_id
+    except IntegrityError:
+        return None
+
+
+def _find(dedupe_key: str):
+    with engine.connect() as conn:
+        job_id = conn.execute(select(_table.c.id).where(_table.c.dedupe_key == dedupe_key)).scalar()
+
+    if job_id is None:
+        # Removed between our insert and select; let the client retry
+        raise HTTPException(status_code=409, detail="A matching report job just finished or expired, please retry")
+
+    return job_id
+
+
+def _forget(job_id: str):
+    with engine.begin() as conn:
+        conn.execute(delete(_table).where(_table.c.id == job_id))
+
+
+def _finish(job_id: str, status: str, result=None, error=None):
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        conn.execute(
+            update(_table)
+            .where(_table.c.id == job_id)
+            .values(
+                status=status,
+                result=result,
+                error=error,
+                finished_at=now,
+                expires_at=now + timedelta(seconds=JOB_TTL_SECONDS)
+            )
+        )
+
+
+def _purge_if_due():
+    global _last_purge
+
+    if time.monotonic() - _last_purge < JOB_TTL_SECONDS:
+        return
+
+    _last_purge = time.monotonic()
+    try:
+        with engine.begin() as conn:
+            conn.execute(delete(_table).where(_table.c.expires_at <= datetime.utcnow()))
+    except Exception as e:
+        logger.warning("Could not purge expired report jobs: %s", e)
+
+
+def get_job(job_id: str):
+    with engine.connect() as conn:
+        row = conn.execute(select(_table).where(_table.c.id == job_id)).first()
+
+    if row is None or (row.expires_at is not None and row.expires_at <= datetime.utcnow()):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    return {
+        "id": row.id,
+        "report": row.report,
+        "params": json.loads(row.params),
+        "status": row.status,
+        "created_at": row.created_at,
+        "started_at": row.started_at,
+        "finished_at": row.finished_at,
+        "error": row.error,
+        "result": json.loads(row.result) if row.result is not None else None
+    }
+
+
+runner = JobRunner(JOB_WORKERS, JOB_MAX_PENDING)
@@ -0,0 +1,173 @@
+from sqlalchemy import and_, or_, false
+from fastapi import HTTPException
+from datetime import datetime
+from schemas import ListFilters
+import base64
+import json
+import operator
+import re
+
+import name_index
+import stock_slots
+from models import Component
+
+# Columns every list endpoint can sort on, on top of the model's counters
+SORTABLE_COLUMNS = ("id", "name", "created_at", "updated_at")
+COUNTER_COLUMNS = ("in_stock", "in_progress", "shipped")
+
+MAX_PAGE_SIZE = 1000
+
+# Column-to-column filters: "<counter><op><counter>", e.g. in_stock<in_progress
+_COMPARISON = re.compile(r"^\s*(\w+)\s*(<=|>=|<|>|=)\s*(\w+)\s*$")
+_OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "=": operator.eq}
+
+
+def _sort_spec(model, sort: str):
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+
+    if field not in SORTABLE_COLUMNS + COUNTER_COLUMNS or not hasattr(model, field):
+        raise HTTPException(status_code=400, detail=f"Cannot sort {model.__tablename__} by '{field}'")
+
+    return field, descending
+
+
+def _column(model, field: str):
+    # Component counters may be split over slot rows; filter and sort on the totals
+    if model is Component and field in stock_slots.COUNTERS:
+        return stock_slots.total_column(field)
+    return getattr(model, field)
+
+
+def _comparison(model, spec: str):
+    match = _COMPARISON.match(spec)
+    if match is None:
+        raise HTTPException(status_code=400, detail=f"Invalid comparison '{spec}', expected e.g. 'in_stock<in_progress'")
+
+    left, op, right = match.groups()
+    for field in (left, right):
+        if field not in COUNTER_COLUMNS or not hasattr(model, field):
+            raise HTTPException(status_code=400, detail=f"Cannot compare {model.__tablename__} on '{field}'")
+
+    return _OPERATORS[op](_column(model, left), _column(model, right))
+
+
+def encode_cursor(sort: str, value, row_id: int):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+
+    payload = json.dumps({"s": sort, "v": value, "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(model, cursor: str, sort: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        field, _ = _sort_spec(model, payload["s"])
+        value = payload["v"]
+
+        if value is not None and getattr(model, field).type.python_type is datetime:
+            value = datetime.fromisoformat(value)
+
+        row_id = int(payload["id"])
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if payload["s"] != sort:
+        raise HTTPException(status_code=400, detail="Cursor was issued for a different sort order")
+
+    return value, row_id
+
+
+def _effective_sort(filters: ListFilters):
+    # Pagination needs a stable order; default to id when the client gave none
+    if filters.sort:
+        return filters.sort
+    if filters.limit is not None or filters.cursor:
+        return "id"
+    return None
+
+
+def apply_list_filters(db, query, model, filters: ListFilters):
+    """
+    Apply search, range filters, sorting and keyset pagination to a list query.
+
+    Substring search (q) goes through the in-memory trigram index on name;
+    prefix search uses the name index in the database. Rows are ordered by
+    (sort column, id), which is also what the cursor resumes from.
+    """
+    if filters.prefix:
+        query = query.filter(model.name.startswith(filters.prefix, autoescape=True))
+
+    if filters.q:
+        matching_ids = name_index.search(model, filters.q)
+
+        if matching_ids is None:
+            # Too short for trigrams: fall back to a LIKE scan
+            query = query.filter(model.name.contains(filters.q, autoescape=True))
+        elif not matching_ids:
+            return query.filter(false())
+        else:
+            query = query.filter(model.id.in_(matching_ids))
+
+    for field in COUNTER_COLUMNS:
+        minimum = getattr(filters, f"{field}_min")
+        maximum = getattr(filters, f"{field}_max")
+
+        if minimum is None and maximum is None:
+            continue
+
+        if not hasattr(model, field):
+            raise HTTPException(status_code=400, detail=f"{model.__tablename__} have no '{field}' to filter on")
+
+        column = _column(model, field)
+        if minimum is not None:
+            query = query.filter(column >= minimum)
+        if maximum is not None:
+            query = query.filter(column <= maximum)
+
+    for spec in filters.compare:
+        query = query.filter(_comparison(model, spec))
+
+    sort = _effective_sort(filters)
+
+    if sort:
+        field, descending = _sort_spec(model, sort)
+        column = _column(model, field)
+
+        if filters.cursor:
+            value, row_id = decode_cursor(model, filters.cursor, sort)
+            if descending:
+                query = query.filter(or_(column < value, and_(column == value, model.id < row_id)))
+            else:
+                query = query.filter(or_(column > value, and_(column == value, model.id > row_id)))
+
+        if descending:
+            query = query.order_by(None).order_by(column.desc(), model.id.desc())
+        else:
+            query = query.order_by(None).order_by(column, model.id)
+
+    if filters.limit is not None:
+        query = query.limit(filters.limit)
+
+    return query
+
+
+def next_cursor(rows, filters: ListFilters):
+    """Cursor for the page after `rows`, or None when this was the last page."""
+    sort = _effective_sort(filters)
+
+    if filters.limit is None or len(rows) < filters.limit:
+        return None
+
+    last = rows[-1]
+    field = sort.lstrip("-")
+
+    # Rows may be ORM objects or plain dicts (see fast_json)
+    if isinstance(last, dict):
+        return encode_cursor(sort, last[field], last["id"])
+
+    return encode_cursor(sort, getattr(last, field), last.id)
@@ -1,28 +1,69 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, Query, Response, Header
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from database import engine, get_db, Base
+from contextlib import asynccontextmanager
+from database import engine, read_engine, get_db, get_read_db, Base, ReadYourWritesMiddleware
 import models
-from typing import List
+from typing import List, Optional, Literal
+from datetime import datetime, timezone
 from schemas import (ComponentResponse, ComponentCreate, ComponentUpdate,
     ProductResponse, ProductCreate, ProductUpdate, ProductDetailResponse,
     ProductCapacityResponse,HealthResponse, BOMItemCreate, OrderResponse, OrderCreate, 
     OrderDetailResponse, OrderSummaryResponse,ProcurementResponse, OrderRequirementsResponse,
-    ProductBOMItemCreate  
+    ProductBOMItemCreate, CacheStatsResponse, DashboardResponse, DeletedEntityResponse,
+    LivenessResponse, ReadinessResponse, ListFilters, ProductTreeResponse, PendingFeasibilityResponse,
+    OrderBatchRequest, OrderBatchResponse, LocationCreate, LocationResponse,
+    ComponentLocationsResponse, ArchiveRunResponse, JobResponse, TransactionStatsResponse,
+    ProfileSessionResponse, ProfilerStatusResponse
 )
+from cache import report_cache
+from events import broker
+from idempotency import run_idempotent
+from transactions import run_transaction, retry_stats
+from stock_coalescer import coalescer
+from warmup import warmup, pool_status
+from profiler import profiler, ProfiledRoute, PROFILER_MAX_SECONDS, list_files as list_profile_files, file_path as profile_file_path
 import crud_components
 import crud_products
 import crud_orders
 import crud_procurement
+import crud_dashboard
+import crud_sync
+import crud_locations
+import archive
+import versioning
+import jobs
+from listing import next_cursor, MAX_PAGE_SIZE
+from negotiation import response_format, list_response
+from compression import CompressionMiddleware
+import hmac
+import os
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the pool and report caches in the background; /readyz stays 503 until done
+    warmup.start()
+    yield
+    warmup.stop()
+    jobs.runner.shutdown()
+    engine.dispose()
+    if read_engine is not None:
+        read_engine.dispose()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="Stock Management System API",
     description="Production-ready API for managing components, products, and orders",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Every route can be sampled by the admin profiler (idle cost: one attribute read per request)
+app.router.route_class = ProfiledRoute
+
 # CORS middleware (allows frontend to call backend)
 # Replace the CORS middleware section with:
 app.add_middleware(
@@ -36,95 +77,333 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets browser clients read the version to send back as If-Match, the
+    # next page's cursor, and their last write time for read-your-writes
+    expose_headers=["ETag", "X-Next-Cursor", "X-Last-Write"],
 )
 
+# Marks responses to writes so the client's next reads skip the replica
+app.add_middleware(ReadYourWritesMiddleware)
+
+# gzip/brotli for large bodies (lists, reports); never the event stream
+app.add_middleware(CompressionMiddleware)
+
 # Create tables (in production, use Alembic migrations instead)
 # Base.metadata.create_all(bind=engine)  # Commented out - we use schema.sql
 
+def updated_since_param(
+    updated_since: Optional[datetime] = Query(None, description="Only return rows changed at or after this time (delta sync)")
+):
+    # Timestamps are stored naive; treat aware input as UTC
+    if updated_since is not None and updated_since.tzinfo is not None:
+        updated_since = updated_since.astimezone(timezone.utc).replace(tzinfo=None)
+    return updated_since
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Admin endpoints are off unless ADMIN_TOKEN is set
+    admin_token = os.getenv("ADMIN_TOKEN")
+    
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token header")
+
+
+def list_filters(
+    q: Optional[str] = Query(None, min_length=1, description="Case-insensitive substring of name"),
+    prefix: Optional[str] = Query(None, min_length=1, description="Name prefix"),
+    in_stock_min: Optional[int] = None,
+    in_stock_max: Optional[int] = None,
+    in_progress_min: Optional[int] = None,
+    in_progress_max: Optional[int] = None,
+    shipped_min: Optional[int] = None,
+    shipped_max: Optional[int] = None,
+    compare: List[str] = Query([], description="Counter compared with another counter, e.g. in_stock<in_progress (repeatable)"),
+    sort: Optional[str] = Query(None, description="Column to sort by, prefix with '-' for descending"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page")
+):
+    return ListFilters(
+        q=q, prefix=prefix,
+        in_stock_min=in_stock_min, in_stock_max=in_stock_max,
+        in_progress_min=in_progress_min, in_progress_max=in_progress_max,
+        shipped_min=shipped_min, shipped_max=shipped_max,
+        compare=compare, sort=sort, limit=limit, cursor=cursor
+    )
+
+
 @app.get("/")
 def read_root():
     return {
         "message": "Stock Management System API",
         "version": "1.0.0",
         "docs": "/docs",
-        "health": "/health"
+        "health": "/health",
+        "livez": "/livez",
+        "readyz": "/readyz"
     }
 
 @app.get("/health", response_model=HealthResponse)
 def health_check(db: Session = Depends(get_db)):
     try:
-        # Test database connection
+        # Test database connection (no table reads; probes should use /livez and /readyz)
         db.execute(text("SELECT 1"))
         
-        # Count tables
-        component_count = db.query(models.Component).count()
-        product_count = db.query(models.Product).count()
-        
         return HealthResponse(
             status="healthy",
             database="connected",
-            message=f"Database connected. Found {component_count} components and {product_count} products."
+            message=f"Database connected. Warmup: {warmup.state}."
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+
+@app.get("/livez", response_model=LivenessResponse)
+async def liveness():
+    """
+    Liveness probe: the process is up and its event loop answers. Never
+    touches the database, so a database outage does not restart workers.
+    """
+    return {"status": "alive"}
+
+
+@app.get("/readyz", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+def readiness():
+    """
+    Readiness probe: 200 once this worker has warmed up and the database
+    answers a `SELECT 1` (cached for READY_PING_SECONDS), otherwise 503.
+    
+    Reports the warmup steps and the connection pool counters; no tables
+    are read.
+    """
+    database_ok, database_error = warmup.ping()
+    ready = warmup.ready and database_ok
+    
+    pool = {"primary": pool_status(engine)}
+    if read_engine is not None:
+        pool["replica"] = pool_status(read_engine)
+    
+    content = {
+        "status": "ready" if ready else "not_ready",
+        "database": "connected" if database_ok else f"error: {database_error}",
+        "warmup": warmup.report(),
+        "pool": pool
+    }
+    
+    return JSONResponse(content=content, status_code=200 if ready else 503)
+
 # ===COMPONENTS ENDPOINTS===
 @app.get("/components", response_model=List[ComponentResponse])
-def get_components(db: Session = Depends(get_db)):
-    return crud_components.get_all_components(db)
+def get_components(
+    updated_since: Optional[datetime] = Depends(updated_since_param),
+    filters: ListFilters = Depends(list_filters),
+    fmt: str = Depends(response_format),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get components, optionally searched, filtered, sorted and paginated.
+    
+    When more rows exist the X-Next-Cursor response header holds the
+    cursor for the next page.
+    
+    Rows are encoded directly (fast_json) rather than through the
+    response_model, which only documents the shape. Columnar JSON and
+    MessagePack are available via Accept or ?format= (see negotiation.py).
+    """
+    components = crud_components.get_all_components(db, updated_since, filters)
+    
+    cursor = next_cursor(components, filters)
+    return list_response(
+        fmt, components, list(ComponentResponse.model_fields),
+        headers={"X-Next-Cursor": cursor} if cursor else None
+    )
 
 
 @app.get("/components/{component_id}", response_model=ComponentResponse)
-def get_component(component_id: int, db: Session = Depends(get_db)):
+def get_component(component_id: int, response: Response, db: Session = Depends(get_read_db)):
+    """
+    Get a single component. The ETag header carries its version for If-Match.
+    """
     component = crud_components.get_component_by_id(db, component_id)
     
     if not component:
         raise HTTPException(status_code=404, detail=f"Component with id {component_id} not found")
     
+    versioning.set_etag(response, component)
     return component
 
 
 @app.post("/components", response_model=ComponentResponse, status_code=201)
 def create_component(component: ComponentCreate, db: Session = Depends(get_db)):
-    return crud_components.create_component(db, component)
+    return run_transaction(db, crud_components.create_component, component)
 
 
 @app.put("/components/{component_id}", response_model=ComponentResponse)
-def update_component(component_id: int, component: ComponentUpdate, db: Session = Depends(get_db)):
-    return crud_components.update_component(db, component_id, component)
+def update_component(
+    component_id: int,
+    component: ComponentUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Update a component's name, spillage coefficient or stock.
+    
+    in_stock sets the unassigned pool; stock held at sites is not changed
+    (use adjust-stock with location_id for that). The response shows totals.
+    
+    Send the ETag from GET /components/{id} (or its version) as If-Match:
+    if the component was edited in the meantime the update is refused with
+    412 instead of overwriting that edit. Without If-Match the update is
+    unconditional.
+    """
+    updated = run_transaction(db, crud_components.update_component, component_id, component, if_match)
+    versioning.set_etag(response, updated)
+    return updated
 
 
 @app.delete("/components/{component_id}")
 def delete_component(component_id: int, db: Session = Depends(get_db)):
-    return crud_components.delete_component(db, component_id)
+    return run_transaction(db, crud_components.delete_component, component_id)
+
+
+@app.put("/components/{component_id}/stock-slots", response_model=ComponentResponse)
+def set_stock_slots(
+    component_id: int,
+    slots: int = Query(..., ge=0),
+    db: Session = Depends(get_db)
+):
+    """
+    Split a hot component's stock counters over `slots` rows.
+    
+    Concurrent allocations then update different rows instead of queueing
+    on one. Totals, and the component response, are unchanged; slots=0
+    folds the counters back into the component row.
+    """
+    return run_transaction(db, crud_components.set_stock_slots, component_id, slots)
+
+
+@app.patch("/components/{component_id}/adjust-stock", response_model=ComponentResponse)
+def adjust_stock(
+    component_id: int,
+    adjustment: int,
+    location_id: Optional[int] = Query(None, gt=0),
+    idempotency_key: Optional[str] = Header(None, max_length=128),
+    db: Session = Depends(get_db)
+):
+    """
+    Add (or with a negative value, remove) stock for a component.
+    
+    With location_id the stock is added to (or removed from) that site;
+    without it, the unassigned pool. The response shows the totals.
+    
+    Send an Idempotency-Key header to make retries safe: a repeated request
+    with the same key gets the first response back instead of adjusting twice.
+    
+    With STOCK_COALESCE_MS set, pool adjustments arriving within that window
+    are applied together in one transaction (see stock_coalescer.py).
+    Adjustments with an Idempotency-Key are not coalesced: their key is
+    stored in the adjustment's own transaction.
+    """
+    def apply():
+        if coalescer is not None and location_id is None and not idempotency_key:
+            return coalescer.submit(component_id, adjustment)
+        return run_transaction(db, crud_components.adjust_component_stock, component_id, adjustment, location_id)
+    
+    return run_idempotent(
+        db,
+        "PATCH /components/adjust-stock",
+        idempotency_key,
+        {"component_id": component_id, "adjustment": adjustment, "location_id": location_id},
+        apply,
+        response_model=ComponentResponse
+    )
+
+
+@app.get("/components/{component_id}/locations", response_model=ComponentLocationsResponse)
+def get_component_locations(component_id: int, db: Session = Depends(get_read_db)):
+    """
+    Stock of a component at each site, plus the unassigned pool.
+    """
+    return crud_locations.get_component_locations(db, component_id)
+
+# ===== LOCATION ENDPOINTS =====
 
+@app.get("/locations", response_model=List[LocationResponse])
+def get_locations(db: Session = Depends(get_read_db)):
+    return crud_locations.get_all_locations(db)
 
-@app.patch("/components/{component_id}/adjust-stock")
-def adjust_stock(component_id: int, adjustment: int, db: Session = Depends(get_db)):
-    return crud_components.adjust_component_stock(db, component_id, adjustment)
+
+@app.post("/locations", response_model=LocationResponse, status_code=201)
+def create_location(location: LocationCreate, db: Session = Depends(get_db)):
+    """
+    Create a site (warehouse, plant) that holds its own component stock.
+    
+    Stock arrives at a site through adjust-stock with location_id, and
+    orders placed with that location_id allocate from it first.
+    """
+    return run_transaction(db, crud_locations.create_location, location)
 
 # ===== PRODUCT ENDPOINTS =====
 
 @app.get("/products", response_model=List[ProductResponse])
-def get_products(db: Session = Depends(get_db)):
+def get_products(
+    updated_since: Optional[datetime] = Depends(updated_since_param),
+    filters: ListFilters = Depends(list_filters),
+    fmt: str = Depends(response_format),
+    db: Session = Depends(get_read_db)
+):
     """
     Get all products (without BOM details).
     
+    With updated_since, only products changed (including BOM replacements)
+    at or after that time are returned. Supports the same search, sort and
+    cursor pagination options and response formats as /components.
+    
     Returns:
         List of products with basic info
     """
-    return crud_products.get_all_products(db)
+    products = crud_products.get_all_products(db, updated_since, filters)
+    
+    cursor = next_cursor(products, filters)
+    return list_response(
+        fmt, products, list(ProductResponse.model_fields),
+        headers={"X-Next-Cursor": cursor} if cursor else None
+    )
 
 
 @app.get("/products/{product_id}", response_model=ProductDetailResponse)
-def get_product(product_id: int, db: Session = Depends(get_db)):
+def get_product(product_id: int, response: Response, db: Session = Depends(get_read_db)):
     """
     Get a single product with complete BOM details.
     
+    The ETag header carries the product's version for If-Match on
+    PUT /products/{id} and PUT /products/{id}/bom.
+    
     Returns:
         Product with BOM entries including component names, spillage, and calculated quantities
     """
-    return crud_products.get_product_with_bom(db, product_id)
+    product = crud_products.get_product_with_bom(db, product_id)
+    versioning.set_etag(response, product)
+    return product
+
+
+@app.get("/products/{product_id}/tree", response_model=ProductTreeResponse)
+def get_product_tree(
+    product_id: int,
+    quantity: int = Query(1, gt=0),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get the fully exploded multi-level BOM of a product.
+    
+    Returns per-level and cumulative quantities for `quantity` units,
+    spillage-adjusted totals per component line and for the whole tree,
+    and how well current stock covers them.
+    """
+    return crud_products.get_product_tree(db, product_id, quantity)
 
 
 @app.post("/products", response_model=ProductDetailResponse, status_code=201)
@@ -145,17 +424,28 @@ def create_product(product: ProductCreate, db: Session = Depends(get_db)):
       ]
     }
     """
-    return crud_products.create_product(db, product)
+    return run_transaction(db, crud_products.create_product, product)
 
 
 @app.put("/products/{product_id}", response_model=ProductResponse)
-def update_product(product_id: int, product: ProductUpdate, db: Session = Depends(get_db)):
+def update_product(
+    product_id: int,
+    product: ProductUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """
     Update a product's name.
     
     To update the BOM, use PUT /products/{product_id}/bom
+    
+    With If-Match (the product's ETag) the update is refused with 412 if
+    the product or its BOM was edited since it was read.
     """
-    return crud_products.update_product(db, product_id, product)
+    updated = run_transaction(db, crud_products.update_product, product_id, product, if_match)
+    versioning.set_etag(response, updated)
+    return updated
 
 
 @app.delete("/products/{product_id}")
@@ -164,10 +454,35 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     Delete a product and its BOM.
     
     Cannot delete if:
-    - Product has inventory in_progress or shipped
+    - Product has inventory in_stock, in_progress or shipped
     - Product has orders in the system
     """
-    return crud_products.delete_product(db, product_id)
+    return run_transaction(db, crud_products.delete_product, product_id)
+
+
+@app.patch("/products/{product_id}/adjust-stock", response_model=ProductResponse)
+def adjust_product_stock(
+    product_id: int,
+    adjustment: int,
+    idempotency_key: Optional[str] = Header(None, max_length=128),
+    db: Session = Depends(get_db)
+):
+    """
+    Add (or with a negative value, remove) finished units of a product.
+    
+    Orders for parent products take these units before building the
+    product from components. Build-ahead orders (to_stock) add to this
+    stock when completed; use this endpoint for stock counts and
+    corrections. Idempotency-Key works as on component adjustments.
+    """
+    return run_idempotent(
+        db,
+        "PATCH /products/adjust-stock",
+        idempotency_key,
+        {"product_id": product_id, "adjustment": adjustment},
+        lambda: run_transaction(db, crud_products.adjust_product_stock, product_id, adjustment),
+        response_model=ProductResponse
+    )
 
 
 @app.put("/products/{product_id}/bom", response_model=ProductDetailResponse)
@@ -175,18 +490,28 @@ def update_product_full_bom(
     product_id: int,
     component_bom: List[BOMItemCreate],
     product_bom: List[ProductBOMItemCreate],
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """
     Replace a product's complete BOM (both components and nested products).
     
     This deletes all existing BOM entries and creates new ones.
+    
+    With If-Match (the product's ETag) the BOM is only replaced if nobody
+    edited the product since it was read; otherwise 412.
     """
-    return crud_products.update_product_full_bom(db, product_id, component_bom, product_bom)
+    updated = run_transaction(db, crud_products.update_product_full_bom, product_id, component_bom, product_bom, if_match)
+    versioning.set_etag(response, updated)
+    return updated
 
 
 @app.get("/products/capacity/calculate", response_model=List[ProductCapacityResponse])
-def calculate_capacity(db: Session = Depends(get_db)):
+def calculate_capacity(
+    location_id: Optional[int] = Query(None, gt=0),
+    db: Session = Depends(get_db)
+):
     """
     Calculate production capacity for all products.
     
@@ -194,26 +519,69 @@ def calculate_capacity(db: Session = Depends(get_db)):
     with current component inventory, considering spillage.
     
     Also shows which component is the limiting factor for each product.
+    With location_id, only the stock held at that site is counted.
+    
+    Results are cached per inventory version, so repeated calls between
+    writes are served without recomputing. They are computed on the
+    primary: a lagging replica would file stale numbers under the new
+    version and serve them to every client until the next write.
     """
-    return crud_products.calculate_production_capacity(db)
-
+    if location_id is None:
+        return report_cache.get_or_compute("capacity", crud_products.calculate_production_capacity, db)
+    
+    crud_locations.get_location_by_id(db, location_id)
+    return report_cache.get_or_compute(
+        f"capacity@{location_id}", crud_products.calculate_production_capacity, db, location_id
+    )
 
 
 # ===== ORDER ENDPOINTS =====
 
 @app.get("/orders", response_model=OrderSummaryResponse)
-def get_orders(db: Session = Depends(get_db)):
+def get_orders(
+    updated_since: Optional[datetime] = Depends(updated_since_param),
+    fmt: str = Depends(response_format),
+    db: Session = Depends(get_read_db)
+):
     """
     Get all orders with summary statistics.
     
+    With updated_since, the list only contains orders whose status changed
+    at or after that time; the counts still cover every order.
+    
+    Only active orders are listed; archived orders (see POST
+    /admin/orders/archive) are included in the completed and total counts
+    and can still be fetched by id.
+    
+    In the columnar format (see /components) only the orders list is
+    turned into per-field arrays; the counts stay as they are.
+    
     Returns:
         Summary with counts by status and list of all orders
     """
-    return crud_orders.get_order_summary(db)
+    return list_response(
+        fmt, crud_orders.get_order_summary(db, updated_since), list(OrderResponse.model_fields), list_key="orders"
+    )
+
+
+@app.get("/orders/pending/feasibility", response_model=PendingFeasibilityResponse)
+def get_pending_feasibility(
+    order_by: Literal["fifo", "smallest_first"] = "fifo",
+    db: Session = Depends(get_db)
+):
+    """
+    Check all pending orders against the stock they compete for.
+    
+    Unlike /orders/{id}/requirements, each order only sees the stock left
+    after the orders ahead of it (oldest first, or smallest first), and is
+    marked allocatable, partially_blocked or blocked with its bottleneck.
+    Cached per inventory version like the capacity report.
+    """
+    return report_cache.get_or_compute(f"feasibility:{order_by}", crud_orders.get_pending_feasibility, db, order_by)
 
 
 @app.get("/orders/{order_id}", response_model=OrderDetailResponse)
-def get_order(order_id: int, db: Session = Depends(get_db)):
+def get_order(order_id: int, db: Session = Depends(get_read_db)):
     """
     Get a single order with full allocation details.
     
@@ -223,7 +591,11 @@ def get_order(order_id: int, db: Session = Depends(get_db)):
 
 
 @app.post("/orders", response_model=OrderDetailResponse, status_code=201)
-def create_order(order: OrderCreate, db: Session = Depends(get_db)):
+def create_order(
+    order: OrderCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=128),
+    db: Session = Depends(get_db)
+):
     """
     Create a new order with automatic inventory allocation.
     
@@ -231,23 +603,77 @@ def create_order(order: OrderCreate, db: Session = Depends(get_db)):
     1. Calculate required components from product BOM
     2. Apply spillage to each component
     3. Check if sufficient inventory exists
-    4. Allocate components (in_stock → in_progress)
+    4. Allocate components (in_stock → in_progress), from the order's
+       location_id first, then other sites, then the unassigned pool
     5. Update product inventory (in_progress++)
-    6. Create allocation records
+    6. Create allocation records (one per component and source)
     
     The entire operation is atomic - either all steps succeed or none do.
     
+    With "allow_partial": true and not enough stock for the full quantity,
+    the order is cut down to the largest buildable quantity and allocated,
+    and the remainder becomes a pending backorder linked by parent_order_id.
+    
     Example request:
     {
       "product_id": 1,
-      "quantity": 100
+      "quantity": 100,
+      "allow_partial": false,
+      "location_id": 2
     }
     
+    With an Idempotency-Key header, retries of the same request return the
+    stored response of the first one instead of creating another order.
+    
     Raises:
         404: Product not found or has no BOM
         400: Insufficient inventory
+        409: A request with the same Idempotency-Key is still running
+        422: The Idempotency-Key was used for a different request
+    """
+    return run_idempotent(
+        db,
+        "POST /orders",
+        idempotency_key,
+        order.model_dump(),
+        lambda: run_transaction(db, crud_orders.create_order, order),
+        response_model=OrderDetailResponse,
+        status_code=201
+    )
+
+
+@app.post("/orders/complete", response_model=OrderBatchResponse)
+def complete_orders(batch: OrderBatchRequest, db: Session = Depends(get_db)):
     """
-    return crud_orders.create_order(db, order)
+    Mark many orders as completed in one transaction.
+    
+    Same inventory moves as /orders/{id}/complete, summed per component and
+    product and applied in one statement per table. All or nothing.
+    
+    Example request:
+    {
+      "order_ids": [1, 2, 3]
+    }
+    
+    Raises:
+        404: Any order not found
+        400: Any order already completed
+    """
+    return run_transaction(db, crud_orders.complete_orders, batch.order_ids)
+
+
+@app.post("/orders/allocate", response_model=OrderBatchResponse)
+def allocate_orders(batch: OrderBatchRequest, db: Session = Depends(get_db)):
+    """
+    Allocate inventory to many pending orders in one transaction.
+    
+    Succeeds only if current stock covers all of them together.
+    
+    Raises:
+        404: Any order not found
+        400: Any order not pending, or insufficient inventory
+    """
+    return run_transaction(db, crud_orders.allocate_pending_orders, batch.order_ids)
 
 
 @app.post("/orders/{order_id}/complete", response_model=OrderDetailResponse)
@@ -263,7 +689,7 @@ def complete_order(order_id: int, db: Session = Depends(get_db)):
         404: Order not found
         400: Order already completed
     """
-    return crud_orders.complete_order(db, order_id)
+    return run_transaction(db, crud_orders.complete_order, order_id)
 
 @app.post("/orders/{order_id}/allocate", response_model=OrderDetailResponse)
 def allocate_order(order_id: int, db: Session = Depends(get_db)):
@@ -272,10 +698,10 @@ def allocate_order(order_id: int, db: Session = Depends(get_db)):
     
     Checks if sufficient inventory now exists and allocates if so.
     """
-    return crud_orders.allocate_pending_order(db, order_id)
+    return run_transaction(db, crud_orders.allocate_pending_order, order_id)
 
 @app.get("/orders/{order_id}/requirements", response_model=OrderRequirementsResponse)
-def get_order_requirements(order_id: int, db: Session = Depends(get_db)):
+def get_order_requirements(order_id: int, db: Session = Depends(get_read_db)):
     """
     Get component requirements for an order (for allocation preview).
     
@@ -286,14 +712,241 @@ def get_order_requirements(order_id: int, db: Session = Depends(get_db)):
 # ==== PROCUREMENT ENDPOINTS ====
 
 @app.get("/procurement/needs", response_model=ProcurementResponse)
-def get_procurement_needs(db: Session = Depends(get_db)):
+def get_procurement_needs(
+    location_id: Optional[int] = Query(None, gt=0),
+    db: Session = Depends(get_db)
+):
     """
     Calculate what components need to be ordered to fulfill all in_progress orders.
     
     Returns list of components with shortages and how much to order.
+    With location_id, covers that site's pending orders against that site's stock.
+    Cached per inventory version like the capacity report.
+    """
+    if location_id is None:
+        return report_cache.get_or_compute("procurement", crud_procurement.calculate_procurement_needs, db)
+    
+    crud_locations.get_location_by_id(db, location_id)
+    return report_cache.get_or_compute(
+        f"procurement@{location_id}", crud_procurement.calculate_procurement_needs, db, location_id
+    )
+
+# ==== SYNC ENDPOINTS ====
+
+@app.get("/deleted-entities", response_model=List[DeletedEntityResponse])
+def get_deleted_entities(
+    updated_since: Optional[datetime] = Depends(updated_since_param),
+    entity_type: Optional[Literal["component", "product"]] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Tombstones for deleted components/products, for delta sync clients.
+    
+    Use together with ?updated_since= on /components and /products.
+    """
+    if updated_since is None:
+        raise HTTPException(status_code=400, detail="updated_since is required")
+    
+    return crud_sync.get_deleted_entities(db, updated_since, entity_type)
+
+# ==== DASHBOARD ENDPOINTS ====
+
+@app.get("/dashboard", response_model=DashboardResponse)
+def get_dashboard(db: Session = Depends(get_db)):
+    """
+    Component inventory, production capacity, order counts with open orders,
+    and procurement needs in one response.
+    
+    Computed from a single bulk load and cached per inventory version, so the
+    dashboard needs one round-trip instead of four. The Inventory and
+    Procurement pages read their data from this response as well.
+    """
+    return report_cache.get_or_compute("dashboard", crud_dashboard.get_dashboard, db)
+
+# ==== EVENT STREAM ====
+
+@app.get("/events")
+async def stream_events(request: Request):
+    """
+    Server-sent events stream of inventory and order changes.
+    
+    Event types:
+    - component.stock: {id, in_stock, in_progress, shipped}
+    - component.deleted / product.deleted: {id}
+    - product.stock: {id, in_stock, in_progress, shipped}
+    - product.updated: {id, name}
+    - product.bom: {id} (BOM created or replaced; refetch the product)
+    - order.status: {id, product_id, quantity, status}
+    - invalidate: {groups} (another worker changed these groups; refetch them)
+    - resync: {} (this client fell behind; refetch everything)
+    """
+    return StreamingResponse(
+        broker.stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ==== JOB ENDPOINTS ====
+
+@app.post("/jobs/{report}", response_model=JobResponse, status_code=202)
+def submit_job(
+    report: Literal["capacity", "procurement", "dashboard", "feasibility"],
+    response: Response,
+    location_id: Optional[int] = Query(None, gt=0),
+    order_by: Optional[Literal["fifo", "smallest_first"]] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Compute a report in the background and return its job right away.
+    
+    Poll GET /jobs/{id} (see the Location header) until status is succeeded
+    or failed. Requests for the same report and parameters while the data is
+    unchanged share one job, on any worker, so a burst of clients costs a
+    single computation. location_id applies to capacity and procurement,
+    order_by to feasibility.
+    
+    Returns 429 with Retry-After when this worker already has JOB_MAX_PENDING
+    jobs queued or running.
+    """
+    params = {}
+    if report in ("capacity", "procurement") and location_id is not None:
+        crud_locations.get_location_by_id(db, location_id)
+        params["location_id"] = location_id
+    if report == "feasibility":
+        params["order_by"] = order_by or "fifo"
+    
+    job = jobs.runner.submit(report, params)
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: str):
+    """
+    Status of a report job, with the report once it has succeeded.
+    
+    Finished jobs are kept for JOB_TTL_SECONDS, then return 404.
+    """
+    return jobs.get_job(job_id)
+
+# ==== CACHE ENDPOINTS ====
+
+@app.get("/cache/stats", response_model=CacheStatsResponse)
+def get_cache_stats():
+    """
+    Hit/miss statistics for the report cache of this worker.
+    """
+    return report_cache.stats()
+
+# ==== TRANSACTION ENDPOINTS ====
+
+@app.get("/transactions/stats", response_model=TransactionStatsResponse)
+def get_transaction_stats():
+    """
+    Retry counters for the write endpoints of this worker.
+    
+    Deadlocks, lock-wait timeouts and stale versions make a write run again
+    from the start after a short backoff; `exhausted` counts writes that
+    still failed after TX_RETRY_ATTEMPTS and were answered with 503.
+    """
+    return retry_stats.snapshot()
+
+# ==== ADMIN ENDPOINTS ====
+
+@app.post("/admin/orders/archive", response_model=ArchiveRunResponse, dependencies=[Depends(require_admin)])
+def archive_orders(
+    older_than_days: Optional[int] = Query(None, ge=0),
+    batch_size: Optional[int] = Query(None, ge=1, le=10000),
+    max_batches: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    """
+    Move completed orders older than older_than_days (default
+    ORDER_ARCHIVE_AFTER_DAYS) and their allocations to the archive tables.
+    
+    Works in batches of batch_size orders, each committed on its own, so an
+    interrupted run loses nothing and the next call resumes. With
+    max_batches the run stops early and reports complete=false.
+    
+    Requires the X-Admin-Token header to match ADMIN_TOKEN.
+    """
+    return archive.archive_completed_orders(db, older_than_days, batch_size, max_batches)
+
+
+@app.post("/admin/profiler/start", response_model=ProfileSessionResponse, dependencies=[Depends(require_admin)])
+def start_profiler(
+    seconds: float = Query(30, gt=0, le=PROFILER_MAX_SECONDS),
+    routes: Optional[List[str]] = Query(None, description='Route templates to profile, e.g. "/products/capacity/calculate" or "POST /orders" (default: all)'),
+    fraction: float = Query(1.0, gt=0, le=1, description="Share of matching requests that are sampled"),
+    interval_ms: Optional[float] = Query(None, ge=1, le=100)
+):
+    """
+    Start a sampling profiler on this worker for `seconds`.
+    
+    Without routes every request in the window is profiled; with routes only
+    those, and with fraction < 1 only that share of them, which keeps the
+    overhead low enough for production traffic. When the window ends (or on
+    POST /admin/profiler/stop) a collapsed-stack file and a speedscope file,
+    with one flamegraph per route, are written for download.
+    
+    Only one session runs at a time per worker (409 otherwise). With several
+    workers, each request reaches one of them; start it on each or run one
+    worker while profiling.
+    
+    Requires the X-Admin-Token header to match ADMIN_TOKEN.
     """
-    return crud_procurement.calculate_procurement_needs(db)
+    session = profiler.start(seconds, interval_ms, routes, fraction)
+    
+    if session is None:
+        raise HTTPException(status_code=409, detail="A profiling session is already running on this worker")
+    
+    return session.summary()
+
+
+@app.post("/admin/profiler/stop", response_model=ProfileSessionResponse, dependencies=[Depends(require_admin)])
+def stop_profiler():
+    """
+    End the running profiling session early and write its files.
+    
+    Requires the X-Admin-Token header to match ADMIN_TOKEN.
+    """
+    session = profiler.stop()
+    
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session has been started on this worker")
+    
+    return session.summary()
+
 
+@app.get("/admin/profiler", response_model=ProfilerStatusResponse, dependencies=[Depends(require_admin)])
+def get_profiler_status():
+    """
+    The current (or last) profiling session of this worker and the profile
+    files available for download.
+    
+    Requires the X-Admin-Token header to match ADMIN_TOKEN.
+    """
+    return {
+        "session": profiler.session.summary() if profiler.session is not None else None,
+        "files": list_profile_files()
+    }
+
+
+@app.get("/admin/profiler/files/{name}", dependencies=[Depends(require_admin)])
+def download_profile(name: str):
+    """
+    Download a profile file. Open .speedscope.json files at
+    https://www.speedscope.app; .collapsed files work with flamegraph.pl,
+    inferno or speedscope.
+    
+    Requires the X-Admin-Token header to match ADMIN_TOKEN.
+    """
+    path = profile_file_path(name)
+    
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile file {name} not found")
+    
+    return FileResponse(path, filename=name)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DECIMAL, TIMESTAMP, Enum, ForeignKey, CheckConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, DECIMAL, TIMESTAMP, Enum, ForeignKey, CheckConstraint, UniqueConstraint, Index, false
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -21,9 +21,15 @@ class Component(Base):
     in_stock = Column(Integer, default=0)
     in_progress = Column(Integer, default=0)
     shipped = Column(Integer, default=0)
+    # > 0: counters are split over this many component_stock_slots rows (see stock_slots.py)
+    stock_slots = Column(Integer, nullable=False, default=0, server_default="0")
+    # Edit counter for If-Match; bumped by edits only, checked on every ORM update (see versioning.py)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
+    
     # Relationships
     bom_entries = relationship("BillOfMaterials", back_populates="component")
     allocations = relationship("OrderAllocation", back_populates="component")
@@ -32,6 +38,53 @@ class Component(Base):
     __table_args__ = (
         CheckConstraint('spillage_coefficient >= 0 AND spillage_coefficient <= 9.9999', name='check_spillage_range'),
         CheckConstraint('in_stock >= 0 AND in_progress >= 0 AND shipped >= 0', name='check_component_quantities'),
+        Index('idx_components_updated_at', 'updated_at', 'id'),
+    )
+
+
+class ComponentStockSlot(Base):
+    __tablename__ = "component_stock_slots"
+    
+    # One of a sharded component's N counter rows; totals are the component row plus all slots
+    component_id = Column(Integer, ForeignKey("components.id", ondelete="CASCADE"), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    in_stock = Column(Integer, nullable=False, default=0)
+    in_progress = Column(Integer, nullable=False, default=0)
+    shipped = Column(Integer, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (
+        CheckConstraint('in_stock >= 0 AND in_progress >= 0 AND shipped >= 0', name='check_stock_slot_quantities'),
+        Index('idx_component_stock_slots_updated_at', 'updated_at'),
+    )
+
+
+class Location(Base):
+    __tablename__ = "locations"
+    
+    # A warehouse / site holding its own component stock
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    name = Column(String(255), unique=True, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+
+class ComponentLocation(Base):
+    __tablename__ = "component_locations"
+    
+    # Stock of one component at one location; counted in the component's totals
+    component_id = Column(Integer, ForeignKey("components.id", ondelete="CASCADE"), primary_key=True)
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="RESTRICT"), primary_key=True)
+    in_stock = Column(Integer, nullable=False, default=0)
+    in_progress = Column(Integer, nullable=False, default=0)
+    shipped = Column(Integer, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+    
+    location = relationship("Location")
+    
+    __table_args__ = (
+        CheckConstraint('in_stock >= 0 AND in_progress >= 0 AND shipped >= 0', name='check_component_location_quantities'),
+        Index('idx_component_locations_location', 'location_id'),
+        Index('idx_component_locations_updated_at', 'updated_at'),
     )
 
 
@@ -40,11 +93,18 @@ class Product(Base):
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String(255), unique=True, nullable=False, index=True)
+    # Finished units on the shelf (built ahead by to_stock orders); parent
+    # products' orders take these before building the child from components
+    in_stock = Column(Integer, nullable=False, default=0, server_default="0")
     in_progress = Column(Integer, default=0)
     shipped = Column(Integer, default=0)
+    # Edit counter for If-Match, as on components
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
+    
     # Relationships
     bom_entries = relationship("BillOfMaterials", back_populates="product", cascade="all, delete-orphan")
     orders = relationship("Order", back_populates="product")
@@ -52,7 +112,8 @@ class Product(Base):
     
     # Constraints
     __table_args__ = (
-        CheckConstraint('in_progress >= 0 AND shipped >= 0', name='check_product_quantities'),
+        CheckConstraint('in_stock >= 0 AND in_progress >= 0 AND shipped >= 0', name='check_product_quantities'),
+        Index('idx_products_updated_at', 'updated_at', 'id'),
     )
 
 
@@ -71,6 +132,8 @@ class BillOfMaterials(Base):
     # Constraints
     __table_args__ = (
         CheckConstraint('quantity_required > 0', name='check_quantity_positive'),
+        UniqueConstraint('product_id', 'component_id', name='unique_product_component'),
+        Index('idx_bill_of_materials_component_id', 'component_id'),
     )
 
 class ProductBOM(Base):
@@ -87,6 +150,8 @@ class ProductBOM(Base):
     __table_args__ = (
         CheckConstraint('quantity_required > 0', name='check_product_quantity_positive'),
         CheckConstraint('parent_product_id != child_product_id', name='check_no_self_reference'),
+        UniqueConstraint('parent_product_id', 'child_product_id', name='unique_parent_child'),
+        Index('idx_product_bom_child_product_id', 'child_product_id'),
     )
 
 
@@ -101,14 +166,36 @@ class Order(Base):
 
     created_at = Column(TIMESTAMP, server_default=func.now())
     completed_at = Column(TIMESTAMP, nullable=True)
+    status_changed_at = Column(TIMESTAMP, server_default=func.now())  # For delta sync
+    
+    # Set on the backorder created for the unbuilt remainder of a partial fill
+    parent_order_id = Column(Integer, ForeignKey("orders.id", ondelete="SET NULL"), nullable=True)
+    
+    # Site the order ships from; its stock is used first when allocating
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="RESTRICT"), nullable=True)
+    
+    # Build-ahead order: completed units go to the product's in_stock, not shipped
+    to_stock = Column(Boolean, nullable=False, default=False, server_default=false())
     
     # Relationships
     product = relationship("Product", back_populates="orders")
     allocations = relationship("OrderAllocation", back_populates="order", cascade="all, delete-orphan")
+    product_allocations = relationship("OrderProductAllocation", back_populates="order", cascade="all, delete-orphan")
+    parent_order = relationship("Order", remote_side=[id], back_populates="backorders")
+    backorders = relationship("Order", back_populates="parent_order")
     
     # Constraints
     __table_args__ = (
         CheckConstraint('quantity > 0', name='check_order_quantity_positive'),
+        Index('idx_orders_status_changed_at', 'status_changed_at', 'id'),
+        # Pending queue (FIFO), open orders and status counts
+        Index('idx_orders_status_created_at', 'status', 'created_at'),
+        # Archive scan (see archive.py)
+        Index('idx_orders_status_completed_at', 'status', 'completed_at'),
+        Index('idx_orders_product_id', 'product_id'),
+        Index('idx_orders_parent_order_id', 'parent_order_id'),
+        # Archived ids must never be handed out again (MySQL 8 already keeps the counter)
+        {"sqlite_autoincrement": True},
     )
 
 
@@ -119,6 +206,8 @@ class OrderAllocation(Base):
     order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
     component_id = Column(Integer, ForeignKey("components.id"), nullable=False)
     quantity_allocated = Column(Integer, nullable=False)
+    # Site the units were taken from (NULL = unassigned pool)
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="RESTRICT"), nullable=True)
     
     # Relationships
     order = relationship("Order", back_populates="allocations")
@@ -127,4 +216,170 @@ class OrderAllocation(Base):
     # Constraints
     __table_args__ = (
         CheckConstraint('quantity_allocated > 0', name='check_allocation_positive'),
-    )
\ No newline at end of file
+        Index('idx_order_allocations_order_id', 'order_id'),
+        Index('idx_order_allocations_component_id', 'component_id'),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class OrderProductAllocation(Base):
+    __tablename__ = "order_product_allocations"
+    
+    # Finished units of a nested product taken from its in_stock for an order
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="RESTRICT"), nullable=False)
+    quantity_allocated = Column(Integer, nullable=False)
+    
+    # Relationships
+    order = relationship("Order", back_populates="product_allocations")
+    product = relationship("Product")
+    
+    # Constraints
+    __table_args__ = (
+        CheckConstraint('quantity_allocated > 0', name='check_product_allocation_positive'),
+        Index('idx_order_product_allocations_order_id', 'order_id'),
+        Index('idx_order_product_allocations_product_id', 'product_id'),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class ArchivedOrder(Base):
+    __tablename__ = "archived_orders"
+    
+    # Completed orders moved out of `orders` by archive.py; same columns, same ids
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="RESTRICT"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    status = Column(Enum(OrderStatus, name="orderstatus", values_callable=lambda e: [m.value for m in e]), nullable=False)
+    created_at = Column(TIMESTAMP, nullable=True)
+    completed_at = Column(TIMESTAMP, nullable=True)
+    status_changed_at = Column(TIMESTAMP, nullable=True)
+    # Not a foreign key: the parent may still be in `orders` or already archived
+    parent_order_id = Column(Integer, nullable=True)
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="RESTRICT"), nullable=True)
+    to_stock = Column(Boolean, nullable=False, default=False, server_default=false())
+    archived_at = Column(TIMESTAMP, server_default=func.now())
+    
+    # Relationships
+    product = relationship("Product")
+    allocations = relationship("ArchivedOrderAllocation", back_populates="order", order_by="ArchivedOrderAllocation.id")
+    product_allocations = relationship(
+        "ArchivedOrderProductAllocation", back_populates="order", order_by="ArchivedOrderProductAllocation.id"
+    )
+    
+    __table_args__ = (
+        Index('idx_archived_orders_parent_order_id', 'parent_order_id'),
+        Index('idx_archived_orders_product_id', 'product_id'),
+    )
+
+
+class ArchivedOrderAllocation(Base):
+    __tablename__ = "archived_order_allocations"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_id = Column(Integer, ForeignKey("archived_orders.id", ondelete="CASCADE"), nullable=False)
+    component_id = Column(Integer, ForeignKey("components.id"), nullable=False)
+    quantity_allocated = Column(Integer, nullable=False)
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="RESTRICT"), nullable=True)
+    
+    # Relationships
+    order = relationship("ArchivedOrder", back_populates="allocations")
+    component = relationship("Component")
+    
+    __table_args__ = (
+        Index('idx_archived_order_allocations_order_id', 'order_id'),
+    )
+
+
+class ArchivedOrderProductAllocation(Base):
+    __tablename__ = "archived_order_product_allocations"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_id = Column(Integer, ForeignKey("archived_orders.id", ondelete="CASCADE"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="RESTRICT"), nullable=False)
+    quantity_allocated = Column(Integer, nullable=False)
+    
+    # Relationships
+    order = relationship("ArchivedOrder", back_populates="product_allocations")
+    product = relationship("Product")
+    
+    __table_args__ = (
+        Index('idx_archived_order_product_allocations_order_id', 'order_id'),
+    )
+
+
+class ArchiveStat(Base):
+    __tablename__ = "archive_stats"
+    
+    # Running totals kept by archive.py, so counts never scan the archive tables
+    table_name = Column(String(64), primary_key=True)
+    rows_archived = Column(BigInteger, nullable=False, default=0)
+    last_archived_at = Column(TIMESTAMP, nullable=True)
+
+
+class DeletedEntity(Base):
+    __tablename__ = "deleted_entities"
+    
+    # Tombstones written by delete_component/delete_product for delta sync clients
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    entity_type = Column(String(32), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(TIMESTAMP, server_default=func.now())
+    
+    __table_args__ = (
+        Index('idx_deleted_entities_type_time', 'entity_type', 'deleted_at'),
+        # Since-queries without a type filter cannot use the index above
+        Index('idx_deleted_entities_time', 'deleted_at'),
+    )
+
+
+class CacheVersion(Base):
+    __tablename__ = "cache_versions"
+    
+    # One row per entity group (components, products, orders); bumped on every write
+    entity_group = Column(String(32), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    
+    # Client-chosen Idempotency-Key, scoped per endpoint
+    scope = Column(String(64), primary_key=True)
+    idempotency_key = Column(String(128), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    
+    # NULL while the first request is still running
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    
+    created_at = Column(TIMESTAMP, nullable=False)
+    expires_at = Column(TIMESTAMP, nullable=False)
+    
+    __table_args__ = (
+        Index('idx_idempotency_keys_expires_at', 'expires_at'),
+    )
+
+
+class ReportJob(Base):
+    __tablename__ = "report_jobs"
+    
+    # Background report runs (see jobs.py); shared by all workers so any of them can answer GET /jobs/{id}
+    id = Column(String(32), primary_key=True)
+    # Hash of (report, parameters, data version); one run per key
+    dedupe_key = Column(String(64), nullable=False, unique=True)
+    report = Column(String(32), nullable=False)
+    params = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP, nullable=False)
+    started_at = Column(TIMESTAMP, nullable=True)
+    finished_at = Column(TIMESTAMP, nullable=True)
+    # NULL while queued or running
+    expires_at = Column(TIMESTAMP, nullable=True)
+    
+    __table_args__ = (
+        Index('idx_report_jobs_expires_at', 'expires_at'),
+    )
@@ -0,0 +1,83 @@
+from sqlalchemy import select
+import threading
+import time
+
+import cache
+from database import SessionLocal
+
+# Minimum query length served by the index; shorter queries fall back to LIKE
+TRIGRAM = 3
+
+
+def _trigrams(text: str):
+    return {text[i:i + TRIGRAM] for i in range(len(text) - TRIGRAM + 1)}
+
+
+class TrigramIndex:
+    """
+    Case-insensitive substring index over (id, name) pairs.
+
+    A query's trigrams are intersected (rarest first) to get candidates,
+    which are then verified with a plain substring check.
+    """
+
+    def __init__(self, rows):
+        self.names = {}
+        self.postings = {}
+
+        for row_id, name in rows:
+            lowered = name.lower()
+            self.names[row_id] = lowered
+            for trigram in _trigrams(lowered):
+                self.postings.setdefault(trigram, set()).add(row_id)
+
+    def search(self, text: str):
+        needle = text.lower()
+        postings = sorted((self.postings.get(t, set()) for t in _trigrams(needle)), key=len)
+
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+
+        return sorted(row_id for row_id in candidates if needle in self.names[row_id])
+
+
+# One index per table, rebuilt when the catalog version changes (or after CACHE_MAX_AGE_SECONDS).
+# Always built from the primary: an index built from a lagging replica would
+# be kept for the whole catalog version, missing the rows the replica lacked.
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_index(model):
+    version = cache.current_version("catalog")
+    key = model.__tablename__
+
+    with _lock:
+        entry = _indexes.get(key)
+        if entry is not None and entry[0] == version and not cache.expired(entry[2]):
+            return entry[1]
+
+    built_at = time.monotonic()
+    db = SessionLocal()
+    try:
+        index = TrigramIndex(db.execute(select(model.id, model.name)).all())
+    finally:
+        db.close()
+
+    with _lock:
+        _indexes[key] = (version, index, built_at)
+
+    return index
+
+
+def search(model, text: str):
+    """
+    Ids of rows whose name contains `text`, or None if `text` is too short for the index.
+    """
+    if len(text) < TRIGRAM:
+        return None
+
+    return get_index(model).search(text)
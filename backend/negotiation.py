@@ -0,0 +1,103 @@
+from fastapi import HTTPException, Query, Request, Response
+from typing import Optional, Literal
+from fast_json import FastJSONResponse, encode_value
+
+try:
+    import msgpack
+except ImportError:  # Optional: without it only the JSON formats are offered
+    msgpack = None
+
+
+# Response formats of the list endpoints (/components, /products, /orders),
+# picked by ?format= or else the Accept header:
+#
+#   json      application/json, the default and the documented contract
+#   columnar  application/vnd.stock.columnar+json: one array per field,
+#             {"id": [1, 2], "name": ["Wheels", "Axle"], ...}, so keys
+#             are not repeated per row
+#   msgpack   application/msgpack: the json layout in MessagePack
+#
+# Values are encoded as in the JSON contract (Decimal and datetimes as
+# strings) in every format.
+
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_MEDIA_TYPE = "application/vnd.stock.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+_FORMATS_BY_MEDIA_TYPE = {
+    JSON_MEDIA_TYPE: "json",
+    COLUMNAR_MEDIA_TYPE: "columnar",
+    MSGPACK_MEDIA_TYPE: "msgpack",
+    "application/x-msgpack": "msgpack",
+}
+
+
+def _available(response_format: str):
+    return response_format != "msgpack" or msgpack is not None
+
+
+def _from_accept(accept: Optional[str]):
+    # Highest q wins, the earlier entry on a tie; */* and unknown types mean JSON
+    best, best_q = "json", 0.0
+
+    for part in (accept or "").split(","):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        response_format = _FORMATS_BY_MEDIA_TYPE.get(media_type.lower())
+
+        if response_format is None or not _available(response_format):
+            continue
+
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        if q > best_q:
+            best, best_q = response_format, q
+
+    return best
+
+
+def response_format(
+    request: Request,
+    format: Optional[Literal["json", "columnar", "msgpack"]] = Query(
+        None, description="Response format; overrides the Accept header (application/vnd.stock.columnar+json, application/msgpack)"
+    )
+):
+    """Dependency: the list format asked for."""
+    if format is not None:
+        if not _available(format):
+            raise HTTPException(status_code=406, detail="MessagePack responses are not available on this server")
+        return format
+
+    return _from_accept(request.headers.get("accept"))
+
+
+def columnar(rows, fields):
+    return {field: [row[field] for row in rows] for field in fields}
+
+
+def list_response(response_format: str, content, fields, list_key: Optional[str] = None, headers: Optional[dict] = None):
+    """
+    Response for a list endpoint in the negotiated format. `content` is a
+    list of row dicts (fast_json rows), or a dict holding one under
+    `list_key`; `fields` are the row fields, in order.
+    """
+    headers = {**(headers or {}), "Vary": "Accept"}
+
+    if response_format == "columnar":
+        if list_key is None:
+            content = columnar(content, fields)
+        else:
+            content = {**content, list_key: columnar(content[list_key], fields)}
+        return FastJSONResponse(content, media_type=COLUMNAR_MEDIA_TYPE, headers=headers)
+
+    if response_format == "msgpack":
+        body = msgpack.packb(content, default=encode_value, use_bin_type=True)
+        return Response(body, media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+
+    return FastJSONResponse(content, headers=headers)
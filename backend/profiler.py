@@ -0,0 +1,333 @@
+from fastapi.routing import APIRoute
+from contextvars import ContextVar
+from collections import Counter
+from datetime import datetime
+from typing import Optional, List
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Where finished profiles are written (per worker; files carry the pid)
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "stock-profiles"))
+
+# Default time between samples, and the longest session that can be started
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_SECONDS = int(os.getenv("PROFILER_MAX_SECONDS", "300"))
+
+# Profiles kept in PROFILE_DIR; older ones are deleted when a session ends
+PROFILER_KEEP_FILES = int(os.getenv("PROFILER_KEEP_FILES", "20"))
+
+# Never profiled: the profiler's own endpoints and the long-lived event stream
+_EXCLUDED_PREFIXES = ("/admin", "/events")
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+# The sampled request this context belongs to; copied into the threadpool with the context
+_current_request = ContextVar("profiled_request", default=None)
+
+
+# Sampling profiler for finding where request time goes in production
+# (Decimal math, ORM hydration, pydantic, waiting on the database).
+#
+# Every route is a ProfiledRoute. While no session runs, all it does per
+# request is read one attribute. During a session, requests on the chosen
+# routes are picked with probability `fraction`. A picked request registers
+# its handler frame (event loop thread: validation, serialization) and its
+# endpoint frame (threadpool thread: the endpoint itself). A sampler thread
+# wakes every interval, looks at every thread's stack via
+# sys._current_frames(), and counts the part of each stack above a
+# registered frame under that request's route. Nothing is traced per call,
+# so overhead scales with the interval, not with the code being profiled.
+
+
+class ProfileSession:
+    def __init__(self, seconds: float, interval_ms: float, routes: Optional[List[str]], fraction: float):
+        self.started_at = datetime.utcnow()
+        self.seconds = seconds
+        self.interval_ms = interval_ms
+        self.routes = routes
+        self.fraction = fraction
+        self.ends_at = time.monotonic() + seconds
+        self.stacks = Counter()
+        self.frames = {}
+        self.samples = 0
+        self.requests = 0
+        self.files = []
+        self.stopped = threading.Event()
+        self._matches = [_parse_route(route) for route in routes] if routes else None
+
+    def wants(self, method: str, path: str):
+        if self._matches is not None and not any(
+            path == route_path and (route_method is None or route_method == method)
+            for route_method, route_path in self._matches
+        ):
+            return False
+
+        return self.fraction >= 1 or random.random() < self.fraction
+
+    def summary(self):
+        return {
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "interval_ms": self.interval_ms,
+            "routes": self.routes,
+            "fraction": self.fraction,
+            "active": not self.stopped.is_set(),
+            "requests": self.requests,
+            "samples": self.samples,
+            "files": list(self.files)
+        }
+
+
+def _parse_route(route: str):
+    # "POST /orders" or just "/orders" (any method)
+    parts = route.split(None, 1)
+    if len(parts) == 2:
+        return parts[0].upper(), parts[1]
+    return None, route
+
+
+def _frame_key(code):
+    return (code.co_name, code.co_filename, code.co_firstlineno)
+
+
+class Profiler:
+    def __init__(self):
+        self.session = None
+        self._registered = {}
+        self._lock = threading.Lock()
+
+    def start(self, seconds: float, interval_ms: Optional[float] = None, routes: Optional[List[str]] = None, fraction: float = 1.0):
+        with self._lock:
+            if self.session is not None and not self.session.stopped.is_set():
+                return None
+
+            session = ProfileSession(seconds, interval_ms or PROFILER_INTERVAL_MS, routes, fraction)
+            self.session = session
+
+        threading.Thread(target=self._sample, args=(session,), name="profiler", daemon=True).start()
+        logger.info("Profiling for %ss (routes=%s, fraction=%s)", seconds, routes or "all", fraction)
+
+        return session
+
+    def stop(self):
+        session = self.session
+        if session is not None and not session.stopped.is_set():
+            session.ends_at = 0
+            session.stopped.wait(5)
+        return session
+
+    # -- request side: cheap checks, only real work for picked requests --
+
+    def begin(self, method: str, path: str, label: str):
+        session = self.session
+        if session is None or session.stopped.is_set() or not session.wants(method, path):
+            return None
+
+        session.requests += 1
+        _current_request.set(label)
+        # The caller's frame: the request handler coroutine
+        return self._register(sys._getframe(1), label)
+
+    def attach(self):
+        """From the endpoint wrapper in the worker thread of a picked request."""
+        label = _current_request.get()
+        if label is None or self.session is None:
+            return None
+        return self._register(sys._getframe(1), label)
+
+    def _register(self, frame, label):
+        key = id(frame)
+        self._registered[key] = label
+        return key
+
+    def end(self, key):
+        if key is not None:
+            self._registered.pop(key, None)
+
+    # -- sampler thread --
+
+    def _sample(self, session: ProfileSession):
+        me = threading.get_ident()
+        interval = session.interval_ms / 1000
+
+        try:
+            while time.monotonic() < session.ends_at:
+                time.sleep(interval)
+
+                if not self._registered:
+                    continue
+
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == me:
+                        continue
+
+                    stack = []
+                    while frame is not None:
+                        label = self._registered.get(id(frame))
+                        if label is not None:
+                            stack.reverse()
+                            for key in stack:
+                                session.frames.setdefault(key, None)
+                            session.stacks[(label, *stack)] += 1
+                            session.samples += 1
+                            break
+                        stack.append(_frame_key(frame.f_code))
+                        frame = frame.f_back
+        except Exception as e:
+            logger.warning("Profiler sampling stopped: %s", e)
+        finally:
+            try:
+                session.files = _write(session)
+            except Exception as e:
+                logger.warning("Could not write profile: %s", e)
+            session.stopped.set()
+            logger.info("Profile finished: %d samples over %d requests", session.samples, session.requests)
+
+
+profiler = Profiler()
+
+
+# -- files --
+
+def _frame_name(key):
+    name, filename, line = key
+    return f"{name} ({_short_path(filename)}:{line})"
+
+
+def _short_path(filename: str):
+    # Our modules by name, libraries from their package on
+    if filename.startswith(_BACKEND_DIR):
+        return filename[len(_BACKEND_DIR):]
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return filename
+
+
+def _write(session: ProfileSession):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = f"profile-{session.started_at:%Y%m%d-%H%M%S}-{os.getpid()}"
+
+    # Collapsed stacks (flamegraph.pl, speedscope, inferno): "route;frame;frame count"
+    collapsed_path = os.path.join(PROFILE_DIR, base + ".collapsed")
+    with open(collapsed_path, "w") as f:
+        for (label, *stack), count in sorted(session.stacks.items(), key=lambda item: -item[1]):
+            names = [label] + [_frame_name(key) for key in stack]
+            f.write(";".join(name.replace(";", ",") for name in names) + f" {count}\n")
+
+    # speedscope: one sampled profile per route, frames shared
+    frame_index = {}
+    frames = []
+    for key in session.frames:
+        frame_index[key] = len(frames)
+        name, filename, line = key
+        frames.append({"name": name, "file": _short_path(filename), "line": line})
+
+    by_route = {}
+    for (label, *stack), count in session.stacks.items():
+        by_route.setdefault(label, []).append(([frame_index[key] for key in stack], count))
+
+    profiles = []
+    for label, entries in sorted(by_route.items()):
+        total = sum(count for _, count in entries) * session.interval_ms
+        profiles.append({
+            "type": "sampled",
+            "name": label,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": total,
+            "samples": [stack for stack, _ in entries],
+            "weights": [count * session.interval_ms for _, count in entries]
+        })
+
+    speedscope_path = os.path.join(PROFILE_DIR, base + ".speedscope.json")
+    with open(speedscope_path, "w") as f:
+        json.dump({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": base,
+            "exporter": "stock-management profiler",
+            "shared": {"frames": frames},
+            "profiles": profiles
+        }, f)
+
+    _prune()
+
+    return [os.path.basename(collapsed_path), os.path.basename(speedscope_path)]
+
+
+def _prune():
+    sessions = sorted({name.split(".", 1)[0] for name in list_files()})
+    for stale in sessions[:-PROFILER_KEEP_FILES] if PROFILER_KEEP_FILES > 0 else []:
+        for name in list_files():
+            if name.startswith(stale + "."):
+                os.remove(os.path.join(PROFILE_DIR, name))
+
+
+def list_files():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted(
+        name for name in os.listdir(PROFILE_DIR)
+        if name.startswith("profile-") and name.endswith((".collapsed", ".speedscope.json"))
+    )
+
+
+def file_path(name: str):
+    """Path of a profile file by name, or None (never anything outside PROFILE_DIR)."""
+    if name not in list_files():
+        return None
+    return os.path.join(PROFILE_DIR, name)
+
+
+# -- routing --
+
+def _traced(endpoint):
+    @functools.wraps(endpoint)
+    def traced_endpoint(*args, **kwargs):
+        key = profiler.attach() if profiler.session is not None else None
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profiler.end(key)
+
+    return traced_endpoint
+
+
+class ProfiledRoute(APIRoute):
+    """
+    APIRoute that can be profiled (see above). Set as the router's
+    route_class before the routes are declared.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        # Sync endpoints run in the threadpool; wrap them so that thread can be attributed
+        if not asyncio.iscoroutinefunction(endpoint) and not path.startswith(_EXCLUDED_PREFIXES):
+            endpoint = _traced(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        if self.path.startswith(_EXCLUDED_PREFIXES):
+            return handler
+
+        path = self.path
+
+        async def profiled_handler(request):
+            key = profiler.begin(request.method, path, f"{request.method} {path}") if profiler.session is not None else None
+            try:
+                return await handler(request)
+            finally:
+                profiler.end(key)
+
+        return profiled_handler
@@ -0,0 +1,110 @@
+from sqlalchemy import select, func, exists
+from sqlalchemy.orm import aliased
+from datetime import datetime
+from typing import Optional
+from models import Order, OrderAllocation, OrderStatus, Product, BillOfMaterials, DeletedEntity
+
+
+# Statements of the hot order and BOM queries. The crud modules run these
+# and check_query_plans.py EXPLAINs the very same builders, so the plan
+# check cannot drift from what the application actually executes.
+
+
+# OrderResponse fields, in order; the summary list is built straight from these columns
+ORDER_SUMMARY_COLUMNS = [
+    Order.id, Order.product_id, Product.name.label("product_name"), Order.quantity, Order.status,
+    Order.created_at, Order.completed_at, Order.parent_order_id, Order.location_id, Order.to_stock
+]
+
+# Orderings for the pending-order feasibility walk
+PENDING_ORDERINGS = {
+    "fifo": (Order.created_at, Order.id),
+    "smallest_first": (Order.quantity, Order.created_at, Order.id),
+}
+
+
+def order_summaries(updated_since: Optional[datetime] = None):
+    """Order list rows (ORDER_SUMMARY_COLUMNS); only orders whose status changed since `updated_since` if given."""
+    query = select(*ORDER_SUMMARY_COLUMNS).join(Product, Product.id == Order.product_id)
+
+    if updated_since is None:
+        return query.order_by(Order.id)
+
+    return query.where(Order.status_changed_at >= updated_since).order_by(Order.status_changed_at, Order.id)
+
+
+def order_status_counts():
+    return select(Order.status, func.count(Order.id)).group_by(Order.status)
+
+
+def open_orders():
+    # No ORDER BY: ORDER BY id would make the planner walk the primary key
+    # over every order instead of using idx_orders_status_created_at
+    return select(Order.id, Order.product_id, Order.quantity, Order.status, Order.created_at).where(
+        Order.status.in_([OrderStatus.PENDING, OrderStatus.IN_PROGRESS])
+    )
+
+
+def pending_orders(order_by: str = "fifo"):
+    """Pending orders in one of the PENDING_ORDERINGS, for the feasibility walk."""
+    return select(Order.id, Order.product_id, Order.quantity, Order.created_at).where(
+        Order.status == OrderStatus.PENDING
+    ).order_by(*PENDING_ORDERINGS[order_by])
+
+
+def pending_demand(location_id: Optional[int] = None):
+    """Pending orders (all sites, or one) in FIFO order, as idx_orders_status_created_at returns them."""
+    query = select(Order.product_id, Order.quantity, Order.status).where(Order.status == OrderStatus.PENDING)
+
+    if location_id is not None:
+        query = query.where(Order.location_id == location_id)
+
+    return query.order_by(Order.created_at, Order.id)
+
+
+def product_order_count(product_id: int):
+    return select(func.count(Order.id)).where(Order.product_id == product_id)
+
+
+def archivable_order_ids(cutoff: datetime, batch_size: int):
+    backorder = aliased(Order, name="backorder")
+
+    return (
+        select(Order.id)
+        .where(
+            Order.status == OrderStatus.COMPLETED,
+            Order.completed_at < cutoff,
+            # Keep parents with live backorders, or their parent_order_id link would be nulled
+            ~exists().where(backorder.parent_order_id == Order.id)
+        )
+        # Oldest first, straight off idx_orders_status_completed_at
+        .order_by(Order.completed_at, Order.id)
+        .limit(batch_size)
+    )
+
+
+def allocation_sums(order_ids):
+    """Allocated quantity per (component_id, location_id) over a batch of orders."""
+    return (
+        select(OrderAllocation.component_id, OrderAllocation.location_id, func.sum(OrderAllocation.quantity_allocated))
+        .where(OrderAllocation.order_id.in_(order_ids))
+        .group_by(OrderAllocation.component_id, OrderAllocation.location_id)
+    )
+
+
+def product_bom_lines(product_id: int):
+    return select(BillOfMaterials).where(BillOfMaterials.product_id == product_id)
+
+
+def component_bom_lines(component_id: int):
+    return select(BillOfMaterials).where(BillOfMaterials.component_id == component_id)
+
+
+def deleted_entities(since: datetime, entity_type: Optional[str] = None):
+    """Delta sync tombstones written at or after `since`, optionally of one entity type."""
+    query = select(DeletedEntity).where(DeletedEntity.deleted_at >= since)
+
+    if entity_type is not None:
+        query = query.where(DeletedEntity.entity_type == entity_type)
+
+    return query.order_by(DeletedEntity.deleted_at, DeletedEntity.id)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 from decimal import Decimal
 
@@ -24,9 +24,34 @@ class ComponentResponse(ComponentBase):
     in_stock: int
     in_progress: int
     shipped: int
+    version: int  # Also sent as the ETag; echo it in If-Match when updating
     created_at: datetime
     updated_at: datetime
 
+# Location Schemas
+
+class LocationCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=255)
+
+class LocationResponse(LocationCreate):
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    created_at: datetime
+
+class LocationStockResponse(BaseModel):
+    location_id: Optional[int]  # None for the unassigned pool
+    location_name: Optional[str]
+    in_stock: int
+    in_progress: int
+    shipped: int
+
+class ComponentLocationsResponse(BaseModel):
+    component_id: int
+    component_name: str
+    locations: List[LocationStockResponse]
+    unassigned: LocationStockResponse
+
 # BOM Schemas
 
 class BOMItemCreate(BaseModel):
@@ -95,8 +120,10 @@ class ProductResponse(ProductBase):
     model_config = ConfigDict(from_attributes=True)
     
     id: int
+    in_stock: int  # Finished units on hand, used by parent products' orders first
     in_progress: int
     shipped: int
+    version: int  # Also sent as the ETag; echo it in If-Match when updating
     created_at: datetime
     updated_at: datetime
 
@@ -104,9 +131,47 @@ class ProductDetailResponse(ProductResponse):
     component_bom: List[BOMItemDetailResponse]
     product_bom: List[ProductBOMItemResponse]
 
+class BOMTreeComponentResponse(BaseModel):
+    component_id: int
+    component_name: str
+    depth: int
+    quantity_per_parent: int
+    cumulative_quantity: int  # Units per top-level order quantity, before spillage
+    spillage_coefficient: Decimal
+    quantity_with_spillage: Decimal
+    total_with_spillage: int  # Rounded up, as allocated by orders
+    in_stock: int
+    stock_coverage: Optional[float]
+
+class BOMTreeNodeResponse(BaseModel):
+    product_id: int
+    product_name: str
+    depth: int
+    quantity_per_parent: int
+    cumulative_quantity: int
+    components: List[BOMTreeComponentResponse]
+    children: List["BOMTreeNodeResponse"]
+
+class BOMTreeTotalResponse(BaseModel):
+    component_id: int
+    component_name: str
+    total_required: int
+    in_stock: int
+    shortage: int
+    stock_coverage: Optional[float]
+
+class ProductTreeResponse(BaseModel):
+    product_id: int
+    product_name: str
+    quantity: int
+    tree: BOMTreeNodeResponse
+    totals: List[BOMTreeTotalResponse]
+    can_build: bool
+
 class ProductCapacityResponse(BaseModel):
     id: int
     name: str
+    in_stock: int
     in_progress: int
     shipped: int
     max_producible: int  # Calculated based on component availability
@@ -119,12 +184,19 @@ class OrderCreate(BaseModel):
     """Create a new order"""
     product_id: int = Field(..., gt=0)
     quantity: int = Field(..., gt=0)
+    # Build what stock allows now and put the rest on a linked backorder
+    allow_partial: bool = False
+    # Site to ship from; its stock is allocated first
+    location_id: Optional[int] = Field(None, gt=0)
+    # Build ahead: completed units go to the product's in_stock instead of shipped
+    to_stock: bool = False
     
     class Config:
         json_schema_extra = {
             "example": {
                 "product_id": 1,
-                "quantity": 100
+                "quantity": 100,
+                "allow_partial": False
             }
         }
 
@@ -136,6 +208,16 @@ class OrderAllocationResponse(BaseModel):
     component_id: int
     component_name: str
     quantity_allocated: int
+    location_id: Optional[int] = None
+
+class OrderProductAllocationResponse(BaseModel):
+    """Finished units of a nested product taken from stock for an order"""
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    product_id: int
+    product_name: str
+    quantity_allocated: int
 
 class OrderResponse(BaseModel):
     """Basic order response"""
@@ -148,10 +230,23 @@ class OrderResponse(BaseModel):
     status: str
     created_at: datetime
     completed_at: Optional[datetime]
+    parent_order_id: Optional[int] = None
+    location_id: Optional[int] = None
+    to_stock: bool = False
 
 class OrderDetailResponse(OrderResponse):
     """Detailed order response with allocations"""
     allocations: List[OrderAllocationResponse]
+    product_allocations: List[OrderProductAllocationResponse] = []
+    backorder_ids: List[int] = []
+
+class OrderBatchRequest(BaseModel):
+    """Ids of the orders to complete or allocate together"""
+    order_ids: List[int] = Field(..., min_length=1, max_length=5000)
+
+class OrderBatchResponse(BaseModel):
+    count: int
+    orders: List[OrderResponse]
 
 class OrderSummaryResponse(BaseModel):
     """Summary of all orders"""
@@ -159,6 +254,7 @@ class OrderSummaryResponse(BaseModel):
     pending: int
     in_progress: int
     completed: int
+    archived: int = 0
     orders: List[OrderResponse]
 
 class ComponentRequirementResponse(BaseModel):
@@ -169,14 +265,45 @@ class ComponentRequirementResponse(BaseModel):
     shortage: int
     has_enough: bool
 
+class SubassemblyRequirementResponse(BaseModel):
+    product_id: int
+    product_name: str
+    from_stock: int  # Finished units that would be taken instead of built
+
 class OrderRequirementsResponse(BaseModel):
     order_id: int
     product_name: str
     quantity: int
     status: str
     requirements: List[ComponentRequirementResponse]
+    subassemblies: List[SubassemblyRequirementResponse] = []
     can_allocate: bool
 
+class FeasibilityBottleneckResponse(BaseModel):
+    component_id: int
+    component_name: str
+    needed: int
+    available: int  # What is left after the orders ahead of this one
+    shortage: int
+
+class OrderFeasibilityResponse(BaseModel):
+    order_id: int
+    product_id: int
+    product_name: str
+    quantity: int
+    created_at: Optional[datetime]
+    feasibility: str  # allocatable | partially_blocked | blocked
+    buildable_quantity: int
+    bottleneck: Optional[FeasibilityBottleneckResponse]
+
+class PendingFeasibilityResponse(BaseModel):
+    order_by: str
+    total_pending: int
+    allocatable: int
+    partially_blocked: int
+    blocked: int
+    orders: List[OrderFeasibilityResponse]
+
 
 # ===== ORDER SCHEMAS =====
 
@@ -192,8 +319,135 @@ class ProcurementResponse(BaseModel):
     components_to_order: List[ProcurementItemResponse]
     total_items: int
 
+# ===== DASHBOARD SCHEMAS =====
+
+class DashboardComponentResponse(BaseModel):
+    id: int
+    name: str
+    spillage_coefficient: Decimal
+    in_stock: int
+    in_progress: int
+    shipped: int
+
+class DashboardOrderResponse(BaseModel):
+    id: int
+    product_name: str
+    quantity: int
+    status: str
+    created_at: datetime
+
+class DashboardOrdersResponse(BaseModel):
+    total_orders: int
+    pending: int
+    in_progress: int
+    completed: int
+    archived: int = 0
+    open_orders: List[DashboardOrderResponse]
+
+class DashboardResponse(BaseModel):
+    """Everything the dashboard cards render, from a single DB pass"""
+    components: List[DashboardComponentResponse]
+    capacity: List[ProductCapacityResponse]
+    orders: DashboardOrdersResponse
+    procurement: ProcurementResponse
+
+# ===== LIST QUERY SCHEMAS =====
+
+class ListFilters(BaseModel):
+    """Search, filter, sort and pagination options for list endpoints"""
+    q: Optional[str] = None            # Case-insensitive substring of name
+    prefix: Optional[str] = None       # Name prefix
+    in_stock_min: Optional[int] = None
+    in_stock_max: Optional[int] = None
+    in_progress_min: Optional[int] = None
+    in_progress_max: Optional[int] = None
+    shipped_min: Optional[int] = None
+    shipped_max: Optional[int] = None
+    compare: List[str] = []            # Counter against counter, e.g. "in_stock<in_progress"
+    sort: Optional[str] = None         # Column name, prefix with '-' for descending
+    limit: Optional[int] = None
+    cursor: Optional[str] = None       # Opaque, from the X-Next-Cursor header
+
+# ===== SYNC SCHEMAS =====
+
+class DeletedEntityResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
+    entity_type: str
+    entity_id: int
+    deleted_at: datetime
+
+# Cache Schemas
+class CacheStatsResponse(BaseModel):
+    versions: Dict[str, int]
+    local_writes: Dict[str, int]
+    entries: int
+    max_entries: int
+    max_age_seconds: float
+    hits: int
+    misses: int
+    hit_rate: float
+
+# Transaction Schemas
+class TransactionStatsResponse(BaseModel):
+    """Write transactions run by this worker and how often they were retried"""
+    units: int
+    retried_units: int
+    retries: int
+    exhausted: int
+    by_reason: Dict[str, int]
+    max_attempts: int
+
+# Admin Schemas
+class ArchiveRunResponse(BaseModel):
+    """Result of one archiving run; run again while complete is false"""
+    cutoff: datetime
+    batches: int
+    orders_archived: int
+    allocations_archived: int
+    complete: bool
+
+class ProfileSessionResponse(BaseModel):
+    """A profiling session of this worker; files are downloadable once active is false"""
+    started_at: datetime
+    seconds: float
+    interval_ms: float
+    routes: Optional[List[str]] = None
+    fraction: float
+    active: bool
+    requests: int
+    samples: int
+    files: List[str]
+
+class ProfilerStatusResponse(BaseModel):
+    session: Optional[ProfileSessionResponse] = None
+    files: List[str]
+
 # Health Check Schema
 class HealthResponse(BaseModel):
     status: str
     database: str
-    message: str
\ No newline at end of file
+    message: str
+
+class LivenessResponse(BaseModel):
+    status: str
+
+class ReadinessResponse(BaseModel):
+    """Warmup state and pool health of this worker"""
+    status: str
+    database: str
+    warmup: Dict[str, Any]
+    pool: Dict[str, Any]
+
+# Background Job Schemas
+class JobResponse(BaseModel):
+    """A report job; result is the report body once status is succeeded"""
+    id: str
+    report: str
+    params: Dict[str, Any]
+    status: str
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    result: Optional[Any] = None
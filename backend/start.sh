@@ -1,2 +1,3 @@
 #!/bin/bash
-gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
\ No newline at end of file
+# --preload imports the app once in the master; forked workers skip the import and only warm up
+gunicorn main:app --preload --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
\ No newline at end of file
@@ -0,0 +1,185 @@
+from sqlalchemy import update
+from fastapi import HTTPException
+from concurrent.futures import Future
+from database import SessionLocal, record_write
+from models import Component
+from cache import bump_version
+from events import broker, component_stock_event
+from transactions import run_transaction, retry_reason
+import crud_components
+import stock_slots
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: collect stock adjustments for this many milliseconds and apply them
+# in one transaction. 0 (the default) applies every adjustment on its own.
+STOCK_COALESCE_MS = float(os.getenv("STOCK_COALESCE_MS", "0"))
+
+# A window closes early once this many adjustments are waiting
+STOCK_COALESCE_MAX_BATCH = int(os.getenv("STOCK_COALESCE_MAX_BATCH", "500"))
+
+
+class StockAdjustmentCoalescer:
+    """
+    Group commit for PATCH /components/{id}/adjust-stock.
+
+    The first request to arrive in an idle window becomes the leader: it
+    waits window_seconds (or until max_batch requests queued up), then
+    applies everything queued with one transaction, one guarded
+    `in_stock = in_stock + :delta` UPDATE per component, and answers every
+    waiting request. Requests are checked in arrival order against a
+    running value of the unassigned pool (the stock they adjust), so each
+    one succeeds or fails exactly as it would have if the batch had been
+    applied one request at a time.
+    """
+
+    def __init__(self, window_seconds: float, max_batch: int):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._condition = threading.Condition()
+        self._pending = []
+        self._leader_waiting = False
+
+    def submit(self, component_id: int, adjustment: int):
+        future = Future()
+
+        with self._condition:
+            self._pending.append((component_id, adjustment, future))
+            lead = not self._leader_waiting
+
+            if lead:
+                self._leader_waiting = True
+            elif len(self._pending) >= self.max_batch:
+                self._condition.notify_all()
+
+        if lead:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.window_seconds)
+                batch, self._pending = self._pending, []
+                self._leader_waiting = False
+
+            self._apply(batch)
+
+        result = future.result()
+        # The leader's session committed; this request wrote all the same
+        record_write()
+        return result
+
+    def _apply(self, batch):
+        db = SessionLocal()
+
+        try:
+            component_ids = sorted({component_id for component_id, _, _ in batch})
+
+            # Lock in id order so concurrent batches cannot deadlock each other
+            components = {
+                component.id: component
+                for component in db.query(Component).filter(
+                    Component.id.in_(component_ids)
+                ).order_by(Component.id).with_for_update()
+            }
+
+            stock_slots.apply_totals(db, components.values())
+            running = {component_id: stock_slots.pool_stock(db, component) for component_id, component in components.items()}
+            totals = {component_id: component.in_stock for component_id, component in components.items()}
+            deltas = {}
+            outcomes = []
+
+            for component_id, adjustment, future in batch:
+                if component_id not in components:
+                    outcomes.append((future, component_id, HTTPException(status_code=404, detail=f"Component with id {component_id} not found")))
+                    continue
+
+                new_stock = running[component_id] + adjustment
+
+                if new_stock < 0:
+                    outcomes.append((future, component_id, HTTPException(
+                        status_code=400,
+                        detail=f"Invalid adjustment. Current stock unassigned: {running[component_id]}, Adjustment: {adjustment}, Result: {new_stock} (cannot be negative)"
+                    )))
+                    continue
+
+                running[component_id] = new_stock
+                totals[component_id] += adjustment
+                deltas[component_id] = deltas.get(component_id, 0) + adjustment
+                outcomes.append((future, component_id, totals[component_id]))
+
+            for component_id, delta in deltas.items():
+                if delta == 0:
+                    continue
+
+                if components[component_id].stock_slots:
+                    try:
+                        stock_slots.adjust(db, components[component_id], "in_stock", delta)
+                        guarded = True
+                    except HTTPException:
+                        guarded = False
+                else:
+                    guarded = db.execute(
+                        update(Component)
+                        .where(Component.id == component_id, Component.in_stock + delta >= 0)
+                        .values(in_stock=Component.in_stock + delta)
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+
+                if not guarded:
+                    # Stock moved under us (e.g. a writer that does not lock); redo one by one
+                    db.rollback()
+                    db.close()
+                    self._apply_individually(batch)
+                    return
+
+            # Re-read for the responses (updated_at is set by the database)
+            changed = db.query(Component).filter(Component.id.in_(list(deltas))).populate_existing().all()
+            stock_slots.apply_totals(db, changed)
+            snapshots = {
+                component.id: {column.key: getattr(component, column.key) for column in Component.__table__.columns}
+                for component in changed
+            }
+            change_events = [component_stock_event(component) for component in changed]
+
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            db.close()
+
+            if retry_reason(e) is not None:
+                # Lost a deadlock or lock wait; each adjustment retries on its own
+                self._apply_individually(batch)
+                return
+
+            logger.warning("Coalesced stock adjustment failed: %s", e)
+
+            for _, _, future in batch:
+                future.set_exception(HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}"))
+            return
+
+        db.close()
+
+        if deltas:
+            bump_version("components")
+            broker.publish_many(change_events)
+
+        for future, component_id, outcome in outcomes:
+            if isinstance(outcome, HTTPException):
+                future.set_exception(outcome)
+            else:
+                # Each caller sees the stock as it was right after its own adjustment
+                future.set_result({**snapshots[component_id], "in_stock": outcome})
+
+    def _apply_individually(self, batch):
+        for component_id, adjustment, future in batch:
+            db = SessionLocal()
+            try:
+                component = run_transaction(db, crud_components.adjust_component_stock, component_id, adjustment)
+                future.set_result({column.key: getattr(component, column.key) for column in Component.__table__.columns})
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                db.close()
+
+
+coalescer = StockAdjustmentCoalescer(STOCK_COALESCE_MS / 1000, STOCK_COALESCE_MAX_BATCH) if STOCK_COALESCE_MS > 0 else None
@@ -0,0 +1,161 @@
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from models import ComponentLocation
+from transactions import RetryableError
+import stock_slots
+
+_locations = ComponentLocation.__table__
+
+
+# Per-site stock. A component's stock at a location lives in its own
+# component_locations row, so sites never contend on each other's rows.
+# Whatever is not assigned to a site stays in the component row (the pool,
+# see stock_slots.py). Allocation takes from the order's own site first,
+# then from the other sites with the most stock, then from the pool, and
+# records the source on each allocation line so completion ships from the
+# same place.
+
+
+def site_stock(db: Session, component_ids):
+    """{component_id: {location_id: in_stock}} for the given components."""
+    if not component_ids:
+        return {}
+
+    rows = db.execute(
+        select(_locations.c.component_id, _locations.c.location_id, _locations.c.in_stock)
+        .where(_locations.c.component_id.in_(list(component_ids)))
+    ).all()
+
+    stock = {}
+    for component_id, location_id, in_stock in rows:
+        stock.setdefault(component_id, {})[location_id] = in_stock
+
+    return stock
+
+
+def availability(total_in_stock: int, sites: dict):
+    """Sources for one component: each site plus the pool (key None)."""
+    available = dict(sites)
+    available[None] = total_in_stock - sum(sites.values())
+    return available
+
+
+def plan(available: dict, quantity: int, location_id=None):
+    """
+    Split `quantity` over the sources in `available` and take it out of them.
+
+    Returns [(location_id or None, units)]. Orders with a site use it first,
+    then the other sites (most stock first), then the pool; orders without
+    one use the pool first. A shortfall is left on the pool, where the
+    guarded update rejects it.
+    """
+    others = sorted(
+        (source for source in available if source is not None and source != location_id),
+        key=lambda source: (-available[source], source)
+    )
+
+    if location_id is not None:
+        sources = [location_id] + others + [None]
+    else:
+        sources = [None] + others
+
+    parts = []
+    remaining = quantity
+
+    for source in sources:
+        units = min(available.get(source, 0), remaining)
+        if units > 0:
+            parts.append((source, units))
+            available[source] -= units
+            remaining -= units
+        if remaining == 0:
+            break
+
+    if remaining:
+        parts.append((None, remaining))
+
+    return parts
+
+
+def _move_at(db: Session, component_id: int, location_id: int, from_field: str, to_field: str, quantity: int):
+    column = _locations.c[from_field]
+
+    return db.execute(
+        update(_locations)
+        .where(
+            _locations.c.component_id == component_id,
+            _locations.c.location_id == location_id,
+            column >= quantity
+        )
+        .values({from_field: column - quantity, to_field: _locations.c[to_field] + quantity})
+    ).rowcount
+
+
+def move(db: Session, component, parts, from_field: str, to_field: str):
+    """Move units between two counters of a component at the sources in `parts`."""
+    for location_id, quantity in parts:
+        if location_id is None:
+            stock_slots.move(db, component, from_field, to_field, quantity)
+            continue
+
+        stock_slots.apply_totals(db, [component])
+
+        if not _move_at(db, component.id, location_id, from_field, to_field, quantity):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Not enough {from_field} left for component '{component.name}' at location {location_id}, please retry"
+            )
+
+        stock_slots.shift_totals(component, from_field, -quantity)
+        stock_slots.shift_totals(component, to_field, quantity)
+
+
+def move_rows(db: Session, deltas: dict, from_field: str, to_field: str):
+    """
+    Batch form of move() for {(component_id, location_id): units}.
+
+    Returns False if any site lacked the units (caller rolls back).
+    """
+    for (component_id, location_id), quantity in sorted(deltas.items()):
+        if not _move_at(db, component_id, location_id, from_field, to_field, quantity):
+            return False
+
+    return True
+
+
+def adjust(db: Session, component, location_id: int, delta: int):
+    """Add `delta` (may be negative) to a component's in_stock at one site."""
+    if delta == 0:
+        return
+
+    stock_slots.apply_totals(db, [component])
+    column = _locations.c.in_stock
+
+    changed = db.execute(
+        update(_locations)
+        .where(
+            _locations.c.component_id == component.id,
+            _locations.c.location_id == location_id,
+            column + delta >= 0
+        )
+        .values(in_stock=column + delta)
+    ).rowcount
+
+    if not changed:
+        if delta < 0:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid adjustment. Not enough stock of '{component.name}' at location {location_id}"
+            )
+
+        # First delivery of this component to the site. If a concurrent first
+        # delivery inserted the row in the meantime, run_transaction runs the
+        # unit again and it takes the UPDATE above
+        try:
+            db.execute(insert(_locations).values(component_id=component.id, location_id=location_id, in_stock=delta))
+        except IntegrityError as e:
+            raise RetryableError("duplicate_insert", e) from e
+
+    stock_slots.shift_totals(component, "in_stock", delta)
@@ -0,0 +1,294 @@
+from sqlalchemy import select, update, insert, delete, func, case, exists, event, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from fastapi import HTTPException
+from models import Component, ComponentStockSlot, ComponentLocation
+import random
+
+# Counters that can be split over slot rows
+COUNTERS = ("in_stock", "in_progress", "shipped")
+
+MAX_STOCK_SLOTS = 64
+
+_slots = ComponentStockSlot.__table__
+_locations = ComponentLocation.__table__
+
+
+# Sharded components store part (normally all) of their counters in
+# component_stock_slots. Writers touch one slot row instead of the single
+# components row, so concurrent allocations of a hot component no longer
+# queue on one row lock. Stock held at a specific site lives in
+# component_locations (see stock_locations.py).
+#
+# Every total is the components row value plus the sum of its slots and
+# locations, and is applied to loaded Component objects in place, so
+# ComponentResponse and the event payloads keep their shape. The
+# components row (plus slots) is the unassigned "pool" that move() and
+# adjust() operate on; both apply deltas in SQL, never absolute values.
+
+
+@event.listens_for(Component, "load")
+@event.listens_for(Component, "refresh")
+def _reset_totals_flag(component, *args):
+    # Freshly loaded counters are the components row only
+    inspect(component).info.pop("stock_totals", None)
+
+
+def total_column(field: str):
+    """SQL expression for a component counter including its slot rows."""
+    slot_sum = select(func.coalesce(func.sum(_slots.c[field]), 0)).where(
+        _slots.c.component_id == Component.id
+    ).scalar_subquery()
+
+    location_sum = select(func.coalesce(func.sum(_locations.c[field]), 0)).where(
+        _locations.c.component_id == Component.id
+    ).scalar_subquery()
+
+    return getattr(Component, field) + case((Component.stock_slots > 0, slot_sum), else_=0) + location_sum
+
+
+def changed_since(since):
+    """Condition matching components whose row, slots or locations changed at or after `since`."""
+    return (Component.updated_at >= since) | exists().where(
+        _slots.c.component_id == Component.id, _slots.c.updated_at >= since
+    ) | exists().where(
+        _locations.c.component_id == Component.id, _locations.c.updated_at >= since
+    )
+
+
+def _sums(db: Session, table, component_ids):
+    if not component_ids:
+        return {}
+
+    rows = db.execute(
+        select(
+            table.c.component_id,
+            func.sum(table.c.in_stock), func.sum(table.c.in_progress), func.sum(table.c.shipped)
+        ).where(table.c.component_id.in_(list(component_ids))).group_by(table.c.component_id)
+    ).all()
+
+    return {row[0]: dict(zip(COUNTERS, (int(value or 0) for value in row[1:]))) for row in rows}
+
+
+def slot_sums(db: Session, component_ids):
+    return _sums(db, _slots, component_ids)
+
+
+def location_sums(db: Session, component_ids):
+    return _sums(db, _locations, component_ids)
+
+
+def apply_totals(db: Session, components):
+    """
+    Replace the counters of loaded components with their totals.
+
+    Values are set as committed state, so they are never flushed back to
+    the components row. Safe to call more than once per object.
+    """
+    pending = [
+        component for component in components
+        if component is not None and not inspect(component).info.get("stock_totals")
+    ]
+
+    if pending:
+        slots = slot_sums(db, [component.id for component in pending if component.stock_slots])
+        locations = location_sums(db, [component.id for component in pending])
+
+        for component in pending:
+            for field in COUNTERS:
+                extra = slots.get(component.id, {}).get(field, 0) + locations.get(component.id, {}).get(field, 0)
+                if extra:
+                    set_committed_value(component, field, getattr(component, field) + extra)
+            inspect(component).info["stock_totals"] = True
+
+    return components
+
+
+def pool_stock(db: Session, component, field: str = "in_stock"):
+    """
+    What adjust() and move() can take from a component's pool counter:
+    the slot rows of a sharded component, else the components row. Read
+    from the database, since loaded counters may already be totals.
+    """
+    if component.stock_slots:
+        return slot_sums(db, [component.id]).get(component.id, {}).get(field, 0)
+
+    return db.execute(select(getattr(Component, field)).where(Component.id == component.id)).scalar_one()
+
+
+def shift_totals(component, field: str, quantity: int):
+    """Keep a loaded component's in-memory total in step with a write made in SQL."""
+    set_committed_value(component, field, getattr(component, field) + quantity)
+
+
+def _update_row(db: Session, component, values, guard=None):
+    conditions = [Component.id == component.id]
+    if guard is not None:
+        conditions.append(guard)
+
+    return db.execute(
+        update(Component).where(*conditions).values(**values).execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _take(db: Session, component, field: str, quantity: int, to_field=None):
+    column = _slots.c[field]
+
+    def values(amount):
+        changes = {field: column - amount}
+        if to_field is not None:
+            changes[to_field] = _slots.c[to_field] + amount
+        return changes
+
+    # Prefer a single slot that covers the whole quantity, picked at random
+    # so concurrent writers spread over the slots
+    rows = db.execute(select(_slots.c.slot, column).where(_slots.c.component_id == component.id)).all()
+    candidates = [slot for slot, available in rows if available >= quantity]
+    random.shuffle(candidates)
+
+    for slot in candidates:
+        taken = db.execute(
+            update(_slots)
+            .where(_slots.c.component_id == component.id, _slots.c.slot == slot, column >= quantity)
+            .values(**values(quantity))
+        ).rowcount
+
+        if taken:
+            return
+
+    # No single slot is big enough: lock them all and take from several
+    rows = db.execute(
+        select(_slots.c.slot, column)
+        .where(_slots.c.component_id == component.id)
+        .order_by(_slots.c.slot)
+        .with_for_update()
+    ).all()
+
+    if sum(available for _, available in rows) < quantity:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Not enough {field} left for component '{component.name}', please retry"
+        )
+
+    remaining = quantity
+    for slot, available in rows:
+        amount = min(available, remaining)
+        if amount <= 0:
+            continue
+
+        db.execute(
+            update(_slots)
+            .where(_slots.c.component_id == component.id, _slots.c.slot == slot)
+            .values(**values(amount))
+        )
+
+        remaining -= amount
+        if remaining == 0:
+            break
+
+
+def _give(db: Session, component, field: str, quantity: int):
+    db.execute(
+        update(_slots)
+        .where(_slots.c.component_id == component.id, _slots.c.slot == random.randrange(component.stock_slots))
+        .values({field: _slots.c[field] + quantity})
+    )
+
+
+def move(db: Session, component, from_field: str, to_field: str, quantity: int):
+    """Move `quantity` pool units between two counters (e.g. in_stock -> in_progress)."""
+    if quantity == 0:
+        return
+
+    apply_totals(db, [component])
+
+    if component.stock_slots:
+        _take(db, component, from_field, quantity, to_field)
+    else:
+        from_column = getattr(Component, from_field)
+        to_column = getattr(Component, to_field)
+
+        moved = _update_row(
+            db, component,
+            {from_field: from_column - quantity, to_field: to_column + quantity},
+            guard=from_column >= quantity
+        )
+        if not moved:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Not enough {from_field} left for component '{component.name}', please retry"
+            )
+
+    shift_totals(component, from_field, -quantity)
+    shift_totals(component, to_field, quantity)
+
+
+def adjust(db: Session, component, field: str, delta: int):
+    """Add `delta` (may be negative) to one pool counter."""
+    if delta == 0:
+        return
+
+    apply_totals(db, [component])
+
+    if component.stock_slots:
+        if delta > 0:
+            _give(db, component, field, delta)
+        else:
+            _take(db, component, field, -delta)
+    else:
+        column = getattr(Component, field)
+        if not _update_row(db, component, {field: column + delta}, guard=column + delta >= 0):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Not enough {field} left for component '{component.name}', please retry"
+            )
+
+    shift_totals(component, field, delta)
+
+
+def sharded_ids(db: Session, component_ids):
+    if not component_ids:
+        return set()
+
+    return set(db.execute(
+        select(Component.id).where(Component.id.in_(list(component_ids)), Component.stock_slots > 0)
+    ).scalars())
+
+
+def reshard(db: Session, component, slots: int):
+    """
+    Spread a component's counters evenly over `slots` slot rows (0 folds
+    them back into the components row). Caller commits.
+    """
+    if slots < 0 or slots > MAX_STOCK_SLOTS:
+        raise HTTPException(status_code=400, detail=f"slots must be between 0 and {MAX_STOCK_SLOTS}")
+
+    # Lock the component and its slots while the counters are redistributed
+    component = db.query(Component).filter(Component.id == component.id).populate_existing().with_for_update().one()
+    db.execute(select(_slots.c.slot).where(_slots.c.component_id == component.id).with_for_update()).all()
+
+    sums = slot_sums(db, [component.id]).get(component.id, {})
+    totals = {field: getattr(component, field) + sums.get(field, 0) for field in COUNTERS}
+
+    db.execute(delete(_slots).where(_slots.c.component_id == component.id))
+
+    if slots == 0:
+        for field in COUNTERS:
+            setattr(component, field, totals[field])
+    else:
+        rows = []
+        for slot in range(slots):
+            row = {"component_id": component.id, "slot": slot}
+            for field in COUNTERS:
+                share, remainder = divmod(totals[field], slots)
+                row[field] = share + (1 if slot < remainder else 0)
+            rows.append(row)
+
+        db.execute(insert(_slots), rows)
+
+        for field in COUNTERS:
+            setattr(component, field, 0)
+
+    component.stock_slots = slots
+
+    return component
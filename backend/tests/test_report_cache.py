@@ -0,0 +1,93 @@
+"""
+Cached reports with a read replica that lags behind the primary.
+
+The primary and the replica are two SQLite files seeded with the same
+data; writes only ever reach the primary, so the replica stays behind
+for the whole test, as it would under replication lag.
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ["DB_URL"] = f"sqlite:///{os.path.join(_tmp, 'primary.db')}"
+os.environ["DB_READ_URL"] = f"sqlite:///{os.path.join(_tmp, 'replica.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+import main
+import models  # noqa: F401 (registers the tables on Base)
+from cache import report_cache
+from database import engine, read_engine, Base
+
+
+SEED = [
+    "INSERT INTO components (name, spillage_coefficient, in_stock, in_progress, shipped) "
+    "VALUES ('Wheels', 0, 400, 0, 0), ('Axle', 0, 200, 0, 0)",
+    "INSERT INTO products (name, in_progress, shipped) VALUES ('Toy Car', 0, 0)",
+    "INSERT INTO bill_of_materials (product_id, component_id, quantity_required) VALUES (1, 1, 4), (1, 2, 2)",
+]
+
+
+@pytest.fixture(autouse=True)
+def databases():
+    for bind in (engine, read_engine):
+        Base.metadata.drop_all(bind=bind)
+        Base.metadata.create_all(bind=bind)
+        with bind.begin() as conn:
+            for statement in SEED:
+                conn.execute(text(statement))
+
+    report_cache.clear()
+    yield
+
+
+def restock(client):
+    # Doubles both components, so the Toy Car capacity goes from 100 to 200
+    for component_id, adjustment in ((1, 400), (2, 200)):
+        response = client.patch(f"/components/{component_id}/adjust-stock?adjustment={adjustment}")
+        assert response.status_code == 200
+
+
+def test_replica_is_behind():
+    writer, reader = TestClient(main.app), TestClient(main.app)
+    restock(writer)
+
+    # Plain reads from a client that has not written still go to the replica
+    assert reader.get("/components/1").json()["in_stock"] == 400
+    assert writer.get("/components/1").json()["in_stock"] == 800
+
+
+def test_capacity_is_computed_on_the_primary():
+    writer, reader = TestClient(main.app), TestClient(main.app)
+    assert reader.get("/products/capacity/calculate").json()[0]["max_producible"] == 100
+
+    restock(writer)
+
+    # The other client asks first; a report computed on the replica would be
+    # cached under the new version and served to the writer as well
+    assert reader.get("/products/capacity/calculate").json()[0]["max_producible"] == 200
+    assert writer.get("/products/capacity/calculate").json()[0]["max_producible"] == 200
+
+
+def test_dashboard_is_computed_on_the_primary():
+    writer, reader = TestClient(main.app), TestClient(main.app)
+    restock(writer)
+
+    for client in (reader, writer):
+        dashboard = client.get("/dashboard").json()
+        assert [c["in_stock"] for c in dashboard["components"]] == [800, 400]
+        assert dashboard["capacity"][0]["max_producible"] == 200
+
+
+def test_name_index_is_built_from_the_primary():
+    writer, reader = TestClient(main.app), TestClient(main.app)
+    assert writer.post("/components", json={"name": "Gearbox", "spillage_coefficient": 0}).status_code == 201
+
+    # The other client's search rebuilds the index for the new catalog version;
+    # built from the replica, it would lack the new component for the writer too
+    assert reader.get("/components?q=gear").json() == []
+    assert [c["name"] for c in writer.get("/components?q=gear").json()] == ["Gearbox"]
@@ -0,0 +1,213 @@
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from fastapi import HTTPException
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Attempts per unit of work, the first one included, before answering 503
+TX_RETRY_ATTEMPTS = int(os.getenv("TX_RETRY_ATTEMPTS", "4"))
+
+# Backoff before the first retry; doubles per retry up to TX_RETRY_MAX_MS, with jitter
+TX_RETRY_BASE_MS = float(os.getenv("TX_RETRY_BASE_MS", "20"))
+TX_RETRY_MAX_MS = float(os.getenv("TX_RETRY_MAX_MS", "500"))
+
+# InnoDB errors after which the transaction can simply run again: the
+# conflict was with another transaction, not with the data
+RETRYABLE_MYSQL_ERRORS = {
+    1213: "deadlock",
+    1205: "lock_wait_timeout",
+}
+
+# Post-commit side effects (cache bumps, change events) queued inside deferred_commit()
+_deferred_effects = ContextVar("deferred_effects", default=None)
+
+
+class RetryableError(Exception):
+    """
+    A retryable database error re-raised past a crud function's generic
+    `except Exception` handler (which would otherwise turn it into a 500).
+    """
+
+    def __init__(self, reason: str, error: Exception):
+        super().__init__(f"{reason}: {error}")
+        self.reason = reason
+        self.error = error
+
+
+def retry_reason(error: Exception) -> Optional[str]:
+    """Why `error` is worth retrying the whole unit for, or None if it is not."""
+    if isinstance(error, RetryableError):
+        return error.reason
+
+    # A versioned UPDATE matched no row: the record changed since it was read
+    if isinstance(error, StaleDataError):
+        return "stale_version"
+
+    if isinstance(error, DBAPIError) and error.orig is not None:
+        args = getattr(error.orig, "args", ())
+        if args and args[0] in RETRYABLE_MYSQL_ERRORS:
+            return RETRYABLE_MYSQL_ERRORS[args[0]]
+
+        # SQLite (local development) has no error codes for this
+        if "database is locked" in str(error.orig):
+            return "database_locked"
+
+    return None
+
+
+def raise_if_retryable(error: Exception):
+    """
+    For generic `except Exception` handlers in the crud modules: call after
+    the rollback, so deadlocks and lock-wait timeouts reach run_transaction
+    instead of becoming a 500.
+    """
+    reason = retry_reason(error)
+
+    if reason is not None:
+        raise RetryableError(reason, error) from error
+
+
+class RetryStats:
+    """Per-worker counters, exported at GET /transactions/stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.units = 0
+        self.retried_units = 0
+        self.retries = 0
+        self.exhausted = 0
+        self.by_reason = {}
+
+    def record(self, attempts: int, reasons, exhausted: bool = False):
+        with self._lock:
+            self.units += 1
+            if attempts > 1:
+                self.retried_units += 1
+                self.retries += attempts - 1
+            if exhausted:
+                self.exhausted += 1
+            for reason in reasons:
+                self.by_reason[reason] = self.by_reason.get(reason, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "units": self.units,
+                "retried_units": self.retried_units,
+                "retries": self.retries,
+                "exhausted": self.exhausted,
+                "by_reason": dict(self.by_reason),
+                "max_attempts": TX_RETRY_ATTEMPTS
+            }
+
+
+retry_stats = RetryStats()
+
+
+def _backoff_seconds(retry: int):
+    # Capped exponential backoff with "equal jitter": never less than half the
+    # step, so retries spread out without collapsing to an immediate rerun
+    step = min(TX_RETRY_MAX_MS, TX_RETRY_BASE_MS * 2 ** (retry - 1))
+    return (step / 2 + random.uniform(0, step / 2)) / 1000
+
+
+def run_transaction(db: Session, unit, *args, **kwargs):
+    """
+    Run `unit(db, *args, **kwargs)`, a function that does its work and
+    commits, and run it again from the start when it fails with a deadlock,
+    lock-wait timeout, stale version or another RetryableError (such as a
+    row insert that lost the race to a concurrent one).
+
+    The unit must only have side effects outside the database (cache
+    versions, events) after its commit, as the crud functions do. After
+    TX_RETRY_ATTEMPTS failed attempts the caller gets 503 with Retry-After.
+    """
+    reasons = []
+
+    for attempt in range(1, TX_RETRY_ATTEMPTS + 1):
+        try:
+            result = unit(db, *args, **kwargs)
+        except Exception as e:
+            reason = retry_reason(e)
+            if reason is None:
+                if reasons:
+                    retry_stats.record(attempt, reasons)
+                raise
+
+            db.rollback()
+            reasons.append(reason)
+
+            if attempt == TX_RETRY_ATTEMPTS:
+                retry_stats.record(attempt, reasons, exhausted=True)
+                logger.warning("%s gave up after %d attempts (%s)", getattr(unit, "__name__", unit), attempt, ", ".join(reasons))
+                raise HTTPException(
+                    status_code=503,
+                    detail="The database is busy with conflicting changes, please retry",
+                    headers={"Retry-After": "1"}
+                )
+
+            logger.info("%s hit %s, retrying (attempt %d)", getattr(unit, "__name__", unit), reason, attempt + 1)
+            time.sleep(_backoff_seconds(attempt))
+            continue
+
+        retry_stats.record(attempt, reasons)
+        return result
+
+
+def defer_until_commit(effect, *args):
+    """
+    For post-commit side effects: inside deferred_commit(), queue
+    effect(*args) until the real commit and return True; otherwise return
+    False and let the caller run it now.
+    """
+    pending = _deferred_effects.get()
+
+    if pending is None:
+        return False
+
+    pending.append((effect, args))
+    return True
+
+
+@contextmanager
+def deferred_commit(db: Session):
+    """
+    Hold back the commits made on `db` inside the block, so the caller can
+    add its own writes to the same transaction (see idempotency.py).
+
+    In the block db.commit() only flushes, and cache bumps and change
+    events are queued (defer_until_commit). Leaving the block commits for
+    real, then runs them. An exception leaves the transaction open for the
+    caller to roll back; a rollback inside the block (run_transaction
+    retrying) drops what was queued so far.
+    """
+    pending = []
+
+    def drop_pending(session, previous_transaction):
+        pending.clear()
+
+    token = _deferred_effects.set(pending)
+    event.listen(db, "after_soft_rollback", drop_pending)
+    db.commit = db.flush
+
+    try:
+        yield
+    finally:
+        del db.commit
+        event.remove(db, "after_soft_rollback", drop_pending)
+        _deferred_effects.reset(token)
+
+    db.commit()
+
+    for effect, args in pending:
+        effect(*args)
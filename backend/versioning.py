@@ -0,0 +1,52 @@
+from fastapi import HTTPException, Response
+from typing import Optional
+
+
+# Optimistic concurrency for components and products. Their `version`
+# column is SQLAlchemy's version_id_col with version_id_generator=False:
+# every ORM UPDATE of the row is issued as `... WHERE id = ? AND version = ?`,
+# but only edits (PUT/PATCH of the record or its BOM) move the version on.
+# Stock counters change far more often than planners edit, and an order
+# being placed should not invalidate the form someone has open.
+#
+# Clients send the ETag they read back as If-Match. A mismatch is caught up
+# front (412), and a concurrent edit that commits between our read and our
+# UPDATE makes the flush match no row (StaleDataError), also 412. No lock is
+# held while the user edits.
+
+
+def etag(version: int):
+    return f'"{version}"'
+
+
+def set_etag(response: Response, entity):
+    response.headers["ETag"] = etag(entity.version)
+
+
+def _matches(if_match: str, version: int):
+    candidates = [value.strip() for value in if_match.split(",")]
+    # A W/ prefix is tolerated: some proxies weaken ETags they pass through
+    return "*" in candidates or any(value.removeprefix("W/") == etag(version) for value in candidates)
+
+
+def check_if_match(entity, if_match: Optional[str], label: str):
+    """
+    Raise 412 when an If-Match header is given and does not match the
+    entity's current version. Without the header the write is unconditional.
+    """
+    if if_match is not None and not _matches(if_match, entity.version):
+        raise precondition_failed(label, entity.version)
+
+
+def bump(entity):
+    entity.version = entity.version + 1
+
+
+def precondition_failed(label: str, current_version: Optional[int] = None):
+    headers = {"ETag": etag(current_version)} if current_version is not None else None
+
+    return HTTPException(
+        status_code=412,
+        detail=f"{label} was changed by someone else; reload it and apply your changes again",
+        headers=headers
+    )
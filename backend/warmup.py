@@ -0,0 +1,163 @@
+from sqlalchemy import text
+from database import engine, read_engine, SessionLocal
+from models import Component, Product
+from cache import report_cache, poll_versions
+import crud_products
+import crud_procurement
+import crud_dashboard
+import name_index
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Connections opened per engine before the worker reports ready (default: the pool size)
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "0"))
+
+# Longest wait between warmup attempts while the database is unreachable
+WARMUP_RETRY_MAX_SECONDS = float(os.getenv("WARMUP_RETRY_MAX_SECONDS", "30"))
+
+# /readyz pings the database at most this often; probes in between reuse the result
+READY_PING_SECONDS = float(os.getenv("READY_PING_SECONDS", "5"))
+
+
+class Warmup:
+    """
+    Per-worker warmup run from the app lifespan.
+
+    Fills the connection pool(s), reads the cache versions and precomputes
+    the catalog reports (BOM graph based) and name indexes, so the first
+    real requests after a deploy do not pay for them. Runs in a background
+    thread and retries until the database answers; /readyz reports
+    "warming" until it has finished.
+    """
+
+    def __init__(self):
+        self.state = "pending"
+        self.error = None
+        self.attempts = 0
+        self.seconds = None
+        self.steps = {}
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._last_ping = (0.0, None)
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def start(self):
+        self.state = "warming"
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        started = time.monotonic()
+        delay = 0.5
+
+        while not self._stopping.is_set():
+            self.attempts += 1
+            try:
+                self._warm()
+                self.state = "ready"
+                self.error = None
+                self.seconds = round(time.monotonic() - started, 3)
+                logger.info("Worker warm after %.2fs: %s", self.seconds, self.steps)
+                return
+            except Exception as e:
+                self.error = str(e)
+                logger.warning("Warmup attempt %d failed: %s", self.attempts, e)
+
+            self._stopping.wait(delay)
+            delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+
+    def _step(self, name, fn, *args):
+        started = time.monotonic()
+        fn(*args)
+        self.steps[name] = round(time.monotonic() - started, 3)
+
+    def _warm(self):
+        self._step("pool", _fill_pool, engine)
+        if read_engine is not None:
+            self._step("read_pool", _fill_pool, read_engine)
+
+        self._step("cache_versions", poll_versions, True)
+
+        db = SessionLocal()
+        try:
+            # Same report keys as the endpoints, so their first call is a cache hit
+            self._step("capacity", report_cache.get_or_compute, "capacity", crud_products.calculate_production_capacity, db)
+            self._step("procurement", report_cache.get_or_compute, "procurement", crud_procurement.calculate_procurement_needs, db)
+            self._step("dashboard", report_cache.get_or_compute, "dashboard", crud_dashboard.get_dashboard, db)
+            self._step("name_index", lambda: [name_index.get_index(model) for model in (Component, Product)])
+        finally:
+            db.close()
+
+    def ping(self):
+        """
+        (ok, error) for a `SELECT 1` on the primary, rate limited to one real
+        query per READY_PING_SECONDS.
+        """
+        with self._lock:
+            checked_at, result = self._last_ping
+            if result is not None and time.monotonic() - checked_at < READY_PING_SECONDS:
+                return result
+
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            result = (True, None)
+        except Exception as e:
+            result = (False, str(e))
+
+        with self._lock:
+            self._last_ping = (time.monotonic(), result)
+
+        return result
+
+    def report(self):
+        return {
+            "state": self.state,
+            "attempts": self.attempts,
+            "seconds": self.seconds,
+            "steps": dict(self.steps),
+            "error": self.error
+        }
+
+
+def _fill_pool(target_engine):
+    pool = target_engine.pool
+    size = WARMUP_CONNECTIONS or getattr(pool, "size", lambda: 1)()
+    connections = []
+
+    # Hold them all at once so the pool really opens `size` connections
+    try:
+        for _ in range(size):
+            conn = target_engine.connect()
+            connections.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def pool_status(target_engine):
+    """Connection counts from the pool itself (no query)."""
+    pool = target_engine.pool
+    status = {"class": type(pool).__name__}
+
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if method is not None:
+            status[name] = method()
+
+    return status
+
+
+warmup = Warmup()
@@ -10,8 +10,23 @@ const apiClient = axios.create({
   },
 });
 
+// Time of our last write, echoed back so our reads skip a lagging read replica
+let lastWrite = null;
+
+apiClient.interceptors.request.use((config) => {
+  if (lastWrite) {
+    config.headers['X-Last-Write'] = lastWrite;
+  }
+  return config;
+});
+
 apiClient.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    if (response.headers['x-last-write']) {
+      lastWrite = response.headers['x-last-write'];
+    }
+    return response;
+  },
   (error) => {
     console.error('API Error:', error.response?.data || error.message);
     return Promise.reject(error);
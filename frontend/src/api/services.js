@@ -1,10 +1,13 @@
 import apiClient from './client';
 
+// Pass the version the user started editing from; the API answers 412 if someone changed it since
+const ifMatch = (version) => (version ? { headers: { 'If-Match': `"${version}"` } } : undefined);
+
 // Components
 export const getComponents = () => apiClient.get('/components');
 export const getComponent = (id) => apiClient.get(`/components/${id}`);
 export const createComponent = (data) => apiClient.post('/components', data);
-export const updateComponent = (id, data) => apiClient.put(`/components/${id}`, data);
+export const updateComponent = (id, data, version) => apiClient.put(`/components/${id}`, data, ifMatch(version));
 export const deleteComponent = (id) => apiClient.delete(`/components/${id}`);
 export const adjustStock = (id, adjustment) => apiClient.patch(`/components/${id}/adjust-stock?adjustment=${adjustment}`);
 
@@ -12,10 +15,10 @@ export const adjustStock = (id, adjustment) => apiClient.patch(`/components/${id
 export const getProducts = () => apiClient.get('/products');
 export const getProduct = (id) => apiClient.get(`/products/${id}`);
 export const createProduct = (data) => apiClient.post('/products', data);
-export const updateProduct = (id, data) => apiClient.put(`/products/${id}`, data);
+export const updateProduct = (id, data, version) => apiClient.put(`/products/${id}`, data, ifMatch(version));
 export const deleteProduct = (id) => apiClient.delete(`/products/${id}`);
-export const updateProductBOM = (id, component_bom, product_bom) => 
-  apiClient.put(`/products/${id}/bom`, { component_bom, product_bom });
+export const updateProductBOM = (id, component_bom, product_bom, version) => 
+  apiClient.put(`/products/${id}/bom`, { component_bom, product_bom }, ifMatch(version));
 export const getProductionCapacity = () => apiClient.get('/products/capacity/calculate');
 
 // Orders
@@ -27,4 +30,6 @@ export const allocateOrder = (id) => apiClient.post(`/orders/${id}/allocate`);
 export const getOrderRequirements = (id) => apiClient.get(`/orders/${id}/requirements`);
 
 // Procurement
-export const getProcurementNeeds = () => apiClient.get('/procurement/needs');
\ No newline at end of file
+export const getProcurementNeeds = () => apiClient.get('/procurement/needs');
+// Dashboard
+export const getDashboard = () => apiClient.get('/dashboard');
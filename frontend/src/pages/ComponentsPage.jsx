@@ -186,7 +186,7 @@ function ComponentForm({ component, onClose, onSave }) {
         await updateComponent(component.id, {
           name: formData.name,
           spillage_coefficient: formData.spillage_coefficient,
-        });
+        }, component.version);
       } else {
         await createComponent(formData);
       }
@@ -1,17 +1,75 @@
+import { useState, useEffect } from 'react';
+import { getDashboard } from '../api/services';
+
 function Dashboard() {
+  const [dashboard, setDashboard] = useState(null);
+  const [loading, setLoading] = useState(true);
+  const [error, setError] = useState(null);
+
+  useEffect(() => {
+    loadDashboard();
+  }, []);
+
+  const loadDashboard = async () => {
+    try {
+      setLoading(true);
+      const response = await getDashboard();
+      setDashboard(response.data);
+      setError(null);
+    } catch (err) {
+      setError(err.response?.data?.detail || 'Failed to load dashboard');
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  const components = dashboard?.components || [];
+  const capacity = dashboard?.capacity || [];
+  const orders = dashboard?.orders;
+  const procurement = dashboard?.procurement;
+
+  const totalInStock = components.reduce((sum, c) => sum + c.in_stock, 0);
+  const buildableProducts = capacity.filter((p) => p.max_producible > 0).length;
+
   return (
     <div>
       <div className="page-header">
         <h2>Dashboard</h2>
         <p>Overview of your production system</p>
       </div>
-      
-      <div className="card">
-        <h3>Welcome to Stock Management System</h3>
-        <p>Use the navigation above to manage components, products, inventory, orders, and procurement.</p>
-      </div>
+
+      {error && <div className="error">{error}</div>}
+
+      {loading ? (
+        <div className="loading">Loading dashboard...</div>
+      ) : dashboard && (
+        <div className="card">
+          <div style={{ display: 'grid', gridTemplateColumns: 'repeat(4, 1fr)', gap: '1rem' }}>
+            <div style={{ padding: '1rem', backgroundColor: '#e8f5e9', borderRadius: '8px', textAlign: 'center' }}>
+              <h4 style={{ color: '#27ae60', marginBottom: '0.5rem' }}>Components In Stock</h4>
+              <p style={{ fontSize: '2rem', fontWeight: 'bold', color: '#27ae60' }}>{totalInStock}</p>
+            </div>
+            <div style={{ padding: '1rem', backgroundColor: '#e3f2fd', borderRadius: '8px', textAlign: 'center' }}>
+              <h4 style={{ color: '#3498db', marginBottom: '0.5rem' }}>Buildable Products</h4>
+              <p style={{ fontSize: '2rem', fontWeight: 'bold', color: '#3498db' }}>
+                {buildableProducts} / {capacity.length}
+              </p>
+            </div>
+            <div style={{ padding: '1rem', backgroundColor: '#fff3e0', borderRadius: '8px', textAlign: 'center' }}>
+              <h4 style={{ color: '#f39c12', marginBottom: '0.5rem' }}>Open Orders</h4>
+              <p style={{ fontSize: '2rem', fontWeight: 'bold', color: '#f39c12' }}>
+                {orders.pending + orders.in_progress}
+              </p>
+            </div>
+            <div style={{ padding: '1rem', backgroundColor: '#ffebee', borderRadius: '8px', textAlign: 'center' }}>
+              <h4 style={{ color: '#e74c3c', marginBottom: '0.5rem' }}>Components to Order</h4>
+              <p style={{ fontSize: '2rem', fontWeight: 'bold', color: '#e74c3c' }}>{procurement.total_items}</p>
+            </div>
+          </div>
+        </div>
+      )}
     </div>
   );
 }
 
-export default Dashboard;
\ No newline at end of file
+export default Dashboard;
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { getComponents, getProductionCapacity } from '../api/services';
+import { getDashboard } from '../api/services';
 
 function InventoryPage() {
   const [view, setView] = useState('components'); // 'components' or 'products'
@@ -10,18 +10,15 @@ function InventoryPage() {
 
   useEffect(() => {
     loadData();
-  }, [view]);
+  }, []);
 
+  // Both views come from the one dashboard call; switching views does not refetch
   const loadData = async () => {
     try {
       setLoading(true);
-      if (view === 'components') {
-        const response = await getComponents();
-        setComponents(response.data);
-      } else {
-        const response = await getProductionCapacity();
-        setProductCapacity(response.data);
-      }
+      const response = await getDashboard();
+      setComponents(response.data.components);
+      setProductCapacity(response.data.capacity);
       setError(null);
     } catch (err) {
       setError(err.response?.data?.detail || 'Failed to load inventory data');
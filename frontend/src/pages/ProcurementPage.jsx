@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { getProcurementNeeds, adjustStock } from '../api/services';
+import { getDashboard, adjustStock } from '../api/services';
 
 function ProcurementPage() {
   const [procurementData, setProcurementData] = useState(null);
@@ -15,8 +15,8 @@ function ProcurementPage() {
   const loadProcurementNeeds = async () => {
     try {
       setLoading(true);
-      const response = await getProcurementNeeds();
-      setProcurementData(response.data);
+      const response = await getDashboard();
+      setProcurementData(response.data.procurement);
       setError(null);
     } catch (err) {
       setError(err.response?.data?.detail || 'Failed to load procurement needs');
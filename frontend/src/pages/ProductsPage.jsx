@@ -121,6 +121,7 @@ function ProductsPage() {
             <thead>
               <tr>
                 <th>Name</th>
+                <th>In Stock</th>
                 <th>In Progress</th>
                 <th>Shipped</th>
                 <th>Actions</th>
@@ -130,6 +131,7 @@ function ProductsPage() {
               {products.map((product) => (
                 <tr key={product.id}>
                   <td><strong>{product.name}</strong></td>
+                  <td>{product.in_stock}</td>
                   <td>{product.in_progress}</td>
                   <td>{product.shipped}</td>
                   <td>
@@ -281,8 +283,8 @@ function ProductForm({ product, onClose, onSave }) {
 
     try {
       if (product) {
-        await updateProduct(product.id, { name: formData.name });
-        await updateProductBOM(product.id, formData.component_bom, formData.product_bom);
+        const updated = await updateProduct(product.id, { name: formData.name }, product.version);
+        await updateProductBOM(product.id, formData.component_bom, formData.product_bom, updated.data.version);
       } else {
         await createProduct(formData);
       }
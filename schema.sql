@@ -1,11 +1,23 @@
 -- Disable FK checks for clean reset
 SET FOREIGN_KEY_CHECKS = 0;
 
+DROP TABLE IF EXISTS report_jobs;
+DROP TABLE IF EXISTS idempotency_keys;
+DROP TABLE IF EXISTS cache_versions;
+DROP TABLE IF EXISTS deleted_entities;
+DROP TABLE IF EXISTS archive_stats;
+DROP TABLE IF EXISTS archived_order_product_allocations;
+DROP TABLE IF EXISTS archived_order_allocations;
+DROP TABLE IF EXISTS archived_orders;
+DROP TABLE IF EXISTS order_product_allocations;
 DROP TABLE IF EXISTS order_allocations;
 DROP TABLE IF EXISTS orders;
 DROP TABLE IF EXISTS bill_of_materials;
 DROP TABLE IF EXISTS product_bom;
 DROP TABLE IF EXISTS products;
+DROP TABLE IF EXISTS component_locations;
+DROP TABLE IF EXISTS locations;
+DROP TABLE IF EXISTS component_stock_slots;
 DROP TABLE IF EXISTS components;
 
 SET FOREIGN_KEY_CHECKS = 1;
@@ -19,21 +31,64 @@ CREATE TABLE components (
     in_stock INT DEFAULT 0,
     in_progress INT DEFAULT 0,
     shipped INT DEFAULT 0,
+    stock_slots INT NOT NULL DEFAULT 0,
+    version INT NOT NULL DEFAULT 1,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     CHECK (spillage_coefficient >= 0 AND spillage_coefficient <= 9.9999),
-    CHECK (in_stock >= 0 AND in_progress >= 0 AND shipped >= 0)
+    CHECK (in_stock >= 0 AND in_progress >= 0 AND shipped >= 0),
+    INDEX idx_components_updated_at (updated_at, id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Component Stock Slots Table (sharded counters for hot components)
+CREATE TABLE component_stock_slots (
+    component_id INT NOT NULL,
+    slot INT NOT NULL,
+    in_stock INT NOT NULL DEFAULT 0,
+    in_progress INT NOT NULL DEFAULT 0,
+    shipped INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (component_id, slot),
+    FOREIGN KEY (component_id) REFERENCES components(id) ON DELETE CASCADE,
+    CHECK (in_stock >= 0 AND in_progress >= 0 AND shipped >= 0),
+    INDEX idx_component_stock_slots_updated_at (updated_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Locations Table (warehouses / sites)
+CREATE TABLE locations (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(255) UNIQUE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Component Locations Table (per-site stock, counted in the component totals)
+CREATE TABLE component_locations (
+    component_id INT NOT NULL,
+    location_id INT NOT NULL,
+    in_stock INT NOT NULL DEFAULT 0,
+    in_progress INT NOT NULL DEFAULT 0,
+    shipped INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (component_id, location_id),
+    FOREIGN KEY (component_id) REFERENCES components(id) ON DELETE CASCADE,
+    FOREIGN KEY (location_id) REFERENCES locations(id) ON DELETE RESTRICT,
+    CHECK (in_stock >= 0 AND in_progress >= 0 AND shipped >= 0),
+    INDEX idx_component_locations_location (location_id),
+    INDEX idx_component_locations_updated_at (updated_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Products Table
 CREATE TABLE products (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(255) UNIQUE NOT NULL,
+    in_stock INT NOT NULL DEFAULT 0,
     in_progress INT DEFAULT 0,
     shipped INT DEFAULT 0,
+    version INT NOT NULL DEFAULT 1,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    CHECK (in_progress >= 0 AND shipped >= 0)
+    CHECK (in_stock >= 0 AND in_progress >= 0 AND shipped >= 0),
+    INDEX idx_products_updated_at (updated_at, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Product_bom table for nested products
@@ -46,7 +101,8 @@ CREATE TABLE product_bom (
     FOREIGN KEY (parent_product_id) REFERENCES products(id) ON DELETE CASCADE,
     FOREIGN KEY (child_product_id) REFERENCES products(id) ON DELETE RESTRICT,
     CHECK (quantity_required > 0),
-    CHECK (parent_product_id != child_product_id)
+    CHECK (parent_product_id != child_product_id),
+    INDEX idx_product_bom_child_product_id (child_product_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Bill of Materials Table
@@ -58,7 +114,8 @@ CREATE TABLE bill_of_materials (
     UNIQUE KEY unique_product_component (product_id, component_id),
     FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
     FOREIGN KEY (component_id) REFERENCES components(id) ON DELETE RESTRICT,
-    CHECK (quantity_required > 0)
+    CHECK (quantity_required > 0),
+    INDEX idx_bill_of_materials_component_id (component_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Orders Table
@@ -69,8 +126,19 @@ CREATE TABLE orders (
     status ENUM('pending', 'in_progress', 'completed') DEFAULT 'pending',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     completed_at TIMESTAMP NULL,
+    status_changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    parent_order_id INT NULL,
+    location_id INT NULL,
+    to_stock BOOLEAN NOT NULL DEFAULT FALSE,
     FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE RESTRICT,
-    CHECK (quantity > 0)
+    FOREIGN KEY (parent_order_id) REFERENCES orders(id) ON DELETE SET NULL,
+    FOREIGN KEY (location_id) REFERENCES locations(id) ON DELETE RESTRICT,
+    CHECK (quantity > 0),
+    INDEX idx_orders_status_changed_at (status_changed_at, id),
+    INDEX idx_orders_status_created_at (status, created_at),
+    INDEX idx_orders_status_completed_at (status, completed_at),
+    INDEX idx_orders_product_id (product_id),
+    INDEX idx_orders_parent_order_id (parent_order_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Order Allocations Table
@@ -79,9 +147,134 @@ CREATE TABLE order_allocations (
     order_id INT NOT NULL,
     component_id INT NOT NULL,
     quantity_allocated INT NOT NULL,
+    location_id INT NULL,
     FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
     FOREIGN KEY (component_id) REFERENCES components(id),
-    CHECK (quantity_allocated > 0)
+    FOREIGN KEY (location_id) REFERENCES locations(id) ON DELETE RESTRICT,
+    CHECK (quantity_allocated > 0),
+    INDEX idx_order_allocations_order_id (order_id),
+    INDEX idx_order_allocations_component_id (component_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Order Product Allocations Table (finished subassemblies taken from products.in_stock)
+CREATE TABLE order_product_allocations (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    order_id INT NOT NULL,
+    product_id INT NOT NULL,
+    quantity_allocated INT NOT NULL,
+    FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE RESTRICT,
+    CHECK (quantity_allocated > 0),
+    INDEX idx_order_product_allocations_order_id (order_id),
+    INDEX idx_order_product_allocations_product_id (product_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Archived Orders Table (completed orders moved out of orders by archive.py)
+CREATE TABLE archived_orders (
+    id INT PRIMARY KEY,
+    product_id INT NOT NULL,
+    quantity INT NOT NULL,
+    status ENUM('pending', 'in_progress', 'completed') NOT NULL,
+    created_at TIMESTAMP NULL,
+    completed_at TIMESTAMP NULL,
+    status_changed_at TIMESTAMP NULL,
+    parent_order_id INT NULL,
+    location_id INT NULL,
+    to_stock BOOLEAN NOT NULL DEFAULT FALSE,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE RESTRICT,
+    FOREIGN KEY (location_id) REFERENCES locations(id) ON DELETE RESTRICT,
+    INDEX idx_archived_orders_parent_order_id (parent_order_id),
+    INDEX idx_archived_orders_product_id (product_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Archived Order Allocations Table
+CREATE TABLE archived_order_allocations (
+    id INT PRIMARY KEY,
+    order_id INT NOT NULL,
+    component_id INT NOT NULL,
+    quantity_allocated INT NOT NULL,
+    location_id INT NULL,
+    FOREIGN KEY (order_id) REFERENCES archived_orders(id) ON DELETE CASCADE,
+    FOREIGN KEY (component_id) REFERENCES components(id),
+    FOREIGN KEY (location_id) REFERENCES locations(id) ON DELETE RESTRICT,
+    INDEX idx_archived_order_allocations_order_id (order_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Archived Order Product Allocations Table
+CREATE TABLE archived_order_product_allocations (
+    id INT PRIMARY KEY,
+    order_id INT NOT NULL,
+    product_id INT NOT NULL,
+    quantity_allocated INT NOT NULL,
+    FOREIGN KEY (order_id) REFERENCES archived_orders(id) ON DELETE CASCADE,
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE RESTRICT,
+    INDEX idx_archived_order_product_allocations_order_id (order_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Archive Stats Table (running totals of archived rows)
+CREATE TABLE archive_stats (
+    table_name VARCHAR(64) PRIMARY KEY,
+    rows_archived BIGINT NOT NULL DEFAULT 0,
+    last_archived_at TIMESTAMP NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT INTO archive_stats (table_name, rows_archived) VALUES
+('orders', 0),
+('order_allocations', 0),
+('order_product_allocations', 0);
+
+-- Deleted Entities Table (tombstones for delta sync)
+CREATE TABLE deleted_entities (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    entity_type VARCHAR(32) NOT NULL,
+    entity_id INT NOT NULL,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_deleted_entities_type_time (entity_type, deleted_at),
+    -- Since-queries without a type filter cannot use the index above
+    INDEX idx_deleted_entities_time (deleted_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Cache Versions Table (cross-worker cache invalidation, one row per entity group)
+CREATE TABLE cache_versions (
+    entity_group VARCHAR(32) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT INTO cache_versions (entity_group, version) VALUES
+('components', 0),
+('products', 0),
+('orders', 0),
+('catalog', 0);
+
+-- Idempotency Keys Table (stored responses for retried POST /orders and stock adjustments)
+CREATE TABLE idempotency_keys (
+    scope VARCHAR(64) NOT NULL,
+    idempotency_key VARCHAR(128) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code INT NULL,
+    response_body MEDIUMTEXT NULL,
+    created_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, idempotency_key),
+    INDEX idx_idempotency_keys_expires_at (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Report Jobs Table (background report runs, see jobs.py)
+CREATE TABLE report_jobs (
+    id CHAR(32) PRIMARY KEY,
+    dedupe_key CHAR(64) NOT NULL,
+    report VARCHAR(32) NOT NULL,
+    params TEXT NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    result MEDIUMTEXT NULL,
+    error TEXT NULL,
+    created_at TIMESTAMP NOT NULL,
+    started_at TIMESTAMP NULL,
+    finished_at TIMESTAMP NULL,
+    expires_at TIMESTAMP NULL,
+    UNIQUE KEY unique_report_jobs_dedupe_key (dedupe_key),
+    INDEX idx_report_jobs_expires_at (expires_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Seed Data: Components